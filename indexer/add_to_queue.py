@@ -1,30 +1,119 @@
 #!/usr/bin/env python3
 
 from argparse import ArgumentParser
+import os
 from pprint import pprint
 import re
-from tasks import process_path
+from time import sleep
+
+from celery import chord
+
+from multistream import index_path_for, read_index, split_ranges
+import scheduler
+from tasks import connect, process_path, process_range, merge_results
+from wp_search_tools.utils.indices import BulkLoad
 
 
 def main():
     parser = ArgumentParser()
     parser.add_argument('path',
-                        help='dump file to index')
+                        help='''dump file to index, or a directory or glob pattern matching
+                        several, which are queued largest first''')
+    parser.add_argument('--pattern', default='*.xml*',
+                        help='''files to index when path is a directory
+                        (default %(default)s)''')
+    parser.add_argument('--max-in-flight', type=int, default=4, metavar='N',
+                        help='''with several files, the maximum number of tasks queued
+                        or running at once (default %(default)s)''')
     parser.add_argument('--dry-run', action='store_true',
                         help="don't insert revisions into elasticsearch")
+    parser.add_argument('--split', type=int, metavar='N',
+                        help='''split a multistream dump into N page-aligned chunks,
+                        each processed by its own task (requires the multistream index)''')
+    parser.add_argument('--incremental', action='store_true',
+                        help="skip revisions which are already in the index's revision table")
+    parser.add_argument('--bulk-load', action='store_true',
+                        help='''put the index into bulk-load mode (no refreshes or replicas)
+                        while the file is processed, and force-merge it afterwards''')
     args = parser.parse_args()
 
-    m = re.search(r'-p(\d*)p(\d*)', args.path)
-    if not m:
-        print(f"Can't find page numbers in {args.path}")
+    if args.bulk_load and not args.dry_run:
+        es, index_name = connect()
+        with BulkLoad(es, index_name):
+            return enqueue(args)
+    return enqueue(args)
+
+
+def enqueue(args):
+    if os.path.isdir(args.path) or scheduler.is_pattern(args.path):
+        if args.split:
+            print("--split can't be used with several files")
+            return -1
+        return enqueue_many(args)
+
+    if args.split:
+        return split(args)
+
+    pprint(f'Processing {args.path}')
+    result = process_path.delay(args.path, expected_pages(args.path), args.dry_run,
+                                args.incremental)
+    wait(result)
+    print(result.get())
+
+
+def expected_pages(path):
+    # Progress is measured by how much of the file has been read, but
+    # the page range in the file name (if any) makes a useful fallback.
+    m = re.search(r'-p(\d+)p(\d+)', path)
+    return int(m[2]) - int(m[1]) + 1 if m else None
+
+
+def enqueue_many(args):
+    files = scheduler.find_dumps(args.path, args.pattern)
+    if not files:
+        print(f'No files match {args.path}')
         return -1
-    p1 = int(m[1])
-    p2 = int(m[2])
-    count = p2 - p1 + 1
+    pprint(f'Processing {len(files)} files, {sum(size for size, _ in files)} bytes')
 
-    pprint(f'Processing {args.path} with {count} expected pages')
-    result = process_path.delay(args.path, count, args.dry_run)
+    def submit(path):
+        return process_path.delay(path, expected_pages(path), args.dry_run, args.incremental)
+
+    def report(path, value):
+        print(f'{path}: {value}')
+
+    summary = scheduler.run([path for _, path in files], submit,
+                            max_in_flight=args.max_in_flight, report=report)
+    pprint(summary)
+    if summary['errors']:
+        return 1
+
+
+def wait(result, interval=10):
+    """Wait for result to be ready, printing its progress reports.
+
+    """
+    while not result.ready():
+        if result.state == 'PROGRESS':
+            info = result.info
+            print(f"{info.get('pages', 0)} pages, {info.get('revisions', 0)} revisions "
+                  f"({info.get('revisions_per_second', 0.0)}/s), "
+                  f"{info['percent']}% done, ETA {info['eta_seconds']} seconds")
+        sleep(interval)
+
+
+def split(args):
+    index_path = index_path_for(args.path)
+    if not (index_path and os.path.exists(index_path)):
+        print(f"Can't find multistream index for {args.path}")
+        return -1
+    ranges = split_ranges(read_index(index_path), os.path.getsize(args.path), args.split)
+
+    pprint(f'Processing {args.path} in {len(ranges)} chunks')
+    subtasks = [process_range.s(args.path, start, end, args.dry_run, args.incremental)
+                for start, end, _ in ranges]
+    result = chord(subtasks)(merge_results.s())
     print(result.get())
 
+
 if __name__ == '__main__':
     main()
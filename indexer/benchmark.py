@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+"""Benchmark the dump parsers on a synthetic dump.
+
+Generates a dump with synthetic_dump.DumpGenerator, then runs each
+parser path over it in a fresh process and records:
+
+  revisions_per_second
+  mb_per_second: input file bytes (as stored on disk) per second
+  peak_rss_mb: peak resident set size of the process doing the parsing
+
+Results are written as JSON, along with the git commit and the
+generator parameters, so runs can be compared across commits:
+
+  benchmark.py --pages 2000 --revisions 20 --bz2 --output bench.json
+
+With --profile, each result also has the time spent in each stage
+(see utils/profiling.py).  This adds some overhead of its own.
+
+"""
+
+from argparse import ArgumentParser
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+from tempfile import TemporaryDirectory
+from time import perf_counter, process_time
+
+from wp_search_tools.indexer.dump_file import PagesDumpFile
+from wp_search_tools.indexer.multistream import MultistreamDumpFile
+from wp_search_tools.indexer.revision_cache import RevisionCacheFile, write_cache
+from wp_search_tools.indexer.synthetic_dump import DumpGenerator
+from wp_search_tools.utils.profiling import NULL_TIMER, StageTimer
+
+logger = logging.getLogger('wp_search_tools.benchmark')
+
+PARSERS = ('iterparse', 'pulldom', 'multistream', 'revcache')
+
+
+def make_dump_file(parser, timer=NULL_TIMER):
+    if parser == 'multistream':
+        return MultistreamDumpFile(timer=timer)
+    if parser == 'revcache':
+        return RevisionCacheFile(timer=timer)
+    return PagesDumpFile(backend=parser, timer=timer)
+
+
+def _run(parser, path, queue, profile=False):
+    """Runs in a child process, so peak RSS is measured for this parser
+    alone.
+
+    """
+    timer = StageTimer() if profile else NULL_TIMER
+    df = make_dump_file(parser, timer)
+    wall = perf_counter()
+    cpu = process_time()
+    for _ in df.process(path):
+        pass
+    wall = perf_counter() - wall
+    cpu = process_time() - cpu
+    # ru_maxrss is in kilobytes on Linux.
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    queue.put({'pages': df.pages,
+               'revisions': df.revisions,
+               'seconds': wall,
+               'cpu_seconds': cpu,
+               'peak_rss_mb': max(usage.ru_maxrss, children.ru_maxrss) / 1024,
+               'stages': timer.report(),
+               })
+
+
+def measure(parser, path, repeat=1, profile=False):
+    """Parses path with parser, repeat times, each in a new process.
+    Returns a dict of results from the fastest run.
+
+    """
+    context = multiprocessing.get_context('spawn')
+    runs = []
+    for _ in range(repeat):
+        queue = context.Queue()
+        process = context.Process(target=_run, args=(parser, path, queue, profile))
+        process.start()
+        result = queue.get()
+        process.join()
+        runs.append(result)
+    best = min(runs, key=lambda r: r['seconds'])
+    size = os.path.getsize(path)
+    best.update(parser=parser,
+                input_bytes=size,
+                revisions_per_second=best['revisions'] / best['seconds'],
+                mb_per_second=size / best['seconds'] / 1e6,
+                peak_rss_mb=max(r['peak_rss_mb'] for r in runs))
+    return best
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'],
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              check=True, universal_newlines=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = ArgumentParser(description='Benchmark the dump parsers')
+    parser.add_argument('--pages', type=int, default=500,
+                        help='number of pages (default %(default)s)')
+    parser.add_argument('--revisions', type=int, default=20,
+                        help='revisions per page (default %(default)s)')
+    parser.add_argument('--text-size', type=int, default=4000,
+                        help='characters of text per revision (default %(default)s)')
+    parser.add_argument('--ip-fraction', type=float, default=0.2,
+                        help='fraction of IP contributors (default %(default)s)')
+    parser.add_argument('--deleted-fraction', type=float, default=0.02,
+                        help='fraction of deleted comments (default %(default)s)')
+    parser.add_argument('--bz2', action='store_true',
+                        help='bz2 compress the dump')
+    parser.add_argument('--parsers', nargs='+', choices=PARSERS, default=list(PARSERS),
+                        help='parser paths to measure (default: all)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per parser; the fastest is reported (default %(default)s)')
+    parser.add_argument('--profile', action='store_true',
+                        help='record the time spent in each stage')
+    parser.add_argument('--output', '-o',
+                        help='file to write JSON results to (default: stdout)')
+    args = parser.parse_args()
+
+    params = {'pages': args.pages,
+              'revisions': args.revisions,
+              'text_size': args.text_size,
+              'ip_fraction': args.ip_fraction,
+              'deleted_fraction': args.deleted_fraction,
+              'bz2': args.bz2,
+              }
+    generator = DumpGenerator(pages=args.pages,
+                              revisions=args.revisions,
+                              text_size=args.text_size,
+                              ip_fraction=args.ip_fraction,
+                              deleted_fraction=args.deleted_fraction)
+    results = []
+    with TemporaryDirectory() as tmp:
+        suffix = '.xml.bz2' if args.bz2 else '.xml'
+        dump_path = os.path.join(tmp, 'synthwiki-pages-meta-history' + suffix)
+        generator.write(dump_path, compress=args.bz2)
+        paths = {parser: dump_path for parser in PARSERS}
+        if 'multistream' in args.parsers:
+            paths['multistream'] = os.path.join(tmp, 'synthwiki-pages-articles-multistream.xml.bz2')
+            generator.write_multistream(paths['multistream'],
+                                        os.path.join(tmp, 'synthwiki-pages-articles-multistream-index.txt.bz2'))
+        if 'revcache' in args.parsers:
+            paths['revcache'] = os.path.join(tmp, 'synthwiki.revcache')
+            write_cache(PagesDumpFile().process(dump_path), paths['revcache'])
+
+        for name in args.parsers:
+            logger.info('Measuring %s', name)
+            result = measure(name, paths[name], args.repeat, args.profile)
+            logger.info('%s: %.0f revisions/s, %.1f MB/s, %.0f MB peak RSS', name,
+                        result['revisions_per_second'], result['mb_per_second'], result['peak_rss_mb'])
+            results.append(result)
+
+    report = {'commit': git_commit(),
+              'python': sys.version.split()[0],
+              'platform': platform.platform(),
+              'cpus': os.cpu_count(),
+              'params': params,
+              'results': results,
+              }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""Checkpoints for resuming interrupted indexing runs.
+
+A checkpoint records the id of the last page whose revisions have all
+been acknowledged by elasticsearch.  Dumps are sorted by page id, so a
+rerun can skip every page up to and including that one.  Because
+revisions are indexed with their rev_id as the document _id, anything
+re-sent after the checkpoint simply overwrites the earlier copy.
+
+"""
+
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+logger = logging.getLogger('wp_search_tools.tasks')
+
+
+class Checkpoint:
+    """A small JSON file in directory, holding the progress of one job.
+
+    The job is identified by key, which should include everything that
+    makes one run different from another (dump path, byte range, index
+    name...).
+
+    """
+    def __init__(self, directory, *key):
+        self.key = ':'.join(str(k) for k in key)
+        digest = hashlib.sha1(self.key.encode('utf-8')).hexdigest()[:16]
+        self.path = Path(directory) / f'{digest}.json'
+
+
+    def load(self):
+        """Returns the saved state as a dict, or None if there is no
+        checkpoint.
+
+        """
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return None
+        if state.get('key') != self.key:
+            logger.warning('Ignoring checkpoint %s, which belongs to "%s"', self.path, state.get('key'))
+            return None
+        return state
+
+
+    def save(self, **state):
+        """Atomically replaces the checkpoint with state.
+
+        """
+        state['key'] = self.key
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+    def clear(self):
+        """Removes the checkpoint, if there is one.
+
+        """
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class Progress:
+    """Advances a Checkpoint, and a RevisionTable, as revisions are
+    acknowledged, but never past a revision which failed to index.
+
+    sent() is called with each revision's page and rev ids as it is
+    handed to the indexer, and commit() once all of those have been
+    acknowledged, with the _ids (rev_ids) of the ones which failed.
+
+    Once anything has failed, the checkpoint stays where it was before
+    the failure, and finish() leaves it in place (instead of clearing
+    it), so a rerun resumes from there and sends the failed revisions
+    again.  The number of failed revisions is in failures, and the ids
+    of their pages in failed_pages.
+
+    The table is updated by each commit() with the highest rev_id sent
+    for each page, except the pages in failed_pages, so an incremental
+    run doesn't skip their failed revisions.
+
+    """
+    def __init__(self, checkpoint=None, table=None):
+        self.checkpoint = checkpoint
+        self.table = table
+        self.failures = 0
+        self.failed_pages = set()
+        # page_id of each rev_id sent since the last commit().
+        self._pages = {}
+        # Highest rev_id per page sent since the last commit().
+        self._sent = {}
+
+
+    def sent(self, page_id, rev_id):
+        if self.checkpoint or self.table is not None:
+            self._pages[rev_id] = page_id
+        if self.table is not None and rev_id > self._sent.get(page_id, 0):
+            self._sent[page_id] = rev_id
+
+
+    def commit(self, failed_ids=(), **state):
+        """Records the failures among the revisions sent since the last
+        commit(), and then, if nothing has failed yet, saves state (if
+        given) in the checkpoint.
+
+        """
+        for doc_id in failed_ids:
+            self.failures += 1
+            page_id = self._pages.get(int(doc_id)) if doc_id is not None else None
+            if page_id is not None:
+                self.failed_pages.add(page_id)
+        self._pages.clear()
+        if self.table is not None:
+            for page_id, rev_id in self._sent.items():
+                if page_id not in self.failed_pages:
+                    self.table.update(page_id, rev_id)
+            self.table.flush()
+            self._sent.clear()
+        if self.checkpoint and state and not self.failures:
+            self.checkpoint.save(**state)
+
+
+    def finish(self, failed_ids=()):
+        """Like commit(), for the end of the run: clears the checkpoint
+        if nothing has failed.
+
+        """
+        self.commit(failed_ids)
+        if not self.checkpoint:
+            return
+        if self.failures:
+            logger.warning('Keeping checkpoint %s: %d revisions of %d pages failed to index',
+                           self.checkpoint.path, self.failures, len(self.failed_pages))
+        else:
+            self.checkpoint.clear()
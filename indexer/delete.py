@@ -1,22 +1,15 @@
 #!/usr/bin/env python3
 
-from configparser import ConfigParser
 import os
 from pathlib import Path
 
-from opensearchpy import OpenSearch
+from wp_search_tools.utils.client import get_client, read_config
 
 
-config = ConfigParser()
-config.read(Path.home() / '.elasticsearch.ini')
-config.read(Path(os.environ['SEARCH_TOOLS']) / 'wp_search_tools/indexer/config.ini')
-
-user = config.get('elasticsearch', 'user')
-password = config.get('elasticsearch', 'password')
-server = config.get('elasticsearch', 'server')
+config = read_config(Path(os.environ['SEARCH_TOOLS']) / 'wp_search_tools/indexer/config.ini')
 index_name = config.get('elasticsearch', 'index')
 
-es = OpenSearch(server, http_auth=(user, password))
+es = get_client(config)
 
 # This is dangerous.  Don't do this unless you really are sure you want
 # to drop the index, potentially destroying a large amount of work.
@@ -11,86 +11,540 @@ meta.wikimedia.org/wiki/Data_dumps/Dump_format for details.
 
 """
 
-import bz2
-import dataclasses
+from array import array
+import io
 import logging
+import os
+from typing import NamedTuple
 from xml.dom import pulldom
+from xml.etree import ElementTree
+
+from wp_search_tools.indexer.openers import open_dump
+from wp_search_tools.indexer.text_filter import TextFilter
+from wp_search_tools.utils.profiling import NULL_TIMER
 
 logger = logging.getLogger('wp_search_tools.tasks')
 
-@dataclasses.dataclass(frozen=True)
-class RevisionData:
+# Number of characters (or bytes) read from the input stream per call to
+# feed() in the iterparse backend.
+CHUNK_SIZE = 1024 * 1024
+
+# Default number of usernames kept in each generation of a UserInterner.
+USER_CACHE_SIZE = 65536
+
+# Stands for None (a deleted contributor, say) in a dictionary-encoded
+# column.
+NO_USER = 0xFFFFFFFF
+
+class RevisionData(NamedTuple):
     """A deleted comment is represented as None.  A revision which simply
     has no comment will have comment set to the empty string.
 
+    timestamp is the time of the revision, as it appears in the dump
+    (e.g. '2001-01-21T02:12:21Z'); title and ns are the page's title and
+    namespace number.  They default to None, for revisions made without
+    them.
+
+    This is a named tuple rather than a dataclass, because millions of
+    them are created per dump file; tuples are smaller, faster to build
+    and cheaper to pickle between processes.
+
     """
     page_id: int
     rev_id: int
     user: str
     comment: str
+    timestamp: str = None
+    title: str = None
+    ns: int = None
 
     def asdict(self):
-        return dataclasses.asdict(self)
+        return {'page_id': self.page_id,
+                'rev_id': self.rev_id,
+                'user': self.user,
+                'comment': self.comment,
+                'timestamp': self.timestamp,
+                'title': self.title,
+                'ns': self.ns,
+                }
+
+
+class UserInterner:
+    """Maps each username to one shared str object.  The parsers build a
+    fresh string for every revision, but a small set of prolific editors
+    and bots account for most revisions, so sharing them saves a lot of
+    memory wherever revisions are held, and pickle (which writes each
+    distinct object once) sends each name once per batch.
+
+    Memory is bounded: names are kept in two generations of at most
+    maxsize each.  When the current generation is full, it becomes the
+    old one and the old one is dropped.  A name found in the old
+    generation moves to the current one, so active users survive and
+    one-off IPs age out.  (sys.intern() would keep every name ever seen
+    for as long as it was in use anywhere, with no bound.)
+
+    """
+    def __init__(self, maxsize=USER_CACHE_SIZE):
+        if (not (isinstance(maxsize, int) and maxsize > 0)):
+            raise ValueError(f'maxsize ({maxsize}) must be a positive integer')
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._current = {}
+        self._old = {}
+
+    def __len__(self):
+        return len(self._current) + len(self._old)
+
+    def __call__(self, name):
+        """Returns the shared copy of name (which may be None).
+
+        """
+        if name is None:
+            return None
+        shared = self._current.get(name)
+        if shared is not None:
+            self.hits += 1
+            return shared
+        shared = self._old.get(name)
+        if shared is None:
+            self.misses += 1
+            shared = name
+        else:
+            self.hits += 1
+        if len(self._current) >= self.maxsize:
+            self._old = self._current
+            self._current = {}
+        self._current[name] = shared
+        return shared
+
+
+class RevisionBatch:
+    """A run of revisions stored column-wise.  The integer columns are
+    kept in compact array('q') objects, so a batch of thousands of
+    revisions is a handful of objects instead of thousands, which makes
+    it cheap to hold, queue or pickle.
+
+    Iterating over a batch yields RevisionData objects.
+
+    The users and titles columns can also be had dictionary-encoded, as
+    an array of small integers and a table of the distinct values (see
+    encode_users()), which is how a batch is pickled.
+
+    """
+    __slots__ = ('page_ids', 'rev_ids', 'users', 'comments', 'timestamps', 'titles', 'namespaces')
+
+    def __init__(self, revisions=()):
+        self.page_ids = array('q')
+        self.rev_ids = array('q')
+        self.users = []
+        self.comments = []
+        self.timestamps = []
+        self.titles = []
+        self.namespaces = []
+        self.extend(revisions)
+
+    def __len__(self):
+        return len(self.rev_ids)
+
+    def __iter__(self):
+        return map(RevisionData, self.page_ids, self.rev_ids, self.users, self.comments,
+                   self.timestamps, self.titles, self.namespaces)
+
+    def __getitem__(self, i):
+        return RevisionData(self.page_ids[i], self.rev_ids[i], self.users[i], self.comments[i],
+                            self.timestamps[i], self.titles[i], self.namespaces[i])
+
+    def __eq__(self, other):
+        if not isinstance(other, RevisionBatch):
+            return NotImplemented
+        return list(self) == list(other)
+
+    def append(self, revision):
+        page_id, rev_id, user, comment, timestamp, title, ns = revision
+        self.page_ids.append(page_id)
+        self.rev_ids.append(rev_id)
+        self.users.append(user)
+        self.comments.append(comment)
+        self.timestamps.append(timestamp)
+        self.titles.append(title)
+        self.namespaces.append(ns)
+
+    def extend(self, revisions):
+        for revision in revisions:
+            self.append(revision)
+
+    def __getstate__(self):
+        user_ids, users = self.encode_users()
+        title_ids, titles = self.encode_titles()
+        return (self.page_ids, self.rev_ids, user_ids, users, self.comments,
+                self.timestamps, title_ids, titles, self.namespaces)
+
+    def __setstate__(self, state):
+        (self.page_ids, self.rev_ids, user_ids, users, self.comments,
+         self.timestamps, title_ids, titles, self.namespaces) = state
+        self.decode_users(user_ids, users)
+        self.decode_titles(title_ids, titles)
+
+    def encode_users(self):
+        """Returns the users column dictionary-encoded, as an (ids, table)
+        tuple: ids is an array('I') with, for each revision, the index of
+        its user in table, a list of the distinct users in order of first
+        appearance.  A deleted contributor is NO_USER.
+
+        """
+        return _encode_column(self.users)
+
+    def decode_users(self, ids, table):
+        """Replaces the users column with the one encoded by ids and table
+        (see encode_users()).  Revisions by the same user share one str.
+
+        """
+        self.users = _decode_column(ids, table)
+
+    def encode_titles(self):
+        """Like encode_users(), for the titles column.  Every revision of
+        a page has the same title, so this is a small table.
+
+        """
+        return _encode_column(self.titles)
+
+    def decode_titles(self, ids, table):
+        self.titles = _decode_column(ids, table)
+
+    def documents(self):
+        """Returns an iterator over the revisions as dicts, the same as
+        RevisionData.asdict() would produce, without building the
+        intermediate RevisionData objects.
+
+        """
+        for page_id, rev_id, user, comment, timestamp, title, ns in zip(
+                self.page_ids, self.rev_ids, self.users, self.comments,
+                self.timestamps, self.titles, self.namespaces):
+            yield {'page_id': page_id,
+                   'rev_id': rev_id,
+                   'user': user,
+                   'comment': comment,
+                   'timestamp': timestamp,
+                   'title': title,
+                   'ns': ns,
+                   }
+
+
+def _encode_column(values):
+    index = {}
+    ids = array('I')
+    for value in values:
+        if value is None:
+            ids.append(NO_USER)
+        else:
+            i = index.get(value)
+            if i is None:
+                i = index[value] = len(index)
+            ids.append(i)
+    return ids, list(index)
+
+
+def _decode_column(ids, table):
+    return [None if i == NO_USER else table[i] for i in ids]
+
+
+def batched(revisions, size):
+    """Groups an iterable of RevisionData into RevisionBatches of at
+    most size revisions.
+
+    """
+    if (not (isinstance(size, int) and size > 0)):
+        raise ValueError(f'size ({size}) must be a positive integer')
+    batch = RevisionBatch()
+    for revision in revisions:
+        batch.append(revision)
+        if len(batch) >= size:
+            yield batch
+            batch = RevisionBatch()
+    if batch:
+        yield batch
 
 
 class PagesDumpFile:
+    """backend selects the XML parser:
+
+      'iterparse': an event-driven parser built on ElementTree's
+      XMLPullParser.  Every element is discarded as soon as it has been
+      examined, so memory use stays flat no matter how big the <text>
+      bodies are.  This is the default.
+
+      'pulldom': the original xml.dom.pulldom parser, which builds a
+      minidom subtree for each <revision>.
+
+    If resume_after is given, revisions belonging to pages whose id is
+    less than or equal to it are skipped; this is used to pick up an
+    interrupted run where it left off.  Skipped pages still count
+    towards pages, but their revisions are not included in revisions.
 
-    def __init__(self):
+    If known_revisions is given, it is consulted (with its get(page_id)
+    method, which returns the highest rev_id already indexed for that
+    page) once per page.  A revision which is already known is skipped
+    as soon as its id is seen: the iterparse backend doesn't look at
+    its contributor, comment or timestamp (the pulldom backend still
+    builds its subtree).  They are counted in skipped.  This is normally a
+    revision_table.RevisionTable.
+
+    If skip_text is true (the default), the input is passed through a
+    text_filter.TextFilter, which cuts the <text> elements (almost all
+    of the bytes of a history dump) out of it before the XML parser
+    sees them.
+
+    timer is a utils.profiling.StageTimer, which is charged with the
+    time spent reading (and decompressing) the input as 'read', removing
+    the <text> elements as 'filter', and the rest of the time spent
+    producing revisions as 'parse'.
+
+    process() decompresses its input with the first available
+    decompressor for the file's suffix (see openers.py), trying the ones
+    named in decompressors first, and lets a multi-threaded one use
+    decompress_threads threads (default: one per CPU).  Which one was
+    used, and its throughput, are in decompression once the file has
+    been read.
+
+    Usernames are passed through a UserInterner (user_interner) holding
+    up to user_cache_size names per generation, so revisions by the same
+    user share one string.  user_cache_size=None turns this off.
+
+    """
+    BACKENDS = ('iterparse', 'pulldom')
+
+    def __init__(self, backend='iterparse', resume_after=None, known_revisions=None,
+                 skip_text=True, timer=NULL_TIMER, user_cache_size=USER_CACHE_SIZE,
+                 decompressors=(), decompress_threads=None):
+        if backend not in self.BACKENDS:
+            raise ValueError(f'backend ({backend}) must be one of {self.BACKENDS}')
+        self.backend = backend
+        self.resume_after = resume_after
+        self.known_revisions = known_revisions
+        self.skip_text = skip_text
+        self.timer = timer
+        self.user_interner = UserInterner(user_cache_size) if user_cache_size else None
+        self.decompressors = tuple(decompressors)
+        self.decompress_threads = decompress_threads
+        self.decompression = None
         self.pages = 0
         self.revisions = 0
+        self.skipped = 0
+        self._stream = None
 
     def asdict(self):
         return asdict(self)
 
 
     def process(self, path):
-        """Path is the file to be parsed.  If it ends in '.bz2', it is
-        decompressed on the fly.
+        """Path is the file to be parsed.  If it ends in '.bz2', '.gz',
+        '.zst' or '.7z', it is decompressed on the fly.
 
         Returns an iterator over RevisionData objects.
 
         """
         logger.debug('process(%s)', path)
-        opener = bz2.open if path.endswith('.bz2') else open
-        with opener(path) as stream:
-            doc = pulldom.parse(stream)
-            state = ''
-            for event, node in doc:
-                if event == pulldom.START_ELEMENT:
-                    if node.tagName == 'page':
-                        state = 'page'
+        stream = open_dump(path, self.decompressors, self.decompress_threads)
+        try:
+            with stream:
+                self._stream = stream
+                yield from self.parse(stream)
+        finally:
+            self._stream = None
+            self.decompression = stream.stats()
+            logger.info('Read "%s" with %s at %.1f MB/s', path, stream.decompressor,
+                        self.decompression['mb_per_second'])
+
+
+    def position(self):
+        """Returns how many bytes of the file given to process() have been
+        read so far (of compressed data, for a compressed file), or None
+        if that isn't known.  The input is read ahead in chunks, so this
+        is approximate.
+
+        """
+        try:
+            return os.lseek(self._stream.fileno(), 0, os.SEEK_CUR)
+        except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+            return None
+
+
+    def parse(self, stream, fragment=False):
+        """Stream is an open file-like object, in either text or binary
+        mode.
+
+        If fragment is true, the stream is a sequence of <page> elements
+        cut out of a larger dump (such as one stream from a multistream
+        dump), which is not a well-formed document on its own.  This is
+        only supported by the iterparse backend.
+
+        Returns an iterator over RevisionData objects.
+
+        """
+        stream = self.timer.reader(stream, 'read')
+        if self.skip_text:
+            stream = self.timer.reader(TextFilter(stream, CHUNK_SIZE), 'filter')
+        if self.backend == 'pulldom':
+            if fragment:
+                raise ValueError('fragments require the iterparse backend')
+            revisions = self._parse_pulldom(stream)
+        else:
+            revisions = self._parse_iterparse(stream, fragment)
+        return self.timer.iterate(revisions, 'parse')
+
+
+    def _parse_iterparse(self, stream, fragment=False):
+        parser = ElementTree.XMLPullParser(events=('start', 'end'))
+        if fragment:
+            # Supply a root element, and never call close(), so it doesn't
+            # matter whether the fragment includes the dump's opening or
+            # closing <mediawiki> tag.
+            parser.feed('<mediawiki>')
+        names = {}
+        elements = []
+        tags = []
+        page_id = rev_id = user = comment = timestamp = title = ns = None
+        skipping = skip = False
+        known = self.known_revisions
+        known_max = 0
+        intern = self._interner()
+        fed = False
+        while True:
+            data = stream.read(CHUNK_SIZE)
+            if data:
+                parser.feed(data)
+                fed = True
+            elif fed and not fragment:
+                parser.close()
+            for event, element in parser.read_events():
+                tag = names.get(element.tag)
+                if tag is None:
+                    tag = names[element.tag] = element.tag.rpartition('}')[2]
+
+                if event == 'start':
+                    if tag == 'page':
                         self.pages += 1
-                        page_id = None
+                        page_id = title = ns = None
+                    elif tag == 'revision':
+                        rev_id = user = timestamp = None
+                        comment = ''
+                        skip = skipping
+                    elements.append(element)
+                    tags.append(tag)
+                    continue
+
+                elements.pop()
+                tags.pop()
+                parent = tags[-1] if tags else None
+                if tag == 'id':
+                    if parent == 'page':
+                        page_id = int(element.text)
+                        skipping = self.resume_after is not None and page_id <= self.resume_after
+                        if known is not None:
+                            known_max = known.get(page_id)
+                    elif parent == 'revision':
+                        rev_id = int(element.text)
+                        skip = skipping or rev_id <= known_max
+                elif skip:
+                    # The revision's <id> comes first, so nothing else
+                    # about a known revision (or one on a page before
+                    # resume_after) is looked at.
+                    if tag == 'revision':
+                        skip = False
+                        if not skipping:
+                            self.skipped += 1
+                elif parent == 'contributor' and (tag == 'username' or tag == 'ip'):
+                    user = intern(element.text)
+                elif tag == 'comment' and parent == 'revision':
+                    if 'deleted' in element.attrib:
+                        comment = None
+                    else:
+                        comment = element.text or ''
+                elif tag == 'timestamp' and parent == 'revision':
+                    timestamp = element.text
+                elif tag == 'revision':
+                    self.revisions += 1
+                    yield RevisionData(page_id, rev_id, user, comment, timestamp, title, ns)
+                elif parent == 'page':
+                    if tag == 'title':
+                        title = element.text
+                    elif tag == 'ns':
+                        ns = int(element.text)
+
+                # Nothing from this element is needed any more, so
+                # drop it (and any children) right away.
+                if elements:
+                    del elements[-1][:]
+            if not data:
+                return
+
+
+    def _interner(self):
+        if self.user_interner is None:
+            return lambda name: name
+        return self.user_interner
+
+
+    def _parse_pulldom(self, stream):
+        doc = pulldom.parse(stream)
+        intern = self._interner()
+        state = ''
+        for event, node in doc:
+            if event == pulldom.START_ELEMENT:
+                if node.tagName == 'page':
+                    state = 'page'
+                    self.pages += 1
+                    page_id = title = ns = None
+                    continue
+                elif state == 'page' and node.tagName == 'id':
+                    doc.expandNode(node)
+                    page_id = int(node.childNodes[0].nodeValue)
+                    continue
+                elif state == 'page' and node.tagName == 'title':
+                    doc.expandNode(node)
+                    title = ''.join(child.nodeValue for child in node.childNodes)
+                    continue
+                elif state == 'page' and node.tagName == 'ns':
+                    doc.expandNode(node)
+                    ns = int(node.childNodes[0].nodeValue)
+                    continue
+                elif state == 'page' and node.tagName == 'revision':
+                    doc.expandNode(node)
+                    if self.resume_after is not None and page_id <= self.resume_after:
                         continue
-                    elif state == 'page' and node.tagName == 'id':
-                        doc.expandNode(node)
-                        page_id = int(node.childNodes[0].nodeValue)
+                    rev_id = int(node.getElementsByTagName('id')[0].childNodes[0].nodeValue)
+                    if self.known_revisions is not None and rev_id <= self.known_revisions.get(page_id):
+                        self.skipped += 1
                         continue
-                    elif state == 'page' and node.tagName == 'revision':
-                        state = 'revision'
-                        self.revisions += 1
-                        doc.expandNode(node)
-                        rev_id = int(node.getElementsByTagName('id')[0].childNodes[0].nodeValue)
-
-                        contributor = node.getElementsByTagName('contributor')[0]
-                        usernames = contributor.getElementsByTagName('username')
-                        if usernames:
-                            user_node = usernames[0]
-                        else:
-                            user_node = contributor.getElementsByTagName('ip')[0]
-                        user = user_node.childNodes[0].nodeValue
-
-                        comment_nodes = node.getElementsByTagName('comment')
-                        if comment_nodes:
-                            comment_node = comment_nodes[0]
-                            if comment_node.hasAttribute('deleted'):
-                                comment = None
-                            else:
-                                child = comment_node.firstChild
-                                comment = (child and child.nodeValue) or ''
+                    state = 'revision'
+                    self.revisions += 1
+
+                    contributor = node.getElementsByTagName('contributor')[0]
+                    usernames = contributor.getElementsByTagName('username')
+                    ips = contributor.getElementsByTagName('ip')
+                    if usernames:
+                        user = intern(usernames[0].childNodes[0].nodeValue)
+                    elif ips:
+                        user = intern(ips[0].childNodes[0].nodeValue)
+                    else:
+                        user = None
+
+                    comment_nodes = node.getElementsByTagName('comment')
+                    if comment_nodes:
+                        comment_node = comment_nodes[0]
+                        if comment_node.hasAttribute('deleted'):
+                            comment = None
                         else:
-                            comment = ''
+                            # Long comments may be split across several
+                            # text nodes.
+                            comment = ''.join(child.nodeValue for child in comment_node.childNodes)
+                    else:
+                        comment = ''
 
-                        state = 'page'
-                        yield RevisionData(page_id, rev_id, user, comment)
-                        continue
+                    timestamp_nodes = node.getElementsByTagName('timestamp')
+                    timestamp = timestamp_nodes[0].childNodes[0].nodeValue if timestamp_nodes else None
+
+                    state = 'page'
+                    yield RevisionData(page_id, rev_id, user, comment, timestamp, title, ns)
+                    continue
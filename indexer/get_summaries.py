@@ -1,26 +1,53 @@
 #!/usr/bin/env python3
 
+"""Compute summary statistics (see summaries.py) straight from the
+dump files, without going through OpenSearch:
+
+  get_summaries.py --file '/dumps/enwiki-20211201-pages-meta-history*' -o summary.json
+
+Each file, or each chunk of a multistream file, is summarized in its
+own worker process, and the partial summaries are merged as they come
+back.
+
+"""
+
 from argparse import ArgumentParser
-import bz2
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from configparser import ConfigParser
-import glob
+import gzip
+import json
 import logging
 import os
 from pathlib import Path
-from pprint import pprint
-from xml.dom import pulldom
+from time import perf_counter
+
+from wp_search_tools.indexer.dump_file import PagesDumpFile
+from wp_search_tools.indexer.multistream import index_path_for, open_range, read_index, split_ranges
+from wp_search_tools.indexer.revision_cache import RevisionCacheFile, is_cache_file
+from wp_search_tools.indexer.scheduler import find_dumps
+from wp_search_tools.indexer.summaries import DEFAULT_K, DEFAULT_PREFIX_LENGTH, Summary
 
-from opensearchpy import OpenSearch
-from dump_file import PagesDumpFile
+logger = logging.getLogger('wp_search_tools.summaries')
 
 
 def main():
-    logging.basicConfig(level=logging.DEBUG)
+    logging.basicConfig(level=logging.INFO)
     parser = ArgumentParser()
     parser.add_argument('--config', '-c', default='config.ini',
                         help='config file (default %(default)s)')
     parser.add_argument('--file', '-f',
-                        help='input file (over-rides config')
+                        help='input file, directory or glob pattern (over-rides config)')
+    parser.add_argument('--output', '-o',
+                        help='file to write the JSON summary to, gzipped if it ends in .gz (default: stdout)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='number of worker processes (default %(default)s)')
+    parser.add_argument('--chunks', type=int, default=None,
+                        help='''split each multistream file into this many chunks
+                        (default: the number of workers)''')
+    parser.add_argument('--top', type=int, default=DEFAULT_K,
+                        help='number of users and prefixes to keep (default %(default)s)')
+    parser.add_argument('--prefix-length', type=int, default=DEFAULT_PREFIX_LENGTH,
+                        help='length of the comment prefixes counted (default %(default)s)')
 
     args = parser.parse_args()
 
@@ -30,20 +57,85 @@ def main():
     config.read(Path(os.environ['SEARCH_TOOLS']) / 'src/elasticsearch.ini')
 
     if args.file:
-        logging.info('Processing command-line file "%s"', args.file)
-        process_path(args.file, config)
+        logger.info('Processing command-line files "%s"', args.file)
+        pattern = args.file
     else:
         pattern = config.get('dumps', 'path_glob')
-        logging.info('Processing directory "%s"', pattern)
-        for path in glob.iglob(pattern):
-            process_path(path, config)
+        logger.info('Processing directory "%s"', pattern)
+    paths = [path for _, path in find_dumps(pattern, include_cache=True)]
+    if not paths:
+        parser.error(f'no files match "{pattern}"')
+
+    start = perf_counter()
+    summary = summarize(paths, args.workers, args.chunks or args.workers, args.top, args.prefix_length)
+    result = summary.asdict()
+    result['files'] = paths
+    result['seconds'] = round(perf_counter() - start, 3)
+    logger.info('Summarized %d revisions from %d files in %.1f seconds',
+                summary.revisions, len(paths), result['seconds'])
+    write(result, args.output)
+
+
+def work_units(paths, chunks):
+    """Returns a list of (path, start, end) work units, one for each
+    file, except that multistream files are split into chunks (with
+    start and end as byte offsets; otherwise they are None).
+
+    """
+    units = []
+    for path in paths:
+        index_path = index_path_for(path)
+        if chunks > 1 and index_path and os.path.exists(index_path):
+            ranges = split_ranges(read_index(index_path), os.path.getsize(path), chunks)
+            units.extend((path, start, end) for start, end, _ in ranges)
+        else:
+            units.append((path, None, None))
+    return units
+
+
+def summarize_unit(path, start=None, end=None, k=DEFAULT_K, prefix_length=DEFAULT_PREFIX_LENGTH):
+    """Returns the Summary of one work unit.  This is a module-level
+    function so it can run in a worker process.
+
+    """
+    summary = Summary(k, prefix_length)
+    if start is not None:
+        df = PagesDumpFile()
+        with open_range(path, start, end) as stream:
+            summary.add_all(df.parse(stream, fragment=True))
+    else:
+        df = RevisionCacheFile() if is_cache_file(path) else PagesDumpFile()
+        summary.add_all(df.process(path))
+    summary.pages = df.pages
+    return summary
+
+
+def summarize(paths, workers=None, chunks=1, k=DEFAULT_K, prefix_length=DEFAULT_PREFIX_LENGTH):
+    """Returns the merged Summary of all the files in paths, computed by
+    a pool of worker processes.
+
+    """
+    summary = Summary(k, prefix_length)
+    units = work_units(paths, chunks)
+    with ProcessPoolExecutor(workers) as pool:
+        futures = {pool.submit(summarize_unit, path, start, end, k, prefix_length): (path, start, end)
+                   for path, start, end in units}
+        for n, future in enumerate(as_completed(futures), 1):
+            # Drop each partial result as soon as it has been merged.
+            unit = futures.pop(future)
+            summary.merge(future.result())
+            logger.info('Done with %d of %d units %s', n, len(units), unit)
+    return summary
+
 
+def write(result, output=None):
+    if output is None:
+        print(json.dumps(result, ensure_ascii=False))
+        return
+    opener = gzip.open if output.endswith('.gz') else open
+    with opener(output, 'wt', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, separators=(',', ':'))
 
-def process_path(path, config):
-    logging.info('Processing file "%s"', path)
-    df = PagesDumpFile(path)
-    for revision in df.process():
-        logging.info(revision)
 
 if __name__ == '__main__':
     main()
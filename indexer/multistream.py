@@ -0,0 +1,261 @@
+"""Parallel processing of Wikipedia 'multistream' XML dumps.
+
+A multistream dump is a concatenation of independent bz2 streams:
+
+  <wikiname>-YYYYMMDD-pages-articles-multistream*.xml*.bz2
+
+The first stream holds the <mediawiki> header and <siteinfo>, each
+following stream holds (usually) 100 <page> elements, and the last one
+holds the closing </mediawiki> tag.  The companion index file:
+
+  <wikiname>-YYYYMMDD-pages-articles-multistream-index*.txt*.bz2
+
+has one line per page, of the form 'offset:page_id:title', where offset
+is the byte offset of the stream containing that page.  Because the
+streams are independent, they can be decompressed and parsed in
+parallel.
+
+"""
+
+import bz2
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+import io
+import logging
+import os
+import re
+
+from wp_search_tools.indexer.dump_file import PagesDumpFile, RevisionBatch
+from wp_search_tools.utils.profiling import NULL_TIMER
+
+logger = logging.getLogger('wp_search_tools.tasks')
+
+
+def index_path_for(path):
+    """Returns the conventional name of the index file which goes with
+    the multistream dump at path, or None if path doesn't look like a
+    multistream dump.
+
+    """
+    index_path, n = re.subn(r'-multistream(\d*)\.xml', r'-multistream-index\1.txt', path)
+    return index_path if n == 1 else None
+
+
+def read_index(index_path):
+    """Returns a list of (offset, first_page_id) tuples, one per stream,
+    sorted by offset.  The index may be bz2 compressed.
+
+    """
+    opener = bz2.open if index_path.endswith('.bz2') else open
+    streams = []
+    last_offset = None
+    with opener(index_path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            offset, page_id, _ = line.split(':', 2)
+            offset = int(offset)
+            if offset != last_offset:
+                streams.append((offset, int(page_id)))
+                last_offset = offset
+    streams.sort()
+    return streams
+
+
+def stream_ranges(streams, file_size, streams_per_range=1):
+    """Groups consecutive streams into byte ranges.
+
+    streams is a list of (offset, first_page_id) tuples, as returned by
+    read_index().  file_size is the size of the dump file; the last range
+    runs to the end of the file.
+
+    Returns a list of (start, end, first_page_id) tuples.
+
+    """
+    if streams_per_range < 1:
+        raise ValueError(f'streams_per_range ({streams_per_range}) must be >= 1')
+    ranges = []
+    for i in range(0, len(streams), streams_per_range):
+        start, first_page_id = streams[i]
+        j = i + streams_per_range
+        end = streams[j][0] if j < len(streams) else file_size
+        ranges.append((start, end, first_page_id))
+    return ranges
+
+
+def split_ranges(streams, file_size, n):
+    """Divides the streams into at most n contiguous byte ranges of
+    roughly equal size, so that a file can be processed as n independent
+    pieces.
+
+    streams is a list of (offset, first_page_id) tuples, as returned by
+    read_index().  file_size is the size of the dump file.
+
+    Returns a list of (start, end, first_page_id) tuples.
+
+    """
+    if (not (isinstance(n, int) and n > 0)):
+        raise ValueError(f'n ({n}) must be a positive integer')
+    if not streams:
+        return []
+    first = streams[0][0]
+    target = (file_size - first) / n
+    ranges = []
+    start, first_page_id = streams[0]
+    for offset, page_id in streams[1:]:
+        if offset - first >= target * (len(ranges) + 1) and len(ranges) < n - 1:
+            ranges.append((start, offset, first_page_id))
+            start, first_page_id = offset, page_id
+    ranges.append((start, file_size, first_page_id))
+    return ranges
+
+
+class _RangeReader(io.RawIOBase):
+    """A read-only view of the bytes [start, end) of an open binary file.
+
+    """
+    def __init__(self, f, start, end):
+        f.seek(start)
+        self._f = f
+        self._remaining = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = min(len(buffer), self._remaining)
+        if n <= 0:
+            return 0
+        data = self._f.read(n)
+        buffer[:len(data)] = data
+        self._remaining -= len(data)
+        return len(data)
+
+
+@contextmanager
+def open_range(path, start, end):
+    """Opens the bytes [start, end) of the multistream dump at path as a
+    stream of decompressed XML, without reading the whole range into
+    memory.  The range must begin and end on stream boundaries.
+
+    """
+    with open(path, 'rb') as f:
+        with bz2.open(_RangeReader(f, start, end)) as stream:
+            yield stream
+
+
+def parse_range(path, start, end, backend='iterparse', resume_after=None, known_revisions=None,
+                skip_text=True):
+    """Decompresses and parses the bytes [start, end) of the multistream
+    dump at path.  The range must begin and end on stream boundaries.
+
+    Returns a (pages, skipped, revisions) tuple, where pages is the
+    number of pages seen, skipped the number of already known revisions
+    and revisions is a RevisionBatch, which is much cheaper to send back
+    from a worker process than a list of RevisionData.
+
+    This is a module-level function so it can run in a worker process.
+
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    xml = bz2.decompress(data)
+    df = PagesDumpFile(backend=backend, resume_after=resume_after,
+                       known_revisions=known_revisions, skip_text=skip_text)
+    revisions = RevisionBatch(df.parse(io.BytesIO(xml), fragment=True))
+    return df.pages, df.skipped, revisions
+
+
+class MultistreamDumpFile(PagesDumpFile):
+    """A PagesDumpFile which decompresses and parses the streams of a
+    multistream dump in a pool of worker processes.  Revisions are still
+    yielded in page order.
+
+    workers is the size of the process pool (default: one per CPU).
+
+    streams_per_task is the number of consecutive streams handed to a
+    worker at a time.  Larger values mean less inter-process overhead,
+    at the cost of more memory per task.
+
+    Note that only the iterparse backend can parse the page fragments
+    which make up each stream.
+
+    """
+    def __init__(self, backend='iterparse', workers=None, streams_per_task=10,
+                 resume_after=None, known_revisions=None, skip_text=True, timer=NULL_TIMER):
+        if backend != 'iterparse':
+            raise ValueError('multistream dumps require the iterparse backend')
+        super().__init__(backend=backend, resume_after=resume_after,
+                         known_revisions=known_revisions, skip_text=skip_text, timer=timer)
+        self.workers = workers or os.cpu_count()
+        self.streams_per_task = streams_per_task
+        self._position = None
+
+
+    def process(self, path, index_path=None):
+        """Path is the multistream dump to be parsed.  If index_path is
+        not given, it is derived from path.
+
+        Returns an iterator over RevisionData objects.
+
+        """
+        logger.debug('process(%s, %s)', path, index_path)
+        index_path = index_path or index_path_for(path)
+        if index_path is None:
+            raise ValueError(f'no index file for "{path}"')
+        ranges = stream_ranges(read_index(index_path),
+                               os.path.getsize(path),
+                               self.streams_per_task)
+        if self.resume_after is not None:
+            ranges = self._resumed(ranges)
+
+        # Keep a bounded number of tasks in flight, so a slow consumer
+        # doesn't cause the whole file to pile up in memory.
+        window = 2 * self.workers
+        pending = deque()
+        with ProcessPoolExecutor(self.workers) as pool:
+            try:
+                if ranges:
+                    self._position = ranges[0][0]
+                for start, end, _ in ranges:
+                    pending.append((end, pool.submit(parse_range, path, start, end, self.backend,
+                                                     self.resume_after, self.known_revisions,
+                                                     self.skip_text)))
+                    if len(pending) >= window:
+                        yield from self._collect(*pending.popleft())
+                while pending:
+                    yield from self._collect(*pending.popleft())
+            finally:
+                for _, future in pending:
+                    future.cancel()
+
+
+    def _resumed(self, ranges):
+        """Drops the leading ranges which only hold pages up to
+        resume_after, so they are never even decompressed.
+
+        """
+        for i in range(len(ranges) - 1):
+            if ranges[i + 1][2] > self.resume_after:
+                return ranges[i:]
+        return ranges[-1:]
+
+
+    def position(self):
+        """Returns the offset of the end of the last range whose revisions
+        have been collected.
+
+        """
+        return self._position
+
+
+    def _collect(self, end, future):
+        # The workers do the reading and parsing; all this process sees
+        # is the time it spends waiting for them.
+        with self.timer.stage('parse'):
+            pages, skipped, revisions = future.result()
+        self._position = end
+        self.pages += pages
+        self.skipped += skipped
+        self.revisions += len(revisions)
+        return revisions
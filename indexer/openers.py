@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+
+"""Opening, and decompressing, dump files.
+
+Most of the cost of reading a bz2 dump is decompression, and Python's
+bz2 module does it on a single core, in the same thread as the parser.
+External decompressors do better: lbzip2 and pbzip2 use every core, and
+even a single-threaded one (bzip2, zstd, gzip) runs in a process of its
+own, alongside the parser instead of taking turns with it.
+
+Each compression format (recognized by its file name suffix) has a
+list of decompressors in order of preference.  open_dump() uses the
+first one which is available on this host, unless told to prefer
+others.  A decompressor is either a Python function, or a command
+which is run as a subprocess and piped from.  Commands normally read
+the file on their stdin, which shares its offset with the file we
+opened, so how far they've got can still be found with os.lseek().
+
+register() adds a decompressor.  To see which is fastest on this host:
+
+  openers.py enwiki-20211201-pages-meta-history1.xml-p1p812.bz2
+
+"""
+
+from argparse import ArgumentParser
+import bz2
+import gzip
+import importlib.util
+import json
+import logging
+import os
+import shutil
+import subprocess
+from time import perf_counter
+from typing import Callable, NamedTuple
+
+logger = logging.getLogger('wp_search_tools.tasks')
+
+
+class Decompressor(NamedTuple):
+    """name identifies the decompressor.  suffixes are the file name
+    endings it handles; '' matches any file no other suffix does.
+
+    Exactly one of function and command is given.  function(path)
+    returns an open file object.  command is the argument list of an
+    external decompressor which writes to stdout, with '{threads}'
+    replaced by the number of threads to use.  The file is given to the
+    command on stdin, unless reads_path is true, in which case its path
+    is appended to the arguments.
+
+    module, if given, is a module which must be installed for the
+    decompressor to be available.
+
+    """
+    name: str
+    suffixes: tuple
+    function: Callable = None
+    command: tuple = None
+    reads_path: bool = False
+    module: str = None
+
+    def available(self):
+        if self.module is not None and importlib.util.find_spec(self.module) is None:
+            return False
+        return self.command is None or shutil.which(self.command[0]) is not None
+
+
+_registry = []
+
+
+def register(decompressor, first=False):
+    """Adds decompressor to the registry, after the ones already there for
+    the same suffixes (or, if first is true, before them).
+
+    """
+    if first:
+        _registry.insert(0, decompressor)
+    else:
+        _registry.append(decompressor)
+
+
+def decompressors(path=None):
+    """Returns the registered decompressors (or only those which handle
+    path), in order of preference.
+
+    """
+    if path is None:
+        return list(_registry)
+    path = str(path)
+    suffix = max((s for d in _registry for s in d.suffixes if path.endswith(s)), key=len)
+    return [d for d in _registry if suffix in d.suffixes]
+
+
+def choose(path, preferred=()):
+    """Returns the Decompressor to use for path: the first available one
+    which handles it, trying the ones named in preferred first.
+
+    """
+    candidates = decompressors(path)
+    rank = {name: i for i, name in enumerate(preferred)}
+    candidates.sort(key=lambda d: rank.get(d.name, len(rank)))
+    for decompressor in candidates:
+        if decompressor.available():
+            return decompressor
+    raise ValueError(f'No decompressor available for "{path}"')
+
+
+def _open_zstandard(path):
+    zstandard = importlib.import_module('zstandard')
+    return zstandard.open(path, 'rb')
+
+
+register(Decompressor('lbzip2', ('.bz2',), command=('lbzip2', '-dc', '-n', '{threads}')))
+register(Decompressor('pbzip2', ('.bz2',), command=('pbzip2', '-dc', '-p{threads}')))
+register(Decompressor('bzip2', ('.bz2',), command=('bzip2', '-dc')))
+register(Decompressor('bz2', ('.bz2',), function=lambda path: bz2.open(path)))
+register(Decompressor('pigz', ('.gz',), command=('pigz', '-dc')))
+register(Decompressor('gzip', ('.gz',), command=('gzip', '-dc')))
+register(Decompressor('python-gzip', ('.gz',), function=lambda path: gzip.open(path)))
+register(Decompressor('zstd', ('.zst',), command=('zstd', '-dcq')))
+register(Decompressor('zstandard', ('.zst',), function=_open_zstandard, module='zstandard'))
+register(Decompressor('7z', ('.7z',), command=('7z', 'e', '-so', '-bd'), reads_path=True))
+register(Decompressor('7za', ('.7z',), command=('7za', 'e', '-so', '-bd'), reads_path=True))
+register(Decompressor('7zz', ('.7z',), command=('7zz', 'e', '-so', '-bd'), reads_path=True))
+register(Decompressor('open', ('',), function=lambda path: open(path)))
+
+
+class DumpStream:
+    """A file-like object reading the decompressed contents of path,
+    which keeps track of how much it has read and how fast.
+
+    """
+    def __init__(self, path, decompressor, stream, process=None, source=None):
+        self.path = str(path)
+        self.decompressor = decompressor.name
+        self.bytes_read = 0
+        self._stream = stream
+        self._process = process
+        self._source = source
+        self._eof = False
+        self._start = perf_counter()
+        self._seconds = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def _count(self, data):
+        if data:
+            self.bytes_read += len(data)
+        else:
+            self._eof = True
+        return data
+
+
+    def read(self, *args):
+        return self._count(self._stream.read(*args))
+
+
+    def readline(self, *args):
+        return self._count(self._stream.readline(*args))
+
+
+    def readinto(self, buffer):
+        n = self._stream.readinto(buffer)
+        if n:
+            self.bytes_read += n
+        else:
+            self._eof = True
+        return n
+
+
+    def fileno(self):
+        # The compressed file, so its position can be had from lseek().
+        return (self._source or self._stream).fileno()
+
+
+    def close(self):
+        if self._seconds is not None:
+            return
+        self._seconds = perf_counter() - self._start
+        self._stream.close()
+        if self._source is not None:
+            self._source.close()
+        if self._process is None:
+            return
+        if not self._eof and self._process.poll() is None:
+            # We've stopped reading early, so it doesn't matter how it
+            # would have ended.
+            self._process.kill()
+            self._process.wait()
+            return
+        status = self._process.wait()
+        if status != 0:
+            raise OSError(f'{self.decompressor} exited with status {status} reading "{self.path}"')
+
+
+    def stats(self):
+        """Returns a dict with the decompressor used, the size of the file
+        (bytes_in), the number of bytes (or characters, for an
+        uncompressed file, which is read as text) read from it so far
+        (bytes_out), the seconds since it was opened (until it was
+        closed) and the rate of bytes_out in MB per second.
+
+        """
+        seconds = self._seconds if self._seconds is not None else perf_counter() - self._start
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            size = None
+        return {'decompressor': self.decompressor,
+                'bytes_in': size,
+                'bytes_out': self.bytes_read,
+                'seconds': round(seconds, 3),
+                'mb_per_second': round(self.bytes_read / seconds / 1e6, 1) if seconds else 0.0,
+                }
+
+
+def open_dump(path, preferred=(), threads=None):
+    """Opens path (a str) for reading, decompressing it with the
+    decompressor chosen by choose(path, preferred).  threads is the
+    number of threads a multi-threaded decompressor may use (default:
+    one per CPU).
+
+    Returns a DumpStream.
+
+    """
+    decompressor = choose(path, preferred)
+    logger.debug('Opening "%s" with %s', path, decompressor.name)
+    if decompressor.function is not None:
+        return DumpStream(path, decompressor, decompressor.function(path))
+
+    threads = str(threads or os.cpu_count() or 1)
+    args = [arg.replace('{threads}', threads) for arg in decompressor.command]
+    source = None
+    if decompressor.reads_path:
+        args.append(path)
+        stdin = subprocess.DEVNULL
+    else:
+        source = stdin = open(path, 'rb')
+    try:
+        process = subprocess.Popen(args, stdin=stdin, stdout=subprocess.PIPE, bufsize=1024 * 1024)
+    except BaseException:
+        if source is not None:
+            source.close()
+        raise
+    return DumpStream(path, decompressor, process.stdout, process, source)
+
+
+def measure(path, names=None, threads=None):
+    """Decompresses all of path with each available decompressor which
+    handles it (or only those in names), and returns a list of their
+    stats().
+
+    """
+    results = []
+    for decompressor in decompressors(path):
+        if names and decompressor.name not in names:
+            continue
+        if not decompressor.available():
+            logger.info('%s is not available', decompressor.name)
+            continue
+        with open_dump(path, [decompressor.name], threads) as stream:
+            while stream.read(1024 * 1024):
+                pass
+        results.append(stream.stats())
+        logger.info('%s: %.1f MB/s', decompressor.name, results[-1]['mb_per_second'])
+    return results
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = ArgumentParser(description='Measure the decompressors available for dump files')
+    parser.add_argument('paths', nargs='+',
+                        help='files to decompress')
+    parser.add_argument('--decompressors', nargs='+', metavar='NAME',
+                        help='decompressors to measure (default: all available)')
+    parser.add_argument('--threads', type=int,
+                        help='threads for multi-threaded decompressors (default: one per CPU)')
+    args = parser.parse_args()
+
+    for path in args.paths:
+        print(json.dumps({'path': path,
+                          'results': measure(path, args.decompressors, args.threads)}))
+
+
+if __name__ == '__main__':
+    main()
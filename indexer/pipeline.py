@@ -0,0 +1,177 @@
+"""Overlap parsing with indexing.
+
+Pipeline runs the parser (any iterator over RevisionData) in a thread
+of its own, which groups the revisions into RevisionBatches and puts
+them on a bounded queue.  The consumer takes batches off the queue and
+hands them to a BulkIndexer, whose sender threads do the network I/O.
+Decompression and the bulk requests both release the GIL, so the
+parser, the consumer and the requests in flight all make progress at
+once.
+
+The queue gives backpressure: when it's full, the parser blocks until
+the consumer catches up, so memory use is bounded by depth batches.
+The time each side spends waiting for the other shows which one is the
+bottleneck.
+
+"""
+
+import logging
+from queue import Empty, Full, Queue
+from threading import Event, Thread
+from time import perf_counter
+
+from wp_search_tools.indexer.dump_file import batched
+
+logger = logging.getLogger('wp_search_tools.tasks')
+
+_DONE = object()
+
+
+class Pipeline:
+    """An iterator over revisions, grouped into RevisionBatches, which
+    are produced in a background thread:
+
+      with Pipeline(df.process(path)) as pipeline:
+          for batch in pipeline:
+              ...
+
+    batch_size is the number of revisions in each batch.
+
+    depth is the maximum number of batches waiting in the queue.  With
+    depth=0 there is no thread or queue; the batches are produced by the
+    consumer as it iterates, as if revisions had been passed through
+    batched().
+
+    If the parser raises an exception, it is raised in the consumer when
+    it gets to that point.  If the consumer stops early (because of an
+    exception, or just by leaving the with block), the parser is stopped
+    and the revisions iterator closed.
+
+    """
+    def __init__(self, revisions, batch_size=1000, depth=4):
+        if (not (isinstance(depth, int) and depth >= 0)):
+            raise ValueError(f'depth ({depth}) must be a non-negative integer')
+        self.revisions = revisions
+        self.batch_size = batch_size
+        self.depth = depth
+        self.batches = 0
+        self.parser_wait = 0.0
+        self.consumer_wait = 0.0
+        self.max_depth = 0
+        self._total_depth = 0
+        self._exception = None
+        self._stop = Event()
+        self._queue = Queue(depth) if depth else None
+        self._thread = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def __iter__(self):
+        if self._queue is None:
+            for batch in batched(self.revisions, self.batch_size):
+                self.batches += 1
+                yield batch
+            return
+
+        self._thread = Thread(target=self._produce, name='parser', daemon=True)
+        self._thread.start()
+        while True:
+            depth = self._queue.qsize()
+            self.max_depth = max(self.max_depth, depth)
+            self._total_depth += depth
+            try:
+                item = self._queue.get_nowait()
+            except Empty:
+                start = perf_counter()
+                item = self._queue.get()
+                self.consumer_wait += perf_counter() - start
+            if item is _DONE:
+                self._thread.join()
+                if self._exception is not None:
+                    raise self._exception
+                return
+            self.batches += 1
+            yield item
+
+
+    def _produce(self):
+        try:
+            for batch in batched(self.revisions, self.batch_size):
+                if not self._put(batch):
+                    break
+        except BaseException as ex:
+            self._exception = ex
+        finally:
+            close = getattr(self.revisions, 'close', None)
+            if close:
+                try:
+                    close()
+                except Exception as ex:
+                    logger.warning('Error closing parser: %s', ex)
+            self._put(_DONE)
+
+
+    def _put(self, item):
+        """Put item on the queue, waiting while it's full.  Returns False if
+        the consumer has gone away.
+
+        """
+        if self._stop.is_set():
+            return False
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except Full:
+            pass
+        start = perf_counter()
+        try:
+            while not self._stop.is_set():
+                try:
+                    self._queue.put(item, timeout=0.1)
+                    return True
+                except Full:
+                    pass
+            return False
+        finally:
+            self.parser_wait += perf_counter() - start
+
+
+    def close(self):
+        """Stop the parser, if it's still running, and wait for it to
+        finish.
+
+        """
+        if self._thread is None:
+            return
+        self._stop.set()
+        while self._thread.is_alive():
+            # Make room, in case the parser is waiting to put something.
+            try:
+                self._queue.get(timeout=0.1)
+            except Empty:
+                pass
+        self._thread = None
+
+
+    def stats(self):
+        """Returns a dict with the number of batches, the maximum and mean
+        number of batches waiting when the consumer went to get one, and
+        the seconds the parser spent waiting for room in the queue
+        (indexing is the bottleneck) and the consumer spent waiting for
+        a batch (parsing is the bottleneck).
+
+        """
+        return {'batches': self.batches,
+                'depth': self.depth,
+                'max_depth': self.max_depth,
+                'mean_depth': round(self._total_depth / self.batches, 2) if self.batches else 0.0,
+                'parser_wait': round(self.parser_wait, 3),
+                'consumer_wait': round(self.consumer_wait, 3),
+                }
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+
+"""A compact binary cache of the RevisionData stream from a dump file.
+
+Parsing the XML dumps is by far the most expensive part of indexing,
+yet only a few fields of each revision are kept.  Extracting those once
+into a cache file means an index can be rebuilt (new mapping, new
+cluster...) by replaying the cache instead of re-parsing the dumps:
+
+  revision_cache.py enwiki-20211201-pages-meta-history1.xml-p1p812.bz2
+
+writes enwiki-20211201-pages-meta-history1.xml-p1p812.revcache, which
+tasks.process_path() and get_summaries.py accept in place of the dump.
+
+File layout (all integers little-endian):
+
+  header: b'WPREVCAC', version (uint32), padding (uint32)
+
+followed by any number of chunks, each holding up to CHUNK_SIZE
+revisions:
+
+  chunk header: body length in bytes (uint64), revisions n (uint32),
+                distinct users u (uint32), distinct titles t (uint32),
+                padding (uint32)
+  page_ids:     n int64
+  rev_ids:      n int64
+  user_ids:     n uint32, indexes into the user table (dump_file.NO_USER for a
+                deleted contributor)
+  title_ids:    n uint32, indexes into the title table (NO_USER for none)
+  namespaces:   n int32 (NO_NS for none)
+  user_offsets: u + 1 uint32, into the user blob
+  title_offsets: t + 1 uint32, into the title blob
+  comment_offsets: n + 1 uint32, into the comment blob
+  timestamp_offsets: n + 1 uint32, into the timestamp blob (an empty
+                timestamp is none)
+  deleted:      n bytes, 1 for a deleted comment
+  user blob:    UTF-8
+  title blob:   UTF-8
+  comment blob: UTF-8
+  timestamp blob: ASCII
+
+Each section is padded to a multiple of 8 bytes.  Chunks are length
+prefixed, so a reader can skip from one to the next without decoding
+them, and the file is read through mmap.
+
+"""
+
+from argparse import ArgumentParser
+from array import array
+import logging
+import mmap
+import struct
+import sys
+
+from wp_search_tools.indexer.dump_file import PagesDumpFile, RevisionBatch, batched
+
+logger = logging.getLogger('wp_search_tools.tasks')
+
+SUFFIX = '.revcache'
+MAGIC = b'WPREVCAC'
+VERSION = 2
+CHUNK_SIZE = 65536
+
+# Stands for a missing namespace in the namespaces column.
+NO_NS = -2 ** 31
+
+_FILE_HEADER = struct.Struct('<8sII')
+_CHUNK_HEADER = struct.Struct('<QIII4x')
+
+
+def is_cache_file(path):
+    return str(path).endswith(SUFFIX)
+
+
+def cache_path_for(path):
+    """Returns the default cache file name for the dump at path.
+
+    """
+    for suffix in ('.bz2', '.gz', '.zst', '.7z'):
+        if path.endswith(suffix):
+            path = path[:-len(suffix)]
+    return path + SUFFIX
+
+
+def _pad(n):
+    return -n % 8
+
+
+def _to_little_endian(a):
+    if sys.byteorder != 'little':
+        a = array(a.typecode, a)
+        a.byteswap()
+    return a.tobytes()
+
+
+def _from_little_endian(typecode, data):
+    a = array(typecode)
+    a.frombytes(data)
+    if sys.byteorder != 'little':
+        a.byteswap()
+    return a
+
+
+def encode_chunk(batch):
+    """Returns the bytes of one chunk (including its header) holding the
+    revisions in batch.
+
+    """
+    n = len(batch)
+    user_ids, users = batch.encode_users()
+    title_ids, titles = batch.encode_titles()
+    namespaces = array('i', [NO_NS if ns is None else ns for ns in batch.namespaces])
+    user_blob, user_offsets = _encode_strings(users)
+    title_blob, title_offsets = _encode_strings(titles)
+    comment_blob, comment_offsets = _encode_strings(batch.comments)
+    timestamp_blob, timestamp_offsets = _encode_strings(batch.timestamps)
+    deleted = bytes(comment is None for comment in batch.comments)
+
+    sections = [_to_little_endian(batch.page_ids),
+                _to_little_endian(batch.rev_ids),
+                _to_little_endian(user_ids),
+                _to_little_endian(title_ids),
+                _to_little_endian(namespaces),
+                _to_little_endian(user_offsets),
+                _to_little_endian(title_offsets),
+                _to_little_endian(comment_offsets),
+                _to_little_endian(timestamp_offsets),
+                deleted,
+                user_blob,
+                title_blob,
+                comment_blob,
+                timestamp_blob,
+                ]
+    body = b''.join(s + b'\0' * _pad(len(s)) for s in sections)
+    return _CHUNK_HEADER.pack(len(body), n, len(users), len(titles)) + body
+
+
+def _encode_strings(strings):
+    offsets = array('I', [0])
+    parts = []
+    position = 0
+    for s in strings:
+        data = s.encode('utf-8') if s else b''
+        parts.append(data)
+        position += len(data)
+        offsets.append(position)
+    return b''.join(parts), offsets
+
+
+def _decode_strings(blob, offsets, count):
+    return [blob[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(count)]
+
+
+def decode_chunk(buffer, offset, n, u, t):
+    """Decodes the chunk body starting at offset in buffer (which may be
+    an mmap) into a RevisionBatch.
+
+    """
+    def take(length):
+        nonlocal offset
+        data = buffer[offset:offset + length]
+        offset += length + _pad(length)
+        return data
+
+    batch = RevisionBatch()
+    batch.page_ids = _from_little_endian('q', take(8 * n))
+    batch.rev_ids = _from_little_endian('q', take(8 * n))
+    user_ids = _from_little_endian('I', take(4 * n))
+    title_ids = _from_little_endian('I', take(4 * n))
+    namespaces = _from_little_endian('i', take(4 * n))
+    user_offsets = _from_little_endian('I', take(4 * (u + 1)))
+    title_offsets = _from_little_endian('I', take(4 * (t + 1)))
+    comment_offsets = _from_little_endian('I', take(4 * (n + 1)))
+    timestamp_offsets = _from_little_endian('I', take(4 * (n + 1)))
+    deleted = take(n)
+    user_blob = take(user_offsets[-1])
+    title_blob = take(title_offsets[-1])
+    comment_blob = take(comment_offsets[-1])
+    timestamp_blob = take(timestamp_offsets[-1])
+
+    batch.decode_users(user_ids, _decode_strings(user_blob, user_offsets, u))
+    batch.decode_titles(title_ids, _decode_strings(title_blob, title_offsets, t))
+    batch.namespaces = [None if ns == NO_NS else ns for ns in namespaces]
+    batch.comments = [None if deleted[i] else
+                      comment_blob[comment_offsets[i]:comment_offsets[i + 1]].decode('utf-8')
+                      for i in range(n)]
+    batch.timestamps = [timestamp or None
+                        for timestamp in _decode_strings(timestamp_blob, timestamp_offsets, n)]
+    return batch
+
+
+def write_cache(revisions, path, chunk_size=CHUNK_SIZE):
+    """Writes an iterable of RevisionData to a cache file at path.
+
+    Returns the number of revisions written.
+
+    """
+    count = 0
+    with open(path, 'wb') as f:
+        f.write(_FILE_HEADER.pack(MAGIC, VERSION, 0))
+        for batch in batched(revisions, chunk_size):
+            f.write(encode_chunk(batch))
+            count += len(batch)
+    return count
+
+
+def read_batches(path):
+    """Returns an iterator over the RevisionBatches in the cache file at
+    path.
+
+    """
+    with open(path, 'rb') as f:
+        if f.seek(0, 2) == 0:
+            raise ValueError(f'"{path}" is not a revision cache file')
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            magic, version, _ = _FILE_HEADER.unpack_from(mm, 0)
+            if magic != MAGIC:
+                raise ValueError(f'"{path}" is not a revision cache file')
+            if version != VERSION:
+                raise ValueError(f'"{path}" has unsupported version {version}')
+            offset = _FILE_HEADER.size
+            while offset < len(mm):
+                length, n, u, t = _CHUNK_HEADER.unpack_from(mm, offset)
+                offset += _CHUNK_HEADER.size
+                yield decode_chunk(mm, offset, n, u, t)
+                offset += length
+
+
+class RevisionCacheFile(PagesDumpFile):
+    """A PagesDumpFile which replays a cache file written by
+    write_cache(), instead of parsing XML.
+
+    """
+    def process(self, path):
+        """Path is the cache file to be read.
+
+        Returns an iterator over RevisionData objects.
+
+        """
+        logger.debug('process(%s)', path)
+        last_page_id = None
+        for batch in self.timer.iterate(read_batches(path), 'read'):
+            for revision in batch:
+                if revision.page_id != last_page_id:
+                    self.pages += 1
+                    last_page_id = revision.page_id
+                if self.resume_after is not None and revision.page_id <= self.resume_after:
+                    continue
+                if (self.known_revisions is not None
+                        and revision.rev_id <= self.known_revisions.get(revision.page_id)):
+                    self.skipped += 1
+                    continue
+                self.revisions += 1
+                yield revision
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = ArgumentParser(description='Extract the revisions from a dump file into a cache file')
+    parser.add_argument('path',
+                        help='dump file to extract')
+    parser.add_argument('--output', '-o',
+                        help='cache file to write (default: derived from path)')
+    args = parser.parse_args()
+
+    output = args.output or cache_path_for(args.path)
+    df = PagesDumpFile()
+    count = write_cache(df.process(args.path), output)
+    logger.info('Wrote %d revisions from %d pages to "%s"', count, df.pages, output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""A compact on-disk record of which revisions are already indexed.
+
+Each monthly dump repeats almost every revision of the previous one.
+RevisionTable remembers, for each page, the highest rev_id which has
+been indexed.  New revisions get higher ids than old ones, so any
+revision at or below that mark can be skipped.
+
+That assumes a page never gains a revision older than the ones already
+indexed.  History merges and imports break it: they can add revisions
+with smaller ids to a page, and those are skipped by incremental runs.
+A full (non-incremental) run picks them up.
+
+The table is a flat file of little-endian int64s indexed by page_id,
+accessed through mmap.  Page ids are dense enough that this is far
+smaller than any hash table would be (8 bytes per page, and the file is
+grown with ftruncate(), so it is sparse where no pages have been seen),
+and lookups are a single array access.
+
+Several processes may share a table, as long as they update disjoint
+sets of pages (which is the case for different dump files).
+
+"""
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+import mmap
+import os
+import sys
+
+# The file grows in steps of this many entries (8 MB).
+GROWTH = 1024 * 1024
+
+
+class RevisionTable:
+    """path is the table file, which is created if it doesn't exist.  If
+    readonly is true, the table can be consulted but not updated.
+
+    """
+    def __init__(self, path, readonly=False):
+        if sys.byteorder != 'little':
+            raise RuntimeError('RevisionTable only supports little-endian hosts')
+        self.path = str(path)
+        self.readonly = readonly
+        flags = os.O_RDONLY if readonly else os.O_RDWR | os.O_CREAT
+        self._fd = os.open(self.path, flags, 0o644)
+        self._mmap = None
+        self._entries = None
+        self._map()
+
+
+    def __reduce__(self):
+        # Worker processes get their own read-only mapping of the same
+        # file.
+        return (RevisionTable, (self.path, True))
+
+
+    def reader(self):
+        """Returns a separate read-only RevisionTable on the same file,
+        which sees this one's updates.  The two can be used from
+        different threads.
+
+        """
+        return RevisionTable(self.path, readonly=True)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def __len__(self):
+        return len(self._entries) if self._entries is not None else 0
+
+
+    def _map(self):
+        self._unmap()
+        size = os.fstat(self._fd).st_size
+        if size:
+            access = mmap.ACCESS_READ if self.readonly else mmap.ACCESS_WRITE
+            self._mmap = mmap.mmap(self._fd, size, access=access)
+            self._entries = memoryview(self._mmap).cast('q')
+
+
+    def _unmap(self):
+        if self._entries is not None:
+            self._entries.release()
+            self._entries = None
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+
+    def _grow(self, page_id):
+        entries = (page_id // GROWTH + 1) * GROWTH
+        # The lock keeps another process from growing the file between
+        # the fstat() and the ftruncate(), which would then shrink it.
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size < entries * 8:
+                os.ftruncate(self._fd, entries * 8)
+        finally:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._map()
+
+
+    def get(self, page_id):
+        """Returns the highest indexed rev_id for page_id, or 0 if none.
+
+        """
+        if page_id >= len(self):
+            # Another process may have grown the file since we mapped it.
+            if os.fstat(self._fd).st_size > len(self) * 8:
+                self._map()
+            if page_id >= len(self):
+                return 0
+        return self._entries[page_id]
+
+
+    def is_indexed(self, page_id, rev_id):
+        return rev_id <= self.get(page_id)
+
+
+    def update(self, page_id, rev_id):
+        """Records that every revision of page_id up to rev_id has been
+        indexed.
+
+        """
+        if self.readonly:
+            raise ValueError(f'"{self.path}" is open read-only')
+        if page_id >= len(self):
+            self._grow(page_id)
+        if rev_id > self._entries[page_id]:
+            self._entries[page_id] = rev_id
+
+
+    def flush(self):
+        if self._mmap is not None and not self.readonly:
+            self._mmap.flush()
+
+
+    def close(self):
+        if self._fd is None:
+            return
+        self.flush()
+        self._unmap()
+        os.close(self._fd)
+        self._fd = None
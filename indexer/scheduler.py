@@ -0,0 +1,114 @@
+"""Run a task over many dump files with a bounded number in flight.
+
+A full history dump is hundreds of files, from a few MB to tens of GB.
+To keep the workers busy until the end, the biggest files are started
+first (so a big one isn't left running alone at the end) and at most
+max_in_flight tasks are queued at a time (so the broker doesn't hold
+the whole run, and the order is kept).  File size is used as the cost
+of a file, since the page ranges in the file names say nothing about
+how many revisions each page has.
+
+"""
+
+import glob
+import logging
+import os
+import re
+from time import perf_counter, sleep
+
+from wp_search_tools.indexer.revision_cache import SUFFIX, cache_path_for, is_cache_file
+
+logger = logging.getLogger('wp_search_tools.scheduler')
+
+# Summed over the results of all the tasks.
+TOTALS = ('pages', 'revisions', 'skipped', 'indexed', 'failed')
+
+# The name of an XML dump: .xml, then the page range (if any), then the
+# compression suffix (if any), e.g. enwiki-...-history1.xml-p1p812.bz2.
+# Revision caches (.xml-p1p812.revcache), multistream indexes
+# (-index.txt.bz2) and the like don't match.
+DUMP_NAME = re.compile(r'\.xml(-p\d+p\d+)?(\.bz2|\.gz|\.zst|\.7z)?$')
+
+
+def is_pattern(path):
+    return any(c in path for c in '*?[')
+
+
+def is_dump_file(path):
+    return DUMP_NAME.search(os.path.basename(path)) is not None
+
+
+def find_dumps(path, pattern='*.xml*', include_cache=False):
+    """Returns a list of (size, path) tuples for the dump files matching
+    path, largest first.  path is either a directory, in which case the
+    files in it matching pattern are used, or a glob pattern itself.
+
+    Only XML dumps (see DUMP_NAME) are included, not the revision
+    caches, multistream indexes or anything else kept alongside them,
+    unless path names a single file.
+
+    If include_cache is true, revision cache files (see
+    revision_cache.py) are included too, for tools which read either.
+    A dump whose cache is also found is left out, so its revisions are
+    only read once, from the cache.
+
+    """
+    patterns = [path]
+    if os.path.isdir(path):
+        patterns = [os.path.join(path, pattern)]
+        if include_cache:
+            patterns.append(os.path.join(path, '*' + SUFFIX))
+    found = {p for pattern in patterns for p in glob.glob(pattern)
+             if os.path.isfile(p)
+             and (is_dump_file(p) or p == path or (include_cache and is_cache_file(p)))}
+    if include_cache:
+        found = {p for p in found if not (is_dump_file(p) and cache_path_for(p) in found)}
+    files = [(os.path.getsize(p), p) for p in found]
+    files.sort(key=lambda f: (-f[0], f[1]))
+    return files
+
+
+def run(paths, submit, max_in_flight=4, poll_interval=5.0, report=None):
+    """Calls submit(path) for each of paths (in order), which must return
+    a Celery AsyncResult (or anything with ready(), successful() and
+    get(propagate=False)), keeping at most max_in_flight of them
+    unfinished at a time.  report(path, result) is called as each one
+    finishes, with its result or exception.
+
+    Returns a summary dict with the number of files, the sum of each of
+    TOTALS over the successful tasks, the tasks which failed outright as
+    (path, error) pairs, and the wall time.
+
+    """
+    if (not (isinstance(max_in_flight, int) and max_in_flight > 0)):
+        raise ValueError(f'max_in_flight ({max_in_flight}) must be a positive integer')
+    start = perf_counter()
+    summary = {'files': 0}
+    summary.update((key, 0) for key in TOTALS)
+    summary['errors'] = []
+    queue = list(paths)
+    queue.reverse()
+    in_flight = []
+    while queue or in_flight:
+        while queue and len(in_flight) < max_in_flight:
+            path = queue.pop()
+            logger.info('Submitting "%s"', path)
+            in_flight.append((path, submit(path)))
+        done = [(path, result) for path, result in in_flight if result.ready()]
+        if not done:
+            sleep(poll_interval)
+            continue
+        for item in done:
+            in_flight.remove(item)
+            path, result = item
+            value = result.get(propagate=False)
+            summary['files'] += 1
+            if result.successful():
+                for key in TOTALS:
+                    summary[key] += value.get(key, 0)
+            else:
+                summary['errors'].append((path, repr(value)))
+            if report:
+                report(path, value)
+    summary['seconds'] = round(perf_counter() - start, 3)
+    return summary
@@ -0,0 +1,177 @@
+"""Statistics over the revisions in the dumps, without OpenSearch.
+
+A Summary is a set of aggregates over a stream of RevisionData which
+can be merged with another Summary of a different stream.  This lets
+get_summaries.py summarize each dump file (or piece of one) in its own
+process and combine the partial results as they come back, so the work
+spreads across all the cores and nothing ever holds more than one
+partial result per worker.
+
+Counts which are keyed by something unbounded (users, comment prefixes)
+are kept in FrequentItems, which uses bounded memory no matter how many
+distinct keys there are.
+
+"""
+
+DEFAULT_K = 1000
+DEFAULT_PREFIX_LENGTH = 20
+
+
+class FrequentItems:
+    """Approximate counts of the most frequent items in a stream, using
+    the Misra-Gries algorithm, in memory proportional to k.
+
+    Every count reported is at most error below the true count, where
+    error is no more than (total count) / (k + 1).  Any item whose true
+    count is more than that is guaranteed to be present.  Two
+    FrequentItems built from different streams can be merged, with the
+    same guarantee for the combined stream.
+
+    """
+    def __init__(self, k=DEFAULT_K):
+        if (not (isinstance(k, int) and k > 0)):
+            raise ValueError(f'k ({k}) must be a positive integer')
+        self.k = k
+        self.counts = {}
+        self.error = 0
+
+
+    def __len__(self):
+        return len(self.counts)
+
+
+    def update(self, item, n=1):
+        counts = self.counts
+        counts[item] = counts.get(item, 0) + n
+        # Pruning is done in batches, so it costs O(log k) per update.
+        if len(counts) > 2 * self.k:
+            self._prune()
+
+
+    def merge(self, other):
+        for item, n in other.counts.items():
+            self.counts[item] = self.counts.get(item, 0) + n
+        self.error += other.error
+        self._prune()
+        return self
+
+
+    def _prune(self):
+        if len(self.counts) <= self.k:
+            return
+        ordered = sorted(self.counts.values(), reverse=True)
+        cut = ordered[self.k]
+        self.error += cut
+        self.counts = {item: n - cut for item, n in self.counts.items() if n > cut}
+
+
+    def top(self, n=None):
+        """Returns up to n (default k) (item, count) pairs, most frequent
+        first.  Ties are broken by item, so the order doesn't depend on how
+        the stream was split up.
+
+        """
+        self._prune()
+        return sorted(self.counts.items(), key=lambda x: (-x[1], x[0]))[:n or self.k]
+
+
+class Summary:
+    """Aggregates over a stream of RevisionData:
+
+      revisions, pages: how many of each were seen.
+      deleted_users: revisions whose contributor was deleted.
+      deleted_comments, empty_comments: revisions with a deleted or an
+        empty comment.
+      comment_lengths: a histogram of comment lengths in characters,
+        where bucket i counts lengths from 2**(i-1) to 2**i - 1 (bucket 0
+        is the empty comment).
+      users: the edit count of the most active users.
+      users_with_deleted_comments: the same, counting only revisions
+        whose comment was deleted.
+      prefixes: the most common comment prefixes, of the first
+        prefix_length characters.
+
+    """
+    def __init__(self, k=DEFAULT_K, prefix_length=DEFAULT_PREFIX_LENGTH):
+        self.k = k
+        self.prefix_length = prefix_length
+        self.revisions = 0
+        self.pages = 0
+        self.deleted_users = 0
+        self.deleted_comments = 0
+        self.empty_comments = 0
+        self.comment_lengths = []
+        self.users = FrequentItems(k)
+        self.users_with_deleted_comments = FrequentItems(k)
+        self.prefixes = FrequentItems(k)
+
+
+    def add(self, revision):
+        self.revisions += 1
+        user = revision.user
+        comment = revision.comment
+        if user is None:
+            self.deleted_users += 1
+        else:
+            self.users.update(user)
+        if comment is None:
+            self.deleted_comments += 1
+            if user is not None:
+                self.users_with_deleted_comments.update(user)
+            return
+        bucket = len(comment).bit_length()
+        lengths = self.comment_lengths
+        if bucket >= len(lengths):
+            lengths.extend([0] * (bucket + 1 - len(lengths)))
+        lengths[bucket] += 1
+        if comment:
+            self.prefixes.update(comment[:self.prefix_length])
+        else:
+            self.empty_comments += 1
+
+
+    def add_all(self, revisions):
+        for revision in revisions:
+            self.add(revision)
+        return self
+
+
+    def merge(self, other):
+        self.revisions += other.revisions
+        self.pages += other.pages
+        self.deleted_users += other.deleted_users
+        self.deleted_comments += other.deleted_comments
+        self.empty_comments += other.empty_comments
+        if len(other.comment_lengths) > len(self.comment_lengths):
+            self.comment_lengths.extend([0] * (len(other.comment_lengths) - len(self.comment_lengths)))
+        for i, n in enumerate(other.comment_lengths):
+            self.comment_lengths[i] += n
+        self.users.merge(other.users)
+        self.users_with_deleted_comments.merge(other.users_with_deleted_comments)
+        self.prefixes.merge(other.prefixes)
+        return self
+
+
+    def asdict(self, top=None):
+        """Returns the summary as a JSON-serializable dict, with the top
+        (default k) entries of each of the frequent item lists.
+
+        """
+        def items(frequent):
+            return {'error': frequent.error,
+                    'top': [[item, n] for item, n in frequent.top(top)],
+                    }
+
+        return {'revisions': self.revisions,
+                'pages': self.pages,
+                'deleted_users': self.deleted_users,
+                'deleted_comments': self.deleted_comments,
+                'empty_comments': self.empty_comments,
+                'comment_lengths': [{'min': 2 ** (i - 1) if i else 0,
+                                     'max': 2 ** i - 1,
+                                     'count': n}
+                                    for i, n in enumerate(self.comment_lengths)],
+                'users': items(self.users),
+                'users_with_deleted_comments': items(self.users_with_deleted_comments),
+                'prefixes': items(self.prefixes),
+                }
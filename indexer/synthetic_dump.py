@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+"""Generate synthetic <mediawiki> 'pages' XML dumps for testing and
+benchmarking.
+
+The output has the same structure as a real pages-meta-history dump
+(siteinfo, page titles and namespaces, revision timestamps,
+contributors, comments, text and sha1), with knobs for the properties
+that matter to parser performance:
+
+  synthetic_dump.py --pages 1000 --revisions 50 --text-size 4000 \\
+      --ip-fraction 0.3 --deleted-fraction 0.05 --bz2 out.xml.bz2
+
+With --multistream INDEX_PATH, the output is bz2 compressed as a
+multistream dump with 100 pages per stream, and the matching index file
+is written to INDEX_PATH.
+
+"""
+
+from argparse import ArgumentParser
+import bz2
+from datetime import datetime, timedelta
+import random
+
+HEADER = '''<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.10/" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:schemaLocation="http://www.mediawiki.org/xml/export-0.10/ http://www.mediawiki.org/xml/export-0.10.xsd" version="0.10" xml:lang="en">
+  <siteinfo>
+    <sitename>Wikipedia</sitename>
+    <dbname>synthwiki</dbname>
+    <base>https://synth.wikipedia.org/wiki/Main_Page</base>
+    <generator>synthetic_dump.py</generator>
+    <case>first-letter</case>
+    <namespaces>
+      <namespace key="0" case="first-letter" />
+      <namespace key="1" case="first-letter">Talk</namespace>
+      <namespace key="2" case="first-letter">User</namespace>
+    </namespaces>
+  </siteinfo>
+'''
+
+FOOTER = '</mediawiki>\n'
+
+WORDS = ('the of and to in a is that for it as was with be by on not he this are or '
+         'his from at which but have an they you were her she there been one all we '
+         'their has would when if so no will can more other its who may about into '
+         'revert vandalism copyedit added removed fix typo citation needed rv wikilink '
+         'infobox category stub expand source ref update clean up section').split()
+
+# Comments also get some escaped markup.  Text doesn't, because it is
+# cut at arbitrary points, which could split an entity.
+COMMENT_WORDS = WORDS + ['&amp;', '[[link]]', '&lt;!-- --&gt;', '/* section */']
+
+STREAM_PAGES = 100
+
+
+class DumpGenerator:
+    """Produces the XML for a synthetic dump, one page at a time.
+
+    pages: number of pages.
+
+    revisions: number of revisions per page.
+
+    text_size: approximate size, in characters, of each revision's
+    <text>.
+
+    ip_fraction: fraction of revisions made by IP (anonymous) editors.
+
+    deleted_fraction: fraction of revisions whose comment is deleted.
+
+    users: number of distinct registered usernames to draw from.
+
+    seed: random seed, so the same parameters always generate the same
+    dump.
+
+    """
+    def __init__(self, pages=100, revisions=10, text_size=2000, ip_fraction=0.2,
+                 deleted_fraction=0.02, users=1000, seed=0):
+        self.pages = pages
+        self.revisions = revisions
+        self.text_size = text_size
+        self.ip_fraction = ip_fraction
+        self.deleted_fraction = deleted_fraction
+        self.users = users
+        self.random = random.Random(seed)
+        # Revision texts are slices of one long random text, which is
+        # much faster than generating each one from scratch.
+        self.corpus = ' '.join(self.random.choice(WORDS) for _ in range(max(text_size, 1000)))
+
+
+    def header(self):
+        return HEADER
+
+
+    def footer(self):
+        return FOOTER
+
+
+    def iter_pages(self):
+        """Returns an iterator over (page_id, xml) tuples.
+
+        """
+        rev_id = 1000
+        timestamp = datetime(2005, 1, 1)
+        for page_id in range(1, self.pages + 1):
+            parts = ['  <page>\n'
+                     f'    <title>Synthetic page {page_id}</title>\n'
+                     f'    <ns>{page_id % 3}</ns>\n'
+                     f'    <id>{page_id}</id>\n']
+            parent_id = None
+            for _ in range(self.revisions):
+                rev_id += self.random.randint(1, 50)
+                timestamp += timedelta(seconds=self.random.randint(1, 100000))
+                parts.append(self.revision(rev_id, parent_id, timestamp))
+                parent_id = rev_id
+            parts.append('  </page>\n')
+            yield page_id, ''.join(parts)
+
+
+    def revision(self, rev_id, parent_id, timestamp):
+        r = self.random
+        if r.random() < self.ip_fraction:
+            contributor = f'        <ip>198.51.{r.randint(0, 255)}.{r.randint(0, 255)}</ip>\n'
+        else:
+            user = r.randint(1, self.users)
+            contributor = (f'        <username>User {user}</username>\n'
+                           f'        <id>{user}</id>\n')
+        if r.random() < self.deleted_fraction:
+            comment = '      <comment deleted="deleted" />\n'
+        else:
+            words = ' '.join(r.choice(COMMENT_WORDS) for _ in range(r.randint(0, 12)))
+            comment = f'      <comment>{words}</comment>\n'
+        start = r.randint(0, len(self.corpus) - 1)
+        text = self.corpus[start:start + self.text_size]
+        parent = f'      <parentid>{parent_id}</parentid>\n' if parent_id else ''
+        return (f'    <revision>\n'
+                f'      <id>{rev_id}</id>\n'
+                f'{parent}'
+                f'      <timestamp>{timestamp:%Y-%m-%dT%H:%M:%SZ}</timestamp>\n'
+                f'      <contributor>\n'
+                f'{contributor}'
+                f'      </contributor>\n'
+                f'{comment}'
+                f'      <model>wikitext</model>\n'
+                f'      <format>text/x-wiki</format>\n'
+                f'      <text bytes="{len(text)}" xml:space="preserve">{text}</text>\n'
+                f'      <sha1>{r.getrandbits(160):032x}</sha1>\n'
+                f'    </revision>\n')
+
+
+    def write(self, path, compress=False):
+        """Writes the dump to path, bz2 compressed if compress is true.
+
+        """
+        opener = bz2.open if compress else open
+        with opener(path, 'wt', encoding='utf-8') as f:
+            f.write(self.header())
+            for _, xml in self.iter_pages():
+                f.write(xml)
+            f.write(self.footer())
+
+
+    def write_multistream(self, path, index_path):
+        """Writes the dump to path as a multistream bz2 file, and its index
+        to index_path.
+
+        """
+        with open(path, 'wb') as f, bz2.open(index_path, 'wt', encoding='utf-8') as index:
+            f.write(bz2.compress(self.header().encode('utf-8')))
+            offset = f.tell()
+            stream = []
+            for page_id, xml in self.iter_pages():
+                index.write(f'{offset}:{page_id}:Synthetic page {page_id}\n')
+                stream.append(xml)
+                if len(stream) == STREAM_PAGES:
+                    f.write(bz2.compress(''.join(stream).encode('utf-8')))
+                    offset = f.tell()
+                    stream = []
+            if stream:
+                f.write(bz2.compress(''.join(stream).encode('utf-8')))
+            f.write(bz2.compress(self.footer().encode('utf-8')))
+
+
+def main():
+    parser = ArgumentParser(description='Generate a synthetic pages XML dump')
+    parser.add_argument('path',
+                        help='output file')
+    parser.add_argument('--pages', type=int, default=100,
+                        help='number of pages (default %(default)s)')
+    parser.add_argument('--revisions', type=int, default=10,
+                        help='revisions per page (default %(default)s)')
+    parser.add_argument('--text-size', type=int, default=2000,
+                        help='characters of text per revision (default %(default)s)')
+    parser.add_argument('--ip-fraction', type=float, default=0.2,
+                        help='fraction of IP contributors (default %(default)s)')
+    parser.add_argument('--deleted-fraction', type=float, default=0.02,
+                        help='fraction of deleted comments (default %(default)s)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed (default %(default)s)')
+    parser.add_argument('--bz2', action='store_true',
+                        help='bz2 compress the output')
+    parser.add_argument('--multistream', metavar='INDEX_PATH',
+                        help='write a multistream bz2 dump, with its index in INDEX_PATH')
+    args = parser.parse_args()
+
+    generator = DumpGenerator(pages=args.pages,
+                              revisions=args.revisions,
+                              text_size=args.text_size,
+                              ip_fraction=args.ip_fraction,
+                              deleted_fraction=args.deleted_fraction,
+                              seed=args.seed)
+    if args.multistream:
+        generator.write_multistream(args.path, args.multistream)
+    else:
+        generator.write(args.path, compress=args.bz2)
+
+
+if __name__ == '__main__':
+    main()
@@ -15,26 +15,31 @@ unset DJANGO_SETTINGS_MODULE before starting celery.
 
 from argparse import ArgumentParser
 import bz2
-from configparser import ConfigParser
+from contextlib import contextmanager, nullcontext
 import glob
 import logging
 import os
 from pathlib import Path
 
 from celery import Celery
-from celery.signals import after_setup_logger
-from opensearchpy import OpenSearch
+from celery.signals import after_setup_logger, worker_process_init
 
+from checkpoint import Checkpoint, Progress
 from dump_file import PagesDumpFile
-from wp_search_tools.utils.progress import ProgressMonitor
+from multistream import MultistreamDumpFile, index_path_for, open_range
+from pipeline import Pipeline
+from revision_cache import RevisionCacheFile, is_cache_file
+from revision_table import RevisionTable
+from wp_search_tools.utils.bulk import BulkIndexer, serialize
+from wp_search_tools.utils.client import get_client, read_config
+from wp_search_tools.utils.indices import create_index
+from wp_search_tools.utils.profiling import NULL_TIMER, SamplingProfiler, StageTimer
+from wp_search_tools.utils.progress import RateMonitor
 
 logger = logging.getLogger('wp_search_tools.tasks')
-progress_logger = ProgressMonitor(logger, count=10)
 
 
-config = ConfigParser()
-config.read(Path.home() / '.elasticsearch.ini')
-config.read(Path(os.environ['SEARCH_TOOLS']) / 'wp_search_tools/indexer/config.ini')
+config = read_config(Path(os.environ['SEARCH_TOOLS']) / 'wp_search_tools/indexer/config.ini')
 
 app = Celery(broker=config.get('celery', 'broker'),
              backend=config.get('celery', 'backend'))
@@ -53,39 +58,396 @@ def setup_loggers(logger, format, **kwargs):
     logger.addHandler(handler)
 
 
-@app.task
-def process_path(path, expected_pages, dry_run=False):
+@worker_process_init.connect
+def init_worker(**kwargs):
+    """Creates each worker process's client (and the index, if need be)
+    as the process starts, so its first task doesn't wait for them.
+
+    """
+    try:
+        connect()
+    except Exception as ex:
+        # The first task will try again, and report the error properly.
+        logger.warning('Unable to connect at worker start: %s', ex)
+
+
+@app.task(bind=True)
+def process_path(self, path, expected_pages=None, dry_run=False, incremental=False):
     """Ingest a dump file and (optionally) index each of the revisions.
 
     path is an absolute path to the dump file.  If the path ends
-    in in .bz2, it is decompressed on the fly.
+    in in .bz2, it is decompressed on the fly.  If path is a multistream
+    dump and its index file is present, the streams are decompressed
+    and parsed in parallel by a pool of processes.  path may also be a
+    revision cache file written by revision_cache.py, in which case no
+    XML parsing is needed at all.
 
-    expected_pages is a rough estimate of the number of pages which
-    are expected to be in the dump file.  This is only used to produce
-    log messages about job progress, so an exact count is not immportant.
+    Progress (counts, rates, bulk request latency, and percent done and
+    ETA based on how much of the file has been read) is logged every
+    [indexer] progress_interval seconds and published as the task's
+    PROGRESS state; see monitor().  expected_pages is an optional rough
+    estimate of the number of pages in the file, used for the percent
+    done when the file position isn't known (e.g. for a cache file).
 
     If dry_run is true, the dump file is parsed as normal, but
     revisions are not uploaded to elasticsearch,
 
-    Returns a dict with status information.
+    Revisions are sent in batches using the _bulk API.  The batch
+    size (in documents and bytes) and the number of concurrent bulk
+    requests are set in the [indexer] section of the config.
+
+    Each revision is indexed with its rev_id as the document id, so
+    re-indexing the same revision is harmless.  Progress is saved in a
+    checkpoint every [indexer] checkpoint_pages pages; if the task is
+    interrupted, running it again on the same file skips the pages
+    which were already indexed.
+
+    If incremental is true, a revision table (see revision_table.py)
+    records the highest rev_id indexed for every page, and revisions at
+    or below it are skipped by the parser.  This makes indexing a new
+    monthly dump cost about as much as the revisions which are new
+    since the last one.
+
+    A compressed dump is decompressed by the fastest decompressor
+    available on this host, unless [indexer] decompressors says
+    otherwise; which one was used, and its throughput, are included in
+    the result as 'decompression'.
+
+    If [indexer] profile is true, the time spent in each stage (reading
+    and decompressing, parsing, serializing and indexing) is logged and
+    included in the result as 'stages'.  If [indexer] profile_samples
+    is set, a sampling profile is also written to that directory.
+
+    Returns a dict with status information, including counts of
+    indexed, skipped and failed revisions, a sample of the per-item
+    errors, and throughput.
+
+    """
+    es, index_name = connect()
+
+    logger.info('Processing file "%s"', path)
+    checkpoint = None if dry_run else Checkpoint(checkpoint_dir(), path, index_name)
+    resume_after = resume_point(checkpoint, path)
+    timer = make_timer()
+    totals = {'bytes': os.path.getsize(path), 'pages': expected_pages}
+    with revision_tables(index_name, incremental) as (table, known), \
+         monitor(self, path, totals) as (rate_monitor, report), \
+         sampling_profiler(path):
+        index_path = index_path_for(path)
+        if is_cache_file(path):
+            df = RevisionCacheFile(resume_after=resume_after, known_revisions=known, timer=timer)
+        elif index_path and os.path.exists(index_path):
+            logger.info('Using multistream index "%s"', index_path)
+            workers = config.getint('indexer', 'multistream_workers', fallback=None)
+            df = MultistreamDumpFile(workers=workers, resume_after=resume_after,
+                                     known_revisions=known, timer=timer)
+        else:
+            df = PagesDumpFile(resume_after=resume_after, known_revisions=known, timer=timer,
+                               decompressors=decompressors(),
+                               decompress_threads=decompress_threads())
+        return index_revisions(es, index_name, path, df, df.process(path), dry_run,
+                               rate_monitor, report, checkpoint, table)
+
+
+@app.task(bind=True)
+def process_range(self, path, start, end, dry_run=False, incremental=False):
+    """Ingest part of a multistream dump file and (optionally) index each
+    of the revisions.
+
+    start and end are byte offsets into the file.  They must fall on
+    bz2 stream boundaries, as given by the multistream index.
+
+    Like process_path(), progress is checkpointed, and a rerun of the
+    same range resumes where the last one stopped.  incremental works
+    the same way as for process_path().
+
+    Returns a dict with status information, in the same form as
+    process_path().
+
+    """
+    es, index_name = connect()
+
+    logger.info('Processing bytes %d-%d of file "%s"', start, end, path)
+    checkpoint = None if dry_run else Checkpoint(checkpoint_dir(), path, start, end, index_name)
+    resume_after = resume_point(checkpoint, path)
+    with revision_tables(index_name, incremental) as (table, known), \
+         monitor(self, f'{path} bytes {start}-{end}') as (rate_monitor, report), \
+         sampling_profiler(f'{path}-{start}-{end}'), \
+         open_range(path, start, end) as stream:
+        df = PagesDumpFile(resume_after=resume_after, known_revisions=known, timer=make_timer())
+        result = index_revisions(es, index_name, path, df, df.parse(stream, fragment=True),
+                                 dry_run, rate_monitor, report, checkpoint, table)
+    result.update(start=start, end=end)
+    return result
+
+
+@app.task
+def merge_results(results):
+    """Chord callback which combines the results of several
+    process_range() tasks into one.
+
+    """
+    merged = {'chunks': len(results)}
+    for key in ('pages', 'revisions', 'skipped', 'indexed', 'failed'):
+        merged[key] = sum(r[key] for r in results)
+    merged['errors'] = [e for r in results for e in r['errors']][:100]
+    merged['seconds'] = max((r['seconds'] for r in results), default=0.0)
+    merged['revisions_per_second'] = sum(r['revisions_per_second'] for r in results)
+    return merged
+
+
+_created_indices = set()
+
+
+def connect():
+    """Returns an (OpenSearch, index_name) tuple.  The client is shared
+    by every task which runs in this process (see utils/client.py), and
+    the index is created, if needed, the first time only.
 
     """
-    user = config.get('elasticsearch', 'user')
-    password = config.get('elasticsearch', 'password')
-    server = config.get('elasticsearch', 'server')
+    es = get_client(config, threads=config.getint('indexer', 'concurrency', fallback=2))
     index_name = config.get('elasticsearch', 'index')
+    if index_name not in _created_indices:
+        create_index(es, index_name)
+        _created_indices.add(index_name)
+    return es, index_name
 
-    es = OpenSearch(server, http_auth=(user, password))
-    es.indices.create(index_name, ignore=400)
 
-    logger.info('Processing file "%s"', path)
-    df = PagesDumpFile()
-    for revision in df.process(path):
+def decompressors():
+    """Returns the names of the decompressors to try first (see
+    openers.py), from [indexer] decompressors.
+
+    """
+    names = config.get('indexer', 'decompressors', fallback='')
+    return [name.strip() for name in names.split(',') if name.strip()]
+
+
+def decompress_threads():
+    """Returns the number of threads a multi-threaded decompressor may
+    use, from [indexer] decompress_threads.  The default shares the
+    CPUs between the worker processes, rather than giving each of them
+    one thread per CPU.
+
+    """
+    threads = config.getint('indexer', 'decompress_threads', fallback=None)
+    if threads is None:
+        cpus = os.cpu_count() or 1
+        threads = max(1, cpus // (app.conf.worker_concurrency or cpus))
+    return threads
+
+
+def checkpoint_dir():
+    return config.get('indexer', 'checkpoint_dir',
+                      fallback=str(Path(os.environ['SEARCH_TOOLS']) / 'checkpoints'))
+
+
+def open_revision_table(index_name):
+    """Returns the RevisionTable for index_name.  There is one table per
+    index, shared by all the tasks indexing into it.
+
+    """
+    default = Path(os.environ['SEARCH_TOOLS']) / 'revision-tables' / f'{index_name}.table'
+    path = Path(config.get('indexer', 'revision_table', fallback=str(default)))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return RevisionTable(path)
+
+
+@contextmanager
+def revision_tables(index_name, incremental):
+    """Context manager which returns a (table, known_revisions) pair: the
+    RevisionTable for index_name, which index_revisions() updates, and a
+    separate read-only view of it for the parser, which runs in another
+    thread.  Both are None unless incremental is true.
+
+    """
+    if not incremental:
+        yield None, None
+        return
+    with open_revision_table(index_name) as table, table.reader() as known:
+        yield table, known
+
+
+def make_timer():
+    """Returns a StageTimer if [indexer] profile is true, else NULL_TIMER.
+
+    """
+    if config.getboolean('indexer', 'profile', fallback=False):
+        return StageTimer()
+    return NULL_TIMER
+
+
+def sampling_profiler(path):
+    """Returns a SamplingProfiler writing to [indexer] profile_samples, if
+    that is set, or else a context manager which does nothing.
+
+    """
+    directory = config.get('indexer', 'profile_samples', fallback=None)
+    if not directory:
+        return nullcontext()
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    output = Path(directory) / f'{Path(path).name}-{os.getpid()}.folded'
+    return SamplingProfiler(output, config.getfloat('indexer', 'profile_interval', fallback=0.005))
+
+
+@contextmanager
+def monitor(task, description, totals=None):
+    """Context manager which returns a (RateMonitor, report) pair for
+    task.  report(snapshot) logs the snapshot and, when running in a
+    worker, publishes it as the task's PROGRESS state, where it can be
+    read with AsyncResult.info.
+
+    If [indexer] metrics_port is set, the monitor is also served over
+    HTTP (see RateMonitor.serve()) while the task runs.  Only one task
+    per host can have the port, so with several worker processes the
+    others just log a warning.
+
+    """
+    interval = config.getfloat('indexer', 'progress_interval', fallback=10.0)
+    rate_monitor = RateMonitor({k: v for k, v in (totals or {}).items() if v},
+                               window=max(60.0, 6 * interval), resolution=interval)
+
+    def report(snapshot):
+        logger.info('Progress of "%s": %d pages, %d revisions (%.1f/s), %s%% done, ETA %s seconds',
+                    description, snapshot.get('pages', 0), snapshot.get('revisions', 0),
+                    snapshot.get('revisions_per_second', 0.0),
+                    snapshot['percent'], snapshot['eta_seconds'])
+        if task.request.id:
+            task.update_state(state='PROGRESS', meta=snapshot)
+
+    server = None
+    port = config.getint('indexer', 'metrics_port', fallback=None)
+    if port is not None:
+        try:
+            server = rate_monitor.serve(port, config.get('indexer', 'metrics_host',
+                                                         fallback='127.0.0.1'))
+        except OSError as ex:
+            logger.warning('Not serving metrics on port %d: %s', port, ex)
+    try:
+        yield rate_monitor, report
+    finally:
+        if server:
+            server.shutdown()
+            server.server_close()
+
+
+def resume_point(checkpoint, path):
+    """Returns the id of the last page recorded in checkpoint, or None
+    to start from the beginning.
+
+    """
+    state = checkpoint and checkpoint.load()
+    if not state:
+        return None
+    logger.info('Resuming "%s" after page %d', path, state['page_id'])
+    return state['page_id']
+
+
+def index_revisions(es, index_name, path, df, revisions, dry_run, rate_monitor, report,
+                    checkpoint=None, table=None):
+    """Send each of the revisions to elasticsearch (unless dry_run is
+    true).  Whenever rate_monitor is due, it is sampled and report() is
+    called with its snapshot.
+
+    If checkpoint is given, it is updated every checkpoint_pages pages,
+    once everything up to the end of the previous page has been
+    acknowledged, and cleared when all the revisions are done.  If any
+    revision fails to index, it is left where it was before the failure
+    (see checkpoint.Progress), so a rerun sends the failed ones again.
+
+    If table is given (a RevisionTable), it is updated with the
+    revisions which have been acknowledged at the same points, leaving
+    out any page with a revision which failed.
+
+    The revisions are parsed in a thread of their own, which stays up to
+    [indexer] pipeline_depth batches of batch_docs revisions ahead (see
+    pipeline.py).  The queue statistics are logged and included in the
+    result as 'pipeline'.
+
+    The time spent serializing and indexing revisions (the latter
+    including any time spent waiting for bulk requests to finish) is
+    charged to df.timer, along with the individual request times, from
+    whichever thread sent them, as 'bulk_request'.
+
+    Returns the task result dict.
+
+    """
+    timer = df.timer
+    checkpoint_pages = config.getint('indexer', 'checkpoint_pages', fallback=1000)
+    batch_docs = config.getint('indexer', 'batch_docs', fallback=1000)
+    last_page_id = None
+    # The parser runs ahead, so df.pages can't be used to decide when to
+    # save a checkpoint; pages are counted as they are consumed instead.
+    pages = 0
+    checkpointed_pages = 0
+    progress = Progress(checkpoint, table)
+    def on_request(seconds):
+        rate_monitor.observe('index_latency', seconds)
+        timer.add('bulk_request', seconds)
+
+    indexer = BulkIndexer(es, index_name,
+                          batch_docs=batch_docs,
+                          batch_bytes=config.getint('indexer', 'batch_bytes', fallback=5*1024*1024),
+                          concurrency=config.getint('indexer', 'concurrency', fallback=2),
+                          on_request=on_request)
+
+    def sample():
+        rate_monitor.sample(pages=df.pages, revisions=df.revisions, skipped=df.skipped,
+                            bytes=df.position(), indexed=indexer.indexed, failed=indexer.failed)
+
+    def commit(**state):
+        with timer.stage('index'):
+            indexer.flush()
+            indexer.wait()
+        progress.commit(indexer.take_failed(), **state)
+
+    pipeline = Pipeline(revisions, batch_size=batch_docs,
+                        depth=config.getint('indexer', 'pipeline_depth', fallback=4))
+    with indexer, pipeline:
+        for batch in pipeline:
+            for revision in batch:
+                if revision.page_id != last_page_id:
+                    if (checkpoint and last_page_id is not None
+                            and pages - checkpointed_pages >= checkpoint_pages):
+                        commit(page_id=last_page_id, pages=pages)
+                        checkpointed_pages = pages
+                    last_page_id = revision.page_id
+                    pages += 1
+                if not dry_run:
+                    # The same calls either way; the timed version is only
+                    # split in two to charge each half to its stage.
+                    if timer.enabled:
+                        with timer.stage('serialize'):
+                            source = serialize(revision.asdict())
+                        with timer.stage('index'):
+                            indexer.add_raw(source, doc_id=revision.rev_id)
+                    else:
+                        indexer.add_raw(serialize(revision.asdict()), doc_id=revision.rev_id)
+                    progress.sent(revision.page_id, revision.rev_id)
+            if rate_monitor.due():
+                sample()
+                report(rate_monitor.snapshot())
         if not dry_run:
-            es.index(index_name, revision.asdict())
-        percent = (100.0 * df.pages) / expected_pages
-        progress_logger.info('Done with %d of %d (%.0f%%) pages', df.pages, expected_pages, percent)
+            commit()
+    progress.finish(indexer.take_failed())
+    stats = indexer.stats()
+    sample()
+    snapshot = rate_monitor.snapshot()
+    logger.info('Finished "%s": %d indexed, %d failed, %.1f docs/s',
+                path, stats['indexed'], stats['failed'], stats['docs_per_second'])
+    if timer.enabled:
+        logger.info('Stage times for "%s": %s', path, timer.format())
+    logger.info('Pipeline for "%s": %s', path, pipeline.stats())
 
     return {'pages': df.pages,
             'revisions': df.revisions,
+            'skipped': df.skipped,
+            'indexed': stats['indexed'],
+            'failed': stats['failed'],
+            'errors': stats['errors'],
+            'seconds': stats['seconds'],
+            'revisions_per_second': round(df.revisions / stats['seconds'], 1) if stats['seconds'] else 0.0,
+            'index_latency': snapshot.get('index_latency'),
+            'stages': timer.report(),
+            'pipeline': pipeline.stats(),
+            'decompression': df.decompression,
             }
@@ -0,0 +1,150 @@
+from io import StringIO
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import Mock
+
+from wp_search_tools.indexer.checkpoint import Checkpoint, Progress
+from wp_search_tools.indexer.dump_file import PagesDumpFile, RevisionData
+from wp_search_tools.indexer.revision_table import RevisionTable
+from wp_search_tools.utils.bulk import BulkIndexer
+
+
+DATA = '''
+<mediawiki>
+  <page>
+    <id>1</id>
+    <revision>
+      <id>101</id>
+      <contributor>
+        <username>name 1</username>
+      </contributor>
+      <comment>comment 1</comment>
+    </revision>
+  </page>
+  <page>
+    <id>2</id>
+    <revision>
+      <id>201</id>
+      <contributor>
+        <username>name 2</username>
+      </contributor>
+      <comment>comment 2</comment>
+    </revision>
+  </page>
+</mediawiki>
+'''
+
+
+class CheckpointTest(TestCase):
+
+    def test_load_without_checkpoint_returns_none(self):
+        with TemporaryDirectory() as tmp:
+            self.assertIsNone(Checkpoint(tmp, 'foo.bz2', 'index').load())
+
+
+    def test_saved_state_is_loaded(self):
+        with TemporaryDirectory() as tmp:
+            Checkpoint(tmp, 'foo.bz2', 'index').save(page_id=42, pages=7)
+            state = Checkpoint(tmp, 'foo.bz2', 'index').load()
+            self.assertEqual(state['page_id'], 42)
+            self.assertEqual(state['pages'], 7)
+
+
+    def test_different_keys_have_different_checkpoints(self):
+        with TemporaryDirectory() as tmp:
+            Checkpoint(tmp, 'foo.bz2', 'index').save(page_id=42)
+            self.assertIsNone(Checkpoint(tmp, 'foo.bz2', 'other-index').load())
+
+
+    def test_clear_removes_checkpoint(self):
+        with TemporaryDirectory() as tmp:
+            checkpoint = Checkpoint(tmp, 'foo.bz2', 'index')
+            checkpoint.save(page_id=42)
+            checkpoint.clear()
+            checkpoint.clear()
+            self.assertIsNone(checkpoint.load())
+
+
+def bulk_response(body, index):
+    """A _bulk stub which fails every document whose _id ends in 2.
+
+    """
+    actions = body.splitlines()[::2]
+    items = []
+    for action in actions:
+        doc_id = action.split(b'"_id":"')[1].split(b'"')[0].decode()
+        status = 400 if doc_id.endswith('2') else 201
+        items.append({'index': {'_id': doc_id, 'status': status}})
+    return {'errors': any(item['index']['status'] >= 300 for item in items), 'items': items}
+
+
+class ProgressTest(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.checkpoint = Checkpoint(self.tmp_dir.name, 'foo.bz2', 'index')
+        es = Mock()
+        es.bulk.side_effect = bulk_response
+        self.indexer = BulkIndexer(es, 'index')
+        self.progress = Progress(self.checkpoint)
+
+
+    def send(self, page_id, *rev_ids):
+        for rev_id in rev_ids:
+            self.indexer.add({'page_id': page_id}, doc_id=rev_id)
+            self.progress.sent(page_id, rev_id)
+        self.indexer.flush()
+        self.indexer.wait()
+
+
+    def test_checkpoint_advances_while_everything_is_indexed(self):
+        self.send(1, 101, 103)
+        self.progress.commit(self.indexer.take_failed(), page_id=1, pages=1)
+        self.assertEqual(self.checkpoint.load()['page_id'], 1)
+        self.progress.finish(self.indexer.take_failed())
+        self.assertIsNone(self.checkpoint.load())
+
+
+    def test_checkpoint_stops_at_failure(self):
+        self.send(1, 101)
+        self.progress.commit(self.indexer.take_failed(), page_id=1, pages=1)
+        self.send(2, 201, 202)
+        self.progress.commit(self.indexer.take_failed(), page_id=2, pages=2)
+        self.send(3, 301)
+        self.progress.commit(self.indexer.take_failed(), page_id=3, pages=3)
+        self.assertEqual(self.indexer.failed, 1)
+        self.assertEqual(self.progress.failed_pages, {2})
+        self.assertEqual(self.checkpoint.load()['page_id'], 1)
+        self.progress.finish(self.indexer.take_failed())
+        self.assertEqual(self.checkpoint.load()['page_id'], 1)
+
+
+    def test_failure_before_first_checkpoint_leaves_none(self):
+        self.send(1, 102)
+        self.progress.finish(self.indexer.take_failed())
+        self.assertIsNone(self.checkpoint.load())
+        self.assertEqual(self.progress.failures, 1)
+
+
+    def test_table_leaves_out_failed_pages(self):
+        with RevisionTable(f'{self.tmp_dir.name}/table') as table:
+            self.progress = Progress(None, table)
+            self.send(1, 101, 103)
+            self.send(2, 201, 202, 203)
+            self.progress.commit(self.indexer.take_failed())
+            self.send(3, 301)
+            self.progress.finish(self.indexer.take_failed())
+            self.assertEqual([table.get(page_id) for page_id in (1, 2, 3)], [103, 0, 301])
+
+
+class ResumeTest(TestCase):
+
+    def test_pages_up_to_resume_point_are_skipped(self):
+        for backend in PagesDumpFile.BACKENDS:
+            with self.subTest(backend=backend):
+                df = PagesDumpFile(backend=backend, resume_after=1)
+                docs = list(df.parse(StringIO(DATA)))
+                self.assertEqual(docs, [RevisionData(2, 201, 'name 2', 'comment 2')])
+                self.assertEqual(df.pages, 2)
+                self.assertEqual(df.revisions, 1)
@@ -1,43 +1,51 @@
+from array import array
 import bz2
 from io import StringIO
+import os
+from pathlib import Path
 from pprint import pprint
+import pickle
+from tempfile import TemporaryDirectory
 from unittest import TestCase
 from unittest.mock import Mock, call, patch, mock_open
 
-from wp_search_tools.indexer.dump_file import PagesDumpFile, RevisionData
+from wp_search_tools.indexer.dump_file import (NO_USER, PagesDumpFile, RevisionBatch, RevisionData,
+                                               UserInterner, batched)
+from wp_search_tools.utils.profiling import StageTimer
 
 
 class PagesDumpFileTest(TestCase):
+    backend = 'iterparse'
 
     def test_construct(self):
-        df = PagesDumpFile()
+        df = PagesDumpFile(backend=self.backend)
 
 
     def test_reports_zero_pages_and_zero_revisions_before_procesing(self):
-        df = PagesDumpFile()
+        df = PagesDumpFile(backend=self.backend)
         self.assertEqual(df.pages, 0)
         self.assertEqual(df.revisions, 0)
 
 
     def test_builtin_open_is_called_with_normal_path(self):
         m = mock_open()
-        with patch('wp_search_tools.indexer.dump_file.open', new=m):
-            df = PagesDumpFile()
+        with patch('wp_search_tools.indexer.openers.open', new=m):
+            df = PagesDumpFile(backend=self.backend)
             list(df.process('foo'))
             m.assert_called_once_with('foo')
 
 
     def test_bz2_open_is_called_with_bz2_path(self):
-        with patch('wp_search_tools.indexer.dump_file.bz2.open', autospec=True) as m:
+        with patch('wp_search_tools.indexer.openers.bz2.open', autospec=True) as m:
             m.return_value = StringIO()
-            df = PagesDumpFile()
+            df = PagesDumpFile(backend=self.backend, decompressors=['bz2'])
             list(df.process('foo.bz2'))
             m.assert_called_once_with('foo.bz2')
 
 
     def test_empty_input_generates_no_items(self):
         stream = StringIO('')
-        df = PagesDumpFile()
+        df = PagesDumpFile(backend=self.backend)
         docs = list(df.process('/dev/null'))
         self.assertEqual(docs, [])
 
@@ -58,9 +66,9 @@ class PagesDumpFileTest(TestCase):
         </mediawiki>
         '''
         m = mock_open()
-        with patch('wp_search_tools.indexer.dump_file.open', new=m):
+        with patch('wp_search_tools.indexer.openers.open', new=m):
             m.return_value = StringIO(data)
-            df = PagesDumpFile()
+            df = PagesDumpFile(backend=self.backend)
             docs = list(df.process('xxx'))
             m.assert_called_once_with('xxx')
             self.assertEqual(docs, [RevisionData(1, 999, 'name', 'text')])
@@ -99,9 +107,9 @@ class PagesDumpFileTest(TestCase):
         </mediawiki>
         '''
         m = mock_open()
-        with patch('wp_search_tools.indexer.dump_file.open', new=m):
+        with patch('wp_search_tools.indexer.openers.open', new=m):
             m.return_value = StringIO(data)
-            df = PagesDumpFile()
+            df = PagesDumpFile(backend=self.backend)
             docs = list(df.process('xxx'))
             m.assert_called_once_with('xxx')
             self.assertEqual(docs, [RevisionData(1, 101, 'name 1', 'comment 1'),
@@ -142,15 +150,86 @@ class PagesDumpFileTest(TestCase):
         </mediawiki>
         '''
         m = mock_open()
-        with patch('wp_search_tools.indexer.dump_file.open', new=m):
+        with patch('wp_search_tools.indexer.openers.open', new=m):
             m.return_value = StringIO(data)
-            df = PagesDumpFile()
+            df = PagesDumpFile(backend=self.backend)
             list(df.process('xxx'))
             m.assert_called_once_with('xxx')
             self.assertEqual(df.pages, 2)
             self.assertEqual(df.revisions, 3)
 
 
+    def test_known_revisions_are_skipped(self):
+        data = '''
+        <mediawiki>
+          <page>
+            <id>1</id>
+            <revision>
+              <id>101</id>
+              <contributor>
+                <username>name 1</username>
+              </contributor>
+              <comment>comment 1</comment>
+            </revision>
+            <revision>
+              <id>102</id>
+              <contributor>
+                <username>name 1</username>
+              </contributor>
+              <comment>comment 2</comment>
+            </revision>
+          </page>
+          <page>
+            <id>2</id>
+            <revision>
+              <id>201</id>
+              <contributor>
+                <username>name 1</username>
+              </contributor>
+              <comment>comment 3</comment>
+            </revision>
+          </page>
+        </mediawiki>
+        '''
+        df = PagesDumpFile(backend=self.backend, known_revisions={1: 101, 2: 0})
+        docs = list(df.parse(StringIO(data)))
+        self.assertEqual([d.rev_id for d in docs], [102, 201])
+        self.assertEqual(df.pages, 2)
+        self.assertEqual(df.revisions, 2)
+        self.assertEqual(df.skipped, 1)
+
+
+    def test_users_of_skipped_revisions_are_not_looked_at(self):
+        data = '''
+        <mediawiki>
+          <page>
+            <id>1</id>
+            <revision>
+              <id>101</id>
+              <contributor><username>skipped 1</username></contributor>
+            </revision>
+          </page>
+          <page>
+            <id>2</id>
+            <revision>
+              <id>201</id>
+              <contributor><username>known</username></contributor>
+            </revision>
+            <revision>
+              <id>202</id>
+              <contributor><username>new</username></contributor>
+            </revision>
+          </page>
+        </mediawiki>
+        '''
+        df = PagesDumpFile(backend=self.backend, resume_after=1, known_revisions={2: 201})
+        df.user_interner = Mock(side_effect=lambda name: name)
+        docs = list(df.parse(StringIO(data)))
+        self.assertEqual([(d.rev_id, d.user) for d in docs], [(202, 'new')])
+        df.user_interner.assert_called_once_with('new')
+        self.assertEqual((df.revisions, df.skipped), (1, 1))
+
+
     def test_empty_comment_generates_empty_comment_string(self):
         data = '''
         <mediawiki>
@@ -167,9 +246,9 @@ class PagesDumpFileTest(TestCase):
         </mediawiki>
         '''
         m = mock_open()
-        with patch('wp_search_tools.indexer.dump_file.open', new=m):
+        with patch('wp_search_tools.indexer.openers.open', new=m):
             m.return_value = StringIO(data)
-            df = PagesDumpFile()
+            df = PagesDumpFile(backend=self.backend)
             docs = list(df.process('xxx'))
             m.assert_called_once_with('xxx')
             self.assertEqual(docs, [RevisionData(1, 999, 'name', '')])
@@ -190,9 +269,9 @@ class PagesDumpFileTest(TestCase):
         </mediawiki>
         '''
         m = mock_open()
-        with patch('wp_search_tools.indexer.dump_file.open', new=m):
+        with patch('wp_search_tools.indexer.openers.open', new=m):
             m.return_value = StringIO(data)
-            df = PagesDumpFile()
+            df = PagesDumpFile(backend=self.backend)
             docs = list(df.process('xxx'))
             m.assert_called_once_with('xxx')
             self.assertEqual(docs, [RevisionData(1, 999, 'name', '')])
@@ -214,9 +293,308 @@ class PagesDumpFileTest(TestCase):
         </mediawiki>
         '''
         m = mock_open()
-        with patch('wp_search_tools.indexer.dump_file.open', new=m):
+        with patch('wp_search_tools.indexer.openers.open', new=m):
             m.return_value = StringIO(data)
-            df = PagesDumpFile()
+            df = PagesDumpFile(backend=self.backend)
             docs = list(df.process('xxx'))
             m.assert_called_once_with('xxx')
             self.assertEqual(docs, [RevisionData(1, 999, 'name', None)])
+
+
+    def test_deleted_contributor_generates_none(self):
+        data = '''
+        <mediawiki>
+          <page>
+            <id>1</id>
+            <revision>
+              <id>999</id>
+              <contributor deleted="deleted"/>
+              <comment>text</comment>
+            </revision>
+          </page>
+        </mediawiki>
+        '''
+        df = PagesDumpFile(backend=self.backend)
+        docs = list(df.parse(StringIO(data)))
+        self.assertEqual(docs, [RevisionData(1, 999, None, 'text')])
+
+
+    def test_ip_contributor_generates_ip_address(self):
+        data = '''
+        <mediawiki>
+          <page>
+            <id>1</id>
+            <revision>
+              <id>999</id>
+              <contributor>
+                <ip>192.0.2.1</ip>
+              </contributor>
+              <comment>text</comment>
+            </revision>
+          </page>
+        </mediawiki>
+        '''
+        df = PagesDumpFile(backend=self.backend)
+        docs = list(df.parse(StringIO(data)))
+        self.assertEqual(docs, [RevisionData(1, 999, '192.0.2.1', 'text')])
+
+
+    def test_contributor_id_is_not_taken_as_revision_id(self):
+        data = '''
+        <mediawiki>
+          <page>
+            <id>1</id>
+            <revision>
+              <id>999</id>
+              <contributor>
+                <username>name</username>
+                <id>12345</id>
+              </contributor>
+              <comment>text</comment>
+            </revision>
+          </page>
+        </mediawiki>
+        '''
+        df = PagesDumpFile(backend=self.backend)
+        docs = list(df.parse(StringIO(data)))
+        self.assertEqual(docs, [RevisionData(1, 999, 'name', 'text')])
+
+
+    def test_timestamp_title_and_namespace_are_extracted(self):
+        data = '''
+        <mediawiki>
+          <page>
+            <title>Talk:Zoë</title>
+            <ns>1</ns>
+            <id>1</id>
+            <revision>
+              <id>101</id>
+              <timestamp>2001-01-21T02:12:21Z</timestamp>
+              <contributor>
+                <username>name</username>
+              </contributor>
+              <comment>text</comment>
+            </revision>
+            <revision>
+              <id>102</id>
+              <parentid>101</parentid>
+              <timestamp>2001-01-22T02:12:21Z</timestamp>
+              <contributor>
+                <username>name</username>
+              </contributor>
+            </revision>
+          </page>
+          <page>
+            <title>Foo</title>
+            <ns>0</ns>
+            <id>2</id>
+            <revision>
+              <id>201</id>
+              <contributor>
+                <username>name</username>
+              </contributor>
+            </revision>
+          </page>
+        </mediawiki>
+        '''
+        df = PagesDumpFile(backend=self.backend)
+        docs = list(df.parse(StringIO(data)))
+        self.assertEqual(docs, [RevisionData(1, 101, 'name', 'text', '2001-01-21T02:12:21Z', 'Talk:Zoë', 1),
+                                RevisionData(1, 102, 'name', '', '2001-01-22T02:12:21Z', 'Talk:Zoë', 1),
+                                RevisionData(2, 201, 'name', '', None, 'Foo', 0)])
+
+
+class PulldomPagesDumpFileTest(PagesDumpFileTest):
+    backend = 'pulldom'
+
+
+class BackendComparisonTest(TestCase):
+
+    def test_unknown_backend_raises_value_error(self):
+        with self.assertRaisesRegex(ValueError, 'must be one of'):
+            PagesDumpFile(backend='sax')
+
+
+    def test_backends_agree_on_sample_dump(self):
+        path = str(Path(__file__).parent / 'test/pages-meta-history0.xml-p1p4')
+        results = {}
+        for backend in PagesDumpFile.BACKENDS:
+            df = PagesDumpFile(backend=backend)
+            results[backend] = (list(df.process(path)), df.pages, df.revisions)
+        self.assertEqual(results['iterparse'], results['pulldom'])
+        docs, pages, revisions = results['iterparse']
+        self.assertEqual(pages, 4)
+        self.assertEqual(revisions, len(docs))
+
+
+class UserInterningTest(TestCase):
+
+    def test_maxsize_must_be_a_positive_integer(self):
+        with self.assertRaisesRegex(ValueError, 'positive integer'):
+            UserInterner(0)
+
+
+    def test_equal_names_are_the_same_object(self):
+        intern = UserInterner()
+        first = intern(''.join(['Some', 'Bot']))
+        second = intern(''.join(['Some', 'Bot']))
+        self.assertIs(first, second)
+        self.assertIsNone(intern(None))
+        self.assertEqual((intern.hits, intern.misses), (1, 1))
+
+
+    def test_size_is_bounded_and_active_names_survive(self):
+        intern = UserInterner(4)
+        bot = intern(''.join(['Some', 'Bot']))
+        for i in range(100):
+            intern(f'10.0.0.{i}')
+            if i % 3 == 0:
+                self.assertIs(intern(''.join(['Some', 'Bot'])), bot)
+            self.assertLessEqual(len(intern), 8)
+
+
+    def test_parsers_share_user_strings(self):
+        path = str(Path(__file__).parent / 'test/pages-meta-history0.xml-p1p4')
+        for backend in PagesDumpFile.BACKENDS:
+            with self.subTest(backend=backend):
+                revisions = list(PagesDumpFile(backend=backend).process(path))
+                users = [r.user for r in revisions if r.user is not None]
+                self.assertLess(len(set(map(id, users))), len(users))
+                self.assertEqual(len(set(map(id, users))), len(set(users)))
+
+
+    def test_interning_can_be_turned_off(self):
+        path = str(Path(__file__).parent / 'test/pages-meta-history0.xml-p1p4')
+        df = PagesDumpFile(user_cache_size=None)
+        self.assertIsNone(df.user_interner)
+        self.assertEqual(list(df.process(path)), list(PagesDumpFile().process(path)))
+
+
+class PositionTest(TestCase):
+
+    def test_position_tracks_compressed_bytes_read(self):
+        sample = Path(__file__).parent / 'test/pages-meta-history0.xml-p1p4'
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'dump.xml.bz2')
+            with bz2.open(path, 'wb') as f:
+                f.write(sample.read_bytes())
+            size = os.path.getsize(path)
+            df = PagesDumpFile()
+            self.assertIsNone(df.position())
+            positions = [df.position() for _ in df.process(path)]
+        self.assertTrue(positions)
+        for position in positions:
+            self.assertGreater(position, 0)
+            self.assertLessEqual(position, size)
+        self.assertIsNone(df.position())
+
+
+    def test_position_of_unseekable_stream_is_none(self):
+        data = (Path(__file__).parent / 'test/pages-meta-history0.xml-p1p4').read_text()
+        m = mock_open()
+        with patch('wp_search_tools.indexer.openers.open', new=m):
+            m.return_value = StringIO(data)
+            df = PagesDumpFile()
+            positions = [df.position() for _ in df.process('xxx')]
+        self.assertTrue(positions)
+        self.assertEqual(set(positions), {None})
+
+
+class TimerTest(TestCase):
+
+    def test_read_and_parse_are_timed(self):
+        for backend in PagesDumpFile.BACKENDS:
+            with self.subTest(backend=backend):
+                timer = StageTimer()
+                df = PagesDumpFile(backend=backend, timer=timer)
+                docs = list(df.process(str(Path(__file__).parent / 'test/pages-meta-history0.xml-p1p4')))
+                report = timer.report()
+                self.assertEqual(report['parse']['calls'], len(docs) + 1)
+                self.assertGreater(report['read']['calls'], 0)
+
+
+class RevisionDataTest(TestCase):
+
+    def test_asdict(self):
+        self.assertEqual(RevisionData(1, 2, 'name', None).asdict(),
+                         {'page_id': 1, 'rev_id': 2, 'user': 'name', 'comment': None,
+                          'timestamp': None, 'title': None, 'ns': None})
+
+
+    def test_is_immutable(self):
+        revision = RevisionData(1, 2, 'name', 'text')
+        with self.assertRaises(AttributeError):
+            revision.user = 'other'
+
+
+    def test_survives_pickling(self):
+        revision = RevisionData(1, 2, 'name', 'text')
+        self.assertEqual(pickle.loads(pickle.dumps(revision)), revision)
+
+
+class RevisionBatchTest(TestCase):
+
+    REVISIONS = [RevisionData(1, 101, 'name 1', 'comment 1', '2001-01-21T02:12:21Z', 'Page 1', 0),
+                 RevisionData(1, 102, 'name 2', None, '2001-01-22T02:12:21Z', 'Page 1', 0),
+                 RevisionData(2, 201, 'name 1', '')]
+
+    def test_round_trips_revisions(self):
+        batch = RevisionBatch(self.REVISIONS)
+        self.assertEqual(len(batch), 3)
+        self.assertEqual(list(batch), self.REVISIONS)
+        self.assertEqual(batch[1], self.REVISIONS[1])
+
+
+    def test_ids_are_stored_in_arrays(self):
+        batch = RevisionBatch(self.REVISIONS)
+        self.assertEqual(batch.page_ids, array('q', [1, 1, 2]))
+        self.assertEqual(batch.rev_ids, array('q', [101, 102, 201]))
+
+
+    def test_documents_match_asdict(self):
+        batch = RevisionBatch(self.REVISIONS)
+        self.assertEqual(list(batch.documents()), [r.asdict() for r in self.REVISIONS])
+
+
+    def test_survives_pickling(self):
+        batch = RevisionBatch(self.REVISIONS)
+        self.assertEqual(pickle.loads(pickle.dumps(batch)), batch)
+
+
+    def test_users_are_dictionary_encoded(self):
+        batch = RevisionBatch(self.REVISIONS + [RevisionData(3, 301, None, '')])
+        ids, table = batch.encode_users()
+        self.assertEqual(ids, array('I', [0, 1, 0, NO_USER]))
+        self.assertEqual(table, ['name 1', 'name 2'])
+        copy = RevisionBatch(batch)
+        copy.decode_users(ids, table)
+        self.assertEqual(copy, batch)
+        self.assertIs(copy.users[0], copy.users[2])
+
+
+    def test_titles_are_dictionary_encoded(self):
+        batch = RevisionBatch(self.REVISIONS)
+        ids, table = batch.encode_titles()
+        self.assertEqual(ids, array('I', [0, 0, NO_USER]))
+        self.assertEqual(table, ['Page 1'])
+        copy = pickle.loads(pickle.dumps(batch))
+        self.assertEqual(copy, batch)
+        self.assertIs(copy.titles[0], copy.titles[1])
+
+
+    def test_pickled_users_are_shared(self):
+        batch = RevisionBatch([RevisionData(1, i, ''.join(['name ', '1']), '') for i in range(10)])
+        copy = pickle.loads(pickle.dumps(batch))
+        self.assertEqual(copy, batch)
+        self.assertEqual(len(set(map(id, copy.users))), 1)
+
+
+    def test_batched_splits_into_batches_of_size(self):
+        batches = list(batched(self.REVISIONS, 2))
+        self.assertEqual([len(b) for b in batches], [2, 1])
+        self.assertEqual([r for b in batches for r in b], self.REVISIONS)
+
+
+    def test_batched_requires_positive_size(self):
+        with self.assertRaisesRegex(ValueError, 'positive integer'):
+            list(batched(self.REVISIONS, 0))
@@ -0,0 +1,183 @@
+from collections import defaultdict
+import bz2
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from wp_search_tools.indexer.dump_file import PagesDumpFile
+from wp_search_tools.indexer.multistream import (MultistreamDumpFile,
+                                                 index_path_for,
+                                                 open_range,
+                                                 read_index,
+                                                 split_ranges,
+                                                 stream_ranges)
+
+
+SAMPLE = Path(__file__).parent / 'test/pages-meta-history0.xml-p1p4'
+
+
+def make_multistream(xml, directory, pages_per_stream=1):
+    """Writes xml out as a multistream dump (plus index) in directory, in
+    the same layout Wikimedia uses: a header stream, page streams, and a
+    footer stream.
+
+    Returns the path to the dump file.
+
+    """
+    head, sep, rest = xml.partition('  <page>')
+    pages = [sep + p for p in rest.split('  <page>')]
+    pages[-1], footer = pages[-1].split('</mediawiki>')
+    footer = '</mediawiki>' + footer
+
+    path = os.path.join(directory, 'xxwiki-20220101-pages-articles-multistream.xml.bz2')
+    index_lines = []
+    with open(path, 'wb') as f:
+        f.write(bz2.compress(head.encode()))
+        for i in range(0, len(pages), pages_per_stream):
+            offset = f.tell()
+            group = pages[i:i + pages_per_stream]
+            for page in group:
+                page_id = page.split('<id>')[1].split('</id>')[0]
+                index_lines.append(f'{offset}:{page_id}:Title {page_id}\n')
+            f.write(bz2.compress(''.join(group).encode()))
+        f.write(bz2.compress(footer.encode()))
+    with bz2.open(index_path_for(path), 'wt') as f:
+        f.writelines(index_lines)
+    return path
+
+
+class MultistreamTest(TestCase):
+
+    def test_index_path_for_single_file_dump(self):
+        self.assertEqual(index_path_for('enwiki-20211201-pages-articles-multistream.xml.bz2'),
+                         'enwiki-20211201-pages-articles-multistream-index.txt.bz2')
+
+
+    def test_index_path_for_partial_dump(self):
+        self.assertEqual(index_path_for('enwiki-20211201-pages-articles-multistream1.xml-p1p41242.bz2'),
+                         'enwiki-20211201-pages-articles-multistream-index1.txt-p1p41242.bz2')
+
+
+    def test_index_path_for_non_multistream_dump_is_none(self):
+        self.assertIsNone(index_path_for('enwiki-20211201-pages-meta-history1.xml-p1p812.bz2'))
+
+
+    def test_stream_ranges_groups_streams(self):
+        streams = [(10, 1), (20, 5), (30, 9)]
+        self.assertEqual(stream_ranges(streams, 45, 2),
+                         [(10, 30, 1), (30, 45, 9)])
+
+
+    def test_stream_ranges_rejects_zero_streams_per_range(self):
+        with self.assertRaisesRegex(ValueError, 'must be >= 1'):
+            stream_ranges([(10, 1)], 20, 0)
+
+
+    def test_read_index_returns_one_entry_per_stream(self):
+        with TemporaryDirectory() as tmp:
+            path = make_multistream(SAMPLE.read_text(), tmp, pages_per_stream=2)
+            streams = read_index(index_path_for(path))
+            self.assertEqual([page_id for _, page_id in streams], [2535877, 2535880])
+
+
+    def test_pulldom_backend_is_rejected(self):
+        with self.assertRaisesRegex(ValueError, 'iterparse'):
+            MultistreamDumpFile(backend='pulldom')
+
+
+    def test_yields_same_revisions_as_single_stream_parse(self):
+        expected_df = PagesDumpFile()
+        expected = list(expected_df.process(str(SAMPLE)))
+        with TemporaryDirectory() as tmp:
+            path = make_multistream(SAMPLE.read_text(), tmp)
+            df = MultistreamDumpFile(workers=2, streams_per_task=1)
+            docs = list(df.process(path))
+        self.assertEqual(docs, expected)
+        self.assertEqual(df.pages, expected_df.pages)
+        self.assertEqual(df.revisions, expected_df.revisions)
+
+
+class SplitTest(TestCase):
+
+    def test_split_ranges_balances_by_bytes(self):
+        streams = [(100, 1), (200, 101), (300, 201), (400, 301)]
+        self.assertEqual(split_ranges(streams, 500, 2),
+                         [(100, 300, 1), (300, 500, 201)])
+
+
+    def test_split_ranges_covers_every_stream_once(self):
+        streams = [(i * 10, i * 100 + 1) for i in range(1, 50)]
+        ranges = split_ranges(streams, 500, 7)
+        self.assertEqual(len(ranges), 7)
+        self.assertEqual(ranges[0][0], 10)
+        self.assertEqual(ranges[-1][1], 500)
+        for (_, end, _), (start, _, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(end, start)
+
+
+    def test_split_ranges_with_more_chunks_than_streams(self):
+        streams = [(10, 1), (20, 2)]
+        self.assertEqual(split_ranges(streams, 30, 5),
+                         [(10, 20, 1), (20, 30, 2)])
+
+
+    def test_split_ranges_requires_positive_n(self):
+        with self.assertRaisesRegex(ValueError, 'positive integer'):
+            split_ranges([(10, 1)], 20, 0)
+
+
+    def test_chunks_parse_to_same_revisions_as_whole_file(self):
+        expected = list(PagesDumpFile().process(str(SAMPLE)))
+        with TemporaryDirectory() as tmp:
+            path = make_multistream(SAMPLE.read_text(), tmp)
+            ranges = split_ranges(read_index(index_path_for(path)), os.path.getsize(path), 3)
+            docs = []
+            pages = 0
+            for start, end, _ in ranges:
+                df = PagesDumpFile()
+                with open_range(path, start, end) as stream:
+                    docs.extend(df.parse(stream, fragment=True))
+                pages += df.pages
+        self.assertEqual(docs, expected)
+        self.assertEqual(pages, 4)
+
+
+class ResumeTest(TestCase):
+
+    def test_resume_skips_earlier_streams(self):
+        expected = [r for r in PagesDumpFile().process(str(SAMPLE)) if r.page_id > 2535878]
+        with TemporaryDirectory() as tmp:
+            path = make_multistream(SAMPLE.read_text(), tmp)
+            df = MultistreamDumpFile(workers=1, streams_per_task=1, resume_after=2535878)
+            docs = list(df.process(path))
+        self.assertEqual(docs, expected)
+        # The stream holding the resume point itself is still parsed.
+        self.assertEqual(df.pages, 3)
+
+
+class PositionTest(TestCase):
+
+    def test_position_is_end_of_last_collected_range(self):
+        with TemporaryDirectory() as tmp:
+            path = make_multistream(SAMPLE.read_text(), tmp)
+            df = MultistreamDumpFile(workers=1, streams_per_task=1)
+            self.assertIsNone(df.position())
+            positions = [df.position() for _ in df.process(path)]
+            size = os.path.getsize(path)
+        self.assertEqual(positions, sorted(positions))
+        self.assertEqual(df.position(), size)
+
+
+class KnownRevisionsTest(TestCase):
+
+    def test_known_revisions_are_skipped_in_workers(self):
+        full = list(PagesDumpFile().process(str(SAMPLE)))
+        known = defaultdict(int, {r.page_id: r.rev_id for r in full[:3]})
+        expected = [r for r in full if r.rev_id > known[r.page_id]]
+        with TemporaryDirectory() as tmp:
+            path = make_multistream(SAMPLE.read_text(), tmp)
+            df = MultistreamDumpFile(workers=1, streams_per_task=1, known_revisions=known)
+            docs = list(df.process(path))
+        self.assertEqual(docs, expected)
+        self.assertEqual(df.skipped, len(full) - len(expected))
@@ -0,0 +1,149 @@
+import bz2
+import gzip
+import os
+import sys
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from wp_search_tools.indexer import openers
+from wp_search_tools.indexer.dump_file import PagesDumpFile
+from wp_search_tools.indexer.openers import Decompressor, choose, decompressors, open_dump
+
+
+# A stand-in for an external decompressor, which works anywhere Python
+# does: it gunzips stdin to stdout, or exits with a status of 3.
+GUNZIP = (sys.executable, '-c',
+          'import gzip, shutil, sys; shutil.copyfileobj(gzip.GzipFile(fileobj=sys.stdin.buffer), sys.stdout.buffer)')
+FAIL = (sys.executable, '-c', 'import sys; sys.exit(3)')
+# Writes a dump whose one comment is the number of threads it was given.
+THREADS = (sys.executable, '-c',
+           'import sys; sys.stdout.write("<mediawiki><page><id>1</id><revision><id>10</id>'
+           '<comment>%s</comment></revision></page></mediawiki>" % sys.argv[1])',
+           '{threads}')
+
+XML = b'''<mediawiki>
+  <page>
+    <id>1</id>
+    <revision>
+      <id>10</id>
+      <contributor><username>Alice</username></contributor>
+      <comment>hello</comment>
+    </revision>
+  </page>
+</mediawiki>
+'''
+
+
+class RegistryTest(TestCase):
+
+    def setUp(self):
+        saved = list(openers._registry)
+        self.addCleanup(lambda: openers._registry.__setitem__(slice(None), saved))
+
+
+    def test_decompressors_are_chosen_by_suffix(self):
+        self.assertIn('bz2', [d.name for d in decompressors('x.xml.bz2')])
+        self.assertEqual([d.name for d in decompressors('x.xml')], ['open'])
+        self.assertEqual(choose('x.xml.zst').suffixes, ('.zst',))
+        self.assertEqual(choose('x.xml.gz', ['python-gzip']).name, 'python-gzip')
+
+
+    def test_preferred_decompressors_come_first(self):
+        self.assertEqual(choose('x.bz2', ['nonesuch', 'bz2']).name, 'bz2')
+
+
+    def test_unavailable_decompressors_are_skipped(self):
+        openers.register(Decompressor('missing', ('.test',), command=('no-such-command-here',)))
+        openers.register(Decompressor('python', ('.test',), function=lambda path: open(path, 'rb')))
+        self.assertEqual(choose('x.test').name, 'python')
+        openers.register(Decompressor('first', ('.test',), function=open), first=True)
+        self.assertEqual(choose('x.test').name, 'first')
+
+
+    def test_module_must_be_installed(self):
+        self.assertFalse(Decompressor('x', ('.x',), function=open, module='no_such_module').available())
+
+
+    def test_no_available_decompressor_raises(self):
+        openers.register(Decompressor('missing', ('.test',), command=('no-such-command-here',)))
+        with self.assertRaisesRegex(ValueError, 'No decompressor'):
+            choose('x.test')
+
+
+class OpenDumpTest(TestCase):
+
+    def setUp(self):
+        saved = list(openers._registry)
+        self.addCleanup(lambda: openers._registry.__setitem__(slice(None), saved))
+        openers.register(Decompressor('gunzip', ('.testgz',), command=GUNZIP), first=True)
+        openers.register(Decompressor('fail', ('.testfail',), command=FAIL), first=True)
+        openers.register(Decompressor('threads', ('.testthreads',), command=THREADS), first=True)
+        self.tmp_dir = TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+
+    def write(self, name, data):
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+
+    def test_subprocess_output_is_read(self):
+        data = b'revision\n' * 100000
+        path = self.write('dump.xml.testgz', gzip.compress(data))
+        with open_dump(path) as stream:
+            self.assertEqual(stream.read(), data)
+            # The subprocess read the file on our descriptor's offset.
+            self.assertEqual(os.lseek(stream.fileno(), 0, os.SEEK_CUR), os.path.getsize(path))
+        stats = stream.stats()
+        self.assertEqual(stats['decompressor'], 'gunzip')
+        self.assertEqual(stats['bytes_in'], os.path.getsize(path))
+        self.assertEqual(stats['bytes_out'], len(data))
+
+
+    def test_failed_subprocess_raises(self):
+        path = self.write('dump.xml.testfail', b'')
+        stream = open_dump(path)
+        self.assertEqual(stream.read(), b'')
+        with self.assertRaisesRegex(OSError, 'fail exited with status 3'):
+            stream.close()
+
+
+    def test_closing_early_stops_subprocess(self):
+        path = self.write('dump.xml.testgz', gzip.compress(os.urandom(4 * 1024 * 1024)))
+        stream = open_dump(path)
+        stream.read(10)
+        stream.close()
+        self.assertIsNotNone(stream._process.returncode)
+
+
+    def test_python_decompressors(self):
+        path = self.write('dump.xml.bz2', bz2.compress(XML))
+        with open_dump(path, ['bz2']) as stream:
+            self.assertEqual(stream.decompressor, 'bz2')
+            self.assertEqual(stream.read(), XML)
+
+
+    def test_dump_file_reports_decompression(self):
+        path = self.write('dump.xml.testgz', gzip.compress(XML))
+        df = PagesDumpFile()
+        self.assertEqual([r.comment for r in df.process(path)], ['hello'])
+        self.assertEqual(df.decompression['decompressor'], 'gunzip')
+        self.assertEqual(df.decompression['bytes_out'], len(XML))
+
+
+    def test_dump_file_passes_threads(self):
+        path = self.write('dump.xml.testthreads', b'')
+        self.assertEqual([r.comment for r in PagesDumpFile(decompress_threads=3).process(path)], ['3'])
+        self.assertEqual([r.comment for r in PagesDumpFile().process(path)], [str(os.cpu_count() or 1)])
+
+
+    def test_every_bz2_decompressor_agrees(self):
+        path = self.write('dump.xml.bz2', bz2.compress(XML))
+        for decompressor in decompressors(path):
+            if decompressor.available():
+                with self.subTest(decompressor=decompressor.name):
+                    df = PagesDumpFile(decompressors=[decompressor.name])
+                    self.assertEqual([r.rev_id for r in df.process(path)], [10])
+                    self.assertEqual(df.decompression['decompressor'], decompressor.name)
@@ -0,0 +1,106 @@
+from threading import current_thread
+from time import sleep
+from unittest import TestCase
+
+from wp_search_tools.indexer.dump_file import RevisionData
+from wp_search_tools.indexer.pipeline import Pipeline
+
+
+def revisions(n):
+    return [RevisionData(i // 3, i, f'user {i}', f'comment {i}') for i in range(n)]
+
+
+class Parser:
+    """A generator-like iterator which records how far it got, which
+    thread ran it, and whether it was closed.
+
+    """
+    def __init__(self, items, fail_at=None, delay=0.0):
+        self.items = iter(items)
+        self.fail_at = fail_at
+        self.delay = delay
+        self.produced = 0
+        self.closed = False
+        self.threads = set()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self.threads.add(current_thread().name)
+        if self.produced == self.fail_at:
+            raise RuntimeError('parse error')
+        sleep(self.delay)
+        item = next(self.items)
+        self.produced += 1
+        return item
+
+    def close(self):
+        self.closed = True
+
+
+class PipelineTest(TestCase):
+
+    def test_depth_must_be_non_negative(self):
+        with self.assertRaisesRegex(ValueError, 'non-negative integer'):
+            Pipeline([], depth=-1)
+
+
+    def test_batches_are_delivered_in_order(self):
+        parser = Parser(revisions(25))
+        with Pipeline(parser, batch_size=10, depth=2) as pipeline:
+            batches = list(pipeline)
+        self.assertEqual([len(b) for b in batches], [10, 10, 5])
+        self.assertEqual([r for b in batches for r in b], revisions(25))
+        self.assertEqual(parser.threads, {'parser'})
+        self.assertTrue(parser.closed)
+        self.assertEqual(pipeline.stats()['batches'], 3)
+
+
+    def test_depth_zero_runs_in_consumer_thread(self):
+        parser = Parser(revisions(5))
+        with Pipeline(parser, batch_size=2, depth=0) as pipeline:
+            batches = list(pipeline)
+        self.assertEqual([r for b in batches for r in b], revisions(5))
+        self.assertEqual(parser.threads, {current_thread().name})
+
+
+    def test_parser_errors_are_raised_in_consumer(self):
+        parser = Parser(revisions(25), fail_at=15)
+        received = []
+        with self.assertRaisesRegex(RuntimeError, 'parse error'):
+            with Pipeline(parser, batch_size=10, depth=2) as pipeline:
+                for batch in pipeline:
+                    received.extend(batch)
+        self.assertEqual(received, revisions(10))
+        self.assertTrue(parser.closed)
+
+
+    def test_queue_bounds_how_far_parser_runs_ahead(self):
+        parser = Parser(revisions(1000))
+        with Pipeline(parser, batch_size=10, depth=3) as pipeline:
+            iterator = iter(pipeline)
+            next(iterator)
+            sleep(0.3)
+            # One batch consumed, three queued, and one waiting to be put.
+            self.assertLessEqual(parser.produced, 50)
+        self.assertTrue(parser.closed)
+        self.assertGreater(pipeline.parser_wait, 0.0)
+
+
+    def test_consumer_stopping_early_stops_parser(self):
+        parser = Parser(revisions(1000))
+        with Pipeline(parser, batch_size=10, depth=2) as pipeline:
+            for batch in pipeline:
+                break
+        self.assertTrue(parser.closed)
+        self.assertLess(parser.produced, 1000)
+
+
+    def test_slow_parser_shows_as_consumer_wait(self):
+        parser = Parser(revisions(20), delay=0.005)
+        with Pipeline(parser, batch_size=5, depth=2) as pipeline:
+            list(pipeline)
+        stats = pipeline.stats()
+        self.assertGreater(stats['consumer_wait'], 0.05)
+        self.assertEqual(stats['batches'], 4)
@@ -0,0 +1,93 @@
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from wp_search_tools.indexer.dump_file import PagesDumpFile, RevisionData
+from wp_search_tools.indexer.revision_cache import (RevisionCacheFile,
+                                                    cache_path_for,
+                                                    is_cache_file,
+                                                    read_batches,
+                                                    write_cache)
+
+
+SAMPLE = Path(__file__).parent / 'test/pages-meta-history0.xml-p1p4'
+
+REVISIONS = [RevisionData(1, 101, 'name 1', 'comment 1'),
+             RevisionData(1, 102, 'name 2', None),
+             RevisionData(1, 103, None, ''),
+             RevisionData(2, 201, 'name 1', 'ünïcode ☃', '2001-01-21T02:12:21Z', 'Zoë', 0),
+             RevisionData(3, 301, 'name 2', 'comment 3', '2005-08-25T14:22:46Z', 'Talk:Zoë', 1)]
+
+
+class RevisionCacheTest(TestCase):
+
+    def test_cache_path_for_strips_compression_suffix(self):
+        self.assertEqual(cache_path_for('foo.xml-p1p4.bz2'), 'foo.xml-p1p4.revcache')
+
+
+    def test_is_cache_file(self):
+        self.assertTrue(is_cache_file('foo.revcache'))
+        self.assertFalse(is_cache_file('foo.bz2'))
+
+
+    def test_revisions_round_trip(self):
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'x.revcache')
+            self.assertEqual(write_cache(REVISIONS, path), 5)
+            df = RevisionCacheFile()
+            self.assertEqual(list(df.process(path)), REVISIONS)
+            self.assertEqual(df.pages, 3)
+            self.assertEqual(df.revisions, 5)
+
+
+    def test_revisions_are_split_into_chunks(self):
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'x.revcache')
+            write_cache(REVISIONS, path, chunk_size=2)
+            batches = list(read_batches(path))
+            self.assertEqual([len(b) for b in batches], [2, 2, 1])
+            self.assertEqual([r for b in batches for r in b], REVISIONS)
+
+
+    def test_empty_stream_round_trips(self):
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'x.revcache')
+            write_cache([], path)
+            self.assertEqual(list(RevisionCacheFile().process(path)), [])
+
+
+    def test_resume_after_skips_pages(self):
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'x.revcache')
+            write_cache(REVISIONS, path)
+            df = RevisionCacheFile(resume_after=1)
+            self.assertEqual(list(df.process(path)), REVISIONS[3:])
+            self.assertEqual(df.pages, 3)
+
+
+    def test_known_revisions_are_skipped(self):
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'x.revcache')
+            write_cache(REVISIONS, path)
+            df = RevisionCacheFile(known_revisions={1: 102, 2: 0, 3: 0})
+            self.assertEqual(list(df.process(path)), REVISIONS[2:])
+            self.assertEqual(df.skipped, 2)
+            self.assertEqual(df.revisions, 3)
+
+
+    def test_other_files_are_rejected(self):
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'x.revcache')
+            with open(path, 'wb') as f:
+                f.write(b'<mediawiki></mediawiki>')
+            with self.assertRaisesRegex(ValueError, 'not a revision cache'):
+                list(read_batches(path))
+
+
+    def test_sample_dump_round_trips(self):
+        expected = list(PagesDumpFile().process(str(SAMPLE)))
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'x.revcache')
+            write_cache(PagesDumpFile().process(str(SAMPLE)), path)
+            self.assertEqual(list(RevisionCacheFile().process(path)), expected)
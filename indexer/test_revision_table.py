@@ -0,0 +1,102 @@
+import os
+import pickle
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from wp_search_tools.indexer.revision_table import GROWTH, RevisionTable
+
+
+class RevisionTableTest(TestCase):
+
+    def test_new_table_is_empty(self):
+        with TemporaryDirectory() as tmp:
+            with RevisionTable(os.path.join(tmp, 't.table')) as table:
+                self.assertEqual(len(table), 0)
+                self.assertEqual(table.get(12345), 0)
+                self.assertFalse(table.is_indexed(12345, 1))
+
+
+    def test_update_records_highest_rev_id(self):
+        with TemporaryDirectory() as tmp:
+            with RevisionTable(os.path.join(tmp, 't.table')) as table:
+                table.update(7, 100)
+                table.update(7, 90)
+                self.assertEqual(table.get(7), 100)
+                self.assertTrue(table.is_indexed(7, 100))
+                self.assertFalse(table.is_indexed(7, 101))
+
+
+    def test_table_grows_for_large_page_ids(self):
+        with TemporaryDirectory() as tmp:
+            with RevisionTable(os.path.join(tmp, 't.table')) as table:
+                table.update(GROWTH + 5, 1)
+                self.assertEqual(len(table), 2 * GROWTH)
+                self.assertEqual(table.get(GROWTH + 5), 1)
+
+
+    def test_growth_is_sparse(self):
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 't.table')
+            with RevisionTable(path) as table:
+                table.update(50 * GROWTH, 1)
+            stat = os.stat(path)
+            self.assertEqual(stat.st_size, 51 * GROWTH * 8)
+            self.assertLess(stat.st_blocks * 512, stat.st_size // 10)
+
+
+    def test_growing_never_shrinks_the_file(self):
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 't.table')
+            with RevisionTable(path) as small, RevisionTable(path) as large:
+                small.update(1, 10)
+                large.update(3 * GROWTH, 30)
+                small.update(GROWTH, 20)
+                self.assertEqual(os.path.getsize(path), 4 * GROWTH * 8)
+                self.assertEqual([small.get(1), small.get(GROWTH), small.get(3 * GROWTH)], [10, 20, 30])
+
+
+    def test_updates_persist(self):
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 't.table')
+            with RevisionTable(path) as table:
+                table.update(3, 30)
+            with RevisionTable(path, readonly=True) as table:
+                self.assertEqual(table.get(3), 30)
+
+
+    def test_readonly_table_rejects_updates(self):
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 't.table')
+            RevisionTable(path).close()
+            with RevisionTable(path, readonly=True) as table:
+                with self.assertRaisesRegex(ValueError, 'read-only'):
+                    table.update(1, 1)
+
+
+    def test_reader_sees_growth_by_writer(self):
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 't.table')
+            with RevisionTable(path) as writer, RevisionTable(path, readonly=True) as reader:
+                self.assertEqual(reader.get(5), 0)
+                writer.update(5, 50)
+                writer.flush()
+                self.assertEqual(reader.get(5), 50)
+
+
+    def test_unpickles_as_readonly_view_of_same_file(self):
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 't.table')
+            with RevisionTable(path) as table:
+                table.update(2, 20)
+                table.flush()
+                with pickle.loads(pickle.dumps(table)) as copy:
+                    self.assertTrue(copy.readonly)
+                    self.assertEqual(copy.get(2), 20)
+
+
+    def test_reader_is_readonly_view(self):
+        with TemporaryDirectory() as tmp:
+            with RevisionTable(os.path.join(tmp, 't.table')) as table, table.reader() as reader:
+                self.assertTrue(reader.readonly)
+                table.update(4, 40)
+                self.assertEqual(reader.get(4), 40)
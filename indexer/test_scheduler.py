@@ -0,0 +1,159 @@
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from wp_search_tools.indexer.scheduler import find_dumps, is_dump_file, is_pattern, run
+
+
+class FakeResult:
+    """An AsyncResult which becomes ready after being polled a given
+    number of times.
+
+    """
+    def __init__(self, value, polls=1, ok=True):
+        self.value = value
+        self.polls = polls
+        self.ok = ok
+
+    def ready(self):
+        self.polls -= 1
+        return self.polls < 0
+
+    def successful(self):
+        return self.ok
+
+    def get(self, propagate=True):
+        return self.value
+
+
+def write(directory, name, size):
+    path = os.path.join(directory, name)
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    return path
+
+
+class FindDumpsTest(TestCase):
+
+    def test_directory_is_ordered_largest_first(self):
+        with TemporaryDirectory() as tmp:
+            small = write(tmp, 'a-history1.xml-p1p10.bz2', 10)
+            big = write(tmp, 'a-history2.xml-p11p20.bz2', 30)
+            medium = write(tmp, 'a-history3.xml-p21p30.bz2', 20)
+            write(tmp, 'a-multistream-index.txt.bz2', 100)
+            write(tmp, 'README', 100)
+            self.assertEqual(find_dumps(tmp), [(30, big), (20, medium), (10, small)])
+
+
+    def test_glob_pattern(self):
+        with TemporaryDirectory() as tmp:
+            write(tmp, 'a1.xml.bz2', 10)
+            b = write(tmp, 'b1.xml.bz2', 10)
+            self.assertEqual(find_dumps(os.path.join(tmp, 'b*')), [(10, b)])
+
+
+    def test_multistream_index_is_excluded_from_glob(self):
+        with TemporaryDirectory() as tmp:
+            dump = write(tmp, 'a-multistream.xml.bz2', 10)
+            write(tmp, 'a-multistream-index.txt.bz2', 10)
+            self.assertEqual(find_dumps(os.path.join(tmp, '*')), [(10, dump)])
+
+
+    def test_only_dumps_are_found(self):
+        with TemporaryDirectory() as tmp:
+            dumps = [write(tmp, name, 10) for name in ('a1.xml-p1p10.bz2', 'a2.xml-p11p20',
+                                                        'b.xml', 'c.xml.gz', 'd.xml.zst', 'e.xml.7z')]
+            for name in ('a1.xml-p1p10.revcache', 'a-multistream-index.txt.bz2',
+                         'a1.xml-p1p10.bz2-index.txt', 'a1.xml-p1p10.bz2.tmp'):
+                write(tmp, name, 10)
+            self.assertEqual(sorted(path for _, path in find_dumps(tmp)), sorted(dumps))
+
+
+    def test_single_file_is_found_whatever_its_name(self):
+        with TemporaryDirectory() as tmp:
+            cache = write(tmp, 'a1.xml-p1p10.revcache', 10)
+            self.assertEqual(find_dumps(cache), [(10, cache)])
+
+
+    def test_caches_are_included_if_asked_for(self):
+        with TemporaryDirectory() as tmp:
+            dump = write(tmp, 'a1.xml-p1p10.bz2', 30)
+            cached = write(tmp, 'a2.xml-p11p20.bz2', 40)
+            cache = write(tmp, 'a2.xml-p11p20.revcache', 20)
+            other = write(tmp, 'other.revcache', 10)
+            self.assertEqual(find_dumps(tmp), [(40, cached), (30, dump)])
+            self.assertEqual(find_dumps(tmp, include_cache=True), [(30, dump), (20, cache), (10, other)])
+
+
+    def test_glob_of_caches(self):
+        with TemporaryDirectory() as tmp:
+            write(tmp, 'a1.xml-p1p10.bz2', 30)
+            cache = write(tmp, 'a1.xml-p1p10.revcache', 20)
+            pattern = os.path.join(tmp, '*.revcache')
+            self.assertEqual(find_dumps(pattern), [])
+            self.assertEqual(find_dumps(pattern, include_cache=True), [(20, cache)])
+
+
+    def test_is_dump_file(self):
+        self.assertTrue(is_dump_file('/dumps/enwiki-20211201-pages-meta-history1.xml-p1p812.bz2'))
+        self.assertFalse(is_dump_file('/dumps/enwiki-20211201-pages-meta-history1.xml-p1p812.revcache'))
+
+
+    def test_is_pattern(self):
+        self.assertTrue(is_pattern('/dumps/*.bz2'))
+        self.assertFalse(is_pattern('/dumps/a.bz2'))
+
+
+class RunTest(TestCase):
+
+    def test_results_are_summed(self):
+        results = {'a': FakeResult({'pages': 1, 'revisions': 10, 'failed': 1}),
+                   'b': FakeResult({'pages': 2, 'revisions': 20, 'skipped': 5}),
+                   }
+        summary = run(['a', 'b'], results.get, poll_interval=0)
+        self.assertEqual(summary['files'], 2)
+        self.assertEqual(summary['pages'], 3)
+        self.assertEqual(summary['revisions'], 30)
+        self.assertEqual(summary['skipped'], 5)
+        self.assertEqual(summary['failed'], 1)
+        self.assertEqual(summary['errors'], [])
+
+
+    def test_in_flight_tasks_are_capped_and_order_kept(self):
+        submitted = []
+        in_flight = []
+        peak = 0
+
+        def submit(path):
+            nonlocal peak
+            submitted.append(path)
+            in_flight.append(path)
+            peak = max(peak, len(in_flight))
+            return FakeResult({'pages': 1}, polls=3)
+
+        def report(path, value):
+            in_flight.remove(path)
+
+        paths = [str(i) for i in range(7)]
+        summary = run(paths, submit, max_in_flight=2, poll_interval=0, report=report)
+        self.assertEqual(submitted, paths)
+        self.assertEqual(peak, 2)
+        self.assertEqual(summary['pages'], 7)
+
+
+    def test_failed_tasks_are_reported(self):
+        results = {'a': FakeResult(RuntimeError('boom'), ok=False),
+                   'b': FakeResult({'pages': 2}),
+                   }
+        reported = []
+        summary = run(['a', 'b'], results.get, poll_interval=0,
+                      report=lambda path, value: reported.append(path))
+        self.assertEqual(summary['files'], 2)
+        self.assertEqual(summary['pages'], 2)
+        self.assertEqual(summary['errors'], [('a', "RuntimeError('boom')")])
+        self.assertEqual(sorted(reported), ['a', 'b'])
+
+
+    def test_max_in_flight_must_be_positive(self):
+        with self.assertRaisesRegex(ValueError, 'positive integer'):
+            run(['a'], None, max_in_flight=0)
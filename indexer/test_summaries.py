@@ -0,0 +1,129 @@
+from collections import Counter
+import gzip
+import json
+import os
+from pathlib import Path
+import random
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from wp_search_tools.indexer.dump_file import PagesDumpFile, RevisionData
+from wp_search_tools.indexer.get_summaries import summarize, work_units, write
+from wp_search_tools.indexer.summaries import FrequentItems, Summary
+from wp_search_tools.indexer.test_multistream import make_multistream
+
+
+SAMPLE = Path(__file__).parent / 'test/pages-meta-history0.xml-p1p4'
+
+
+class FrequentItemsTest(TestCase):
+
+    def test_k_must_be_a_positive_integer(self):
+        with self.assertRaisesRegex(ValueError, 'positive integer'):
+            FrequentItems(0)
+
+
+    def test_counts_are_exact_with_few_items(self):
+        f = FrequentItems(10)
+        for item in 'abacab':
+            f.update(item)
+        self.assertEqual(f.top(), [('a', 3), ('b', 2), ('c', 1)])
+        self.assertEqual(f.error, 0)
+
+
+    def test_memory_is_bounded_and_error_is_within_bound(self):
+        rng = random.Random(1)
+        items = [min(int(rng.paretovariate(1.0)), 10000) for _ in range(20000)]
+        f = FrequentItems(20)
+        for item in items:
+            f.update(item)
+        self.assertLessEqual(len(f), 40)
+        self.assertLessEqual(f.error, len(items) / 21)
+        true = Counter(items)
+        for item, n in f.top():
+            self.assertLessEqual(n, true[item])
+            self.assertGreaterEqual(n, true[item] - f.error)
+        for item, n in true.items():
+            if n > f.error:
+                self.assertIn(item, dict(f.top()))
+
+
+    def test_merge_matches_single_stream(self):
+        rng = random.Random(2)
+        items = [rng.choice('aaaabbbcdefghij') for _ in range(1000)]
+        single = FrequentItems(3)
+        for item in items:
+            single.update(item)
+        left, right = FrequentItems(3), FrequentItems(3)
+        for item in items[:400]:
+            left.update(item)
+        for item in items[400:]:
+            right.update(item)
+        merged = left.merge(right)
+        self.assertLessEqual(merged.error, len(items) / 4)
+        self.assertEqual([item for item, _ in merged.top(2)], ['a', 'b'])
+        self.assertEqual([item for item, _ in single.top(2)], ['a', 'b'])
+
+
+REVISIONS = [RevisionData(1, 101, 'alice', 'fix typo'),
+             RevisionData(1, 102, 'bob', None),
+             RevisionData(1, 103, None, ''),
+             RevisionData(2, 201, 'alice', 'fix link'),
+             RevisionData(2, 202, 'alice', 'x' * 100)]
+
+
+class SummaryTest(TestCase):
+
+    def test_add(self):
+        s = Summary(prefix_length=3).add_all(REVISIONS)
+        d = s.asdict()
+        self.assertEqual(d['revisions'], 5)
+        self.assertEqual(d['deleted_users'], 1)
+        self.assertEqual(d['deleted_comments'], 1)
+        self.assertEqual(d['empty_comments'], 1)
+        self.assertEqual(d['users']['top'], [['alice', 3], ['bob', 1]])
+        self.assertEqual(d['users_with_deleted_comments']['top'], [['bob', 1]])
+        self.assertEqual(d['prefixes']['top'], [['fix', 2], ['xxx', 1]])
+        self.assertEqual(d['comment_lengths'][0], {'min': 0, 'max': 0, 'count': 1})
+        self.assertEqual(d['comment_lengths'][4], {'min': 8, 'max': 15, 'count': 2})
+        self.assertEqual(d['comment_lengths'][7], {'min': 64, 'max': 127, 'count': 1})
+        self.assertEqual(sum(b['count'] for b in d['comment_lengths']), 4)
+
+
+    def test_merge_equals_whole(self):
+        whole = Summary().add_all(REVISIONS)
+        merged = Summary().add_all(REVISIONS[:2]).merge(Summary().add_all(REVISIONS[2:]))
+        self.assertEqual(merged.asdict(), whole.asdict())
+
+
+    def test_asdict_is_json_serializable(self):
+        json.dumps(Summary().add_all(REVISIONS).asdict())
+
+
+class SummarizeTest(TestCase):
+
+    def test_summarize_matches_serial_summary(self):
+        df = PagesDumpFile()
+        expected = Summary().add_all(df.process(str(SAMPLE)))
+        expected.pages = df.pages
+        self.assertEqual(summarize([str(SAMPLE)], workers=1).asdict(), expected.asdict())
+
+
+    def test_multistream_files_are_split_into_chunks(self):
+        expected = Summary().add_all(PagesDumpFile().process(str(SAMPLE))).asdict()
+        with TemporaryDirectory() as tmp:
+            path = make_multistream(SAMPLE.read_text(), tmp)
+            self.assertEqual(len(work_units([path], 3)), 3)
+            self.assertEqual(work_units([path], 1), [(path, None, None)])
+            result = summarize([path], workers=2, chunks=3).asdict()
+        self.assertEqual(result['pages'], 4)
+        result['pages'] = expected['pages']
+        self.assertEqual(result, expected)
+
+
+    def test_write_gzip(self):
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'summary.json.gz')
+            write({'revisions': 3}, path)
+            with gzip.open(path, 'rt') as f:
+                self.assertEqual(json.load(f), {'revisions': 3})
@@ -0,0 +1,45 @@
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from wp_search_tools.indexer.dump_file import PagesDumpFile
+from wp_search_tools.indexer.multistream import MultistreamDumpFile
+from wp_search_tools.indexer.synthetic_dump import DumpGenerator
+
+
+class DumpGeneratorTest(TestCase):
+
+    def test_generated_dump_has_requested_shape(self):
+        generator = DumpGenerator(pages=5, revisions=4, text_size=100,
+                                  ip_fraction=0.5, deleted_fraction=0.5)
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'dump.xml')
+            generator.write(path)
+            df = PagesDumpFile()
+            docs = list(df.process(path))
+        self.assertEqual(df.pages, 5)
+        self.assertEqual(len(docs), 20)
+        self.assertTrue(any(d.comment is None for d in docs))
+        self.assertTrue(any(d.user.startswith('198.51.') for d in docs))
+        self.assertTrue(any(d.user.startswith('User ') for d in docs))
+
+
+    def test_same_seed_generates_same_dump(self):
+        with TemporaryDirectory() as tmp:
+            paths = [os.path.join(tmp, f'dump{i}.xml.bz2') for i in range(2)]
+            for path in paths:
+                DumpGenerator(pages=3, seed=42).write(path, compress=True)
+            docs = [list(PagesDumpFile().process(path)) for path in paths]
+        self.assertEqual(docs[0], docs[1])
+
+
+    def test_multistream_output_matches_plain_output(self):
+        generator_args = {'pages': 250, 'revisions': 2, 'text_size': 50}
+        with TemporaryDirectory() as tmp:
+            plain = os.path.join(tmp, 'dump.xml')
+            DumpGenerator(**generator_args).write(plain)
+            multi = os.path.join(tmp, 'x-multistream.xml.bz2')
+            DumpGenerator(**generator_args).write_multistream(multi, os.path.join(tmp, 'x-multistream-index.txt.bz2'))
+            expected = list(PagesDumpFile().process(plain))
+            docs = list(MultistreamDumpFile(workers=2, streams_per_task=1).process(multi))
+        self.assertEqual(docs, expected)
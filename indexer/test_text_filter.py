@@ -0,0 +1,94 @@
+from io import BytesIO, StringIO
+from pathlib import Path
+import re
+from unittest import TestCase
+
+from wp_search_tools.indexer.dump_file import PagesDumpFile
+from wp_search_tools.indexer.text_filter import TextFilter
+
+
+SAMPLE = Path(__file__).parent / 'test/pages-meta-history0.xml-p1p4'
+
+DATA = '''<page>
+  <revision>
+    <id>1</id>
+    <comment>a &lt;text&gt; comment</comment>
+    <text bytes="20" xml:space="preserve">some &lt;b&gt;wiki&lt;/b&gt; text</text>
+    <textual>kept</textual>
+  </revision>
+  <revision>
+    <id>2</id>
+    <text bytes="0" />
+    <text deleted="deleted"/>
+    <text
+      bytes="5">multi
+line</text>
+  </revision>
+</page>
+'''
+
+EXPECTED = re.sub(r'<text[\s/>](?:[^>]*/>|.*?</text>)', '', DATA, flags=re.S)
+
+
+def read_all(stream, size):
+    pieces = []
+    while True:
+        data = stream.read(size)
+        if not data:
+            return pieces
+        pieces.append(data)
+
+
+class TextFilterTest(TestCase):
+
+    def test_expected_output(self):
+        self.assertIn('<textual>kept</textual>', EXPECTED)
+        self.assertIn('a &lt;text&gt; comment', EXPECTED)
+        self.assertNotIn('<text ', EXPECTED)
+        self.assertNotIn('wiki', EXPECTED)
+
+
+    def test_text_elements_are_removed(self):
+        self.assertEqual(TextFilter(StringIO(DATA)).read(), EXPECTED)
+
+
+    def test_binary_stream(self):
+        f = TextFilter(BytesIO(DATA.encode('utf-8')))
+        self.assertEqual(f.read(), EXPECTED.encode('utf-8'))
+        self.assertEqual(f.removed, len(DATA) - len(EXPECTED))
+
+
+    def test_any_chunk_boundaries(self):
+        for chunk_size in range(1, 40):
+            with self.subTest(chunk_size=chunk_size):
+                f = TextFilter(BytesIO(DATA.encode('utf-8')), chunk_size=chunk_size)
+                self.assertEqual(b''.join(read_all(f, 7)), EXPECTED.encode('utf-8'))
+
+
+    def test_read_never_exceeds_size(self):
+        f = TextFilter(StringIO(DATA), chunk_size=1000)
+        pieces = read_all(f, 5)
+        self.assertTrue(all(0 < len(p) <= 5 for p in pieces))
+        self.assertEqual(''.join(pieces), EXPECTED)
+
+
+    def test_read_zero_returns_right_type(self):
+        self.assertEqual(TextFilter(BytesIO(b'<a/>')).read(0), b'')
+        self.assertEqual(TextFilter(StringIO('<a/>')).read(0), '')
+
+
+    def test_empty_stream(self):
+        self.assertEqual(TextFilter(BytesIO(b'')).read(), b'')
+
+
+    def test_unterminated_text_is_dropped(self):
+        self.assertEqual(TextFilter(StringIO('<a><text>abc')).read(), '<a>')
+
+
+    def test_parsers_give_same_revisions_with_and_without_filter(self):
+        for backend in PagesDumpFile.BACKENDS:
+            with self.subTest(backend=backend):
+                filtered = list(PagesDumpFile(backend=backend).process(str(SAMPLE)))
+                unfiltered = list(PagesDumpFile(backend=backend, skip_text=False).process(str(SAMPLE)))
+                self.assertTrue(filtered)
+                self.assertEqual(filtered, unfiltered)
@@ -0,0 +1,144 @@
+"""Drop <text> elements from a dump before it reaches the XML parser.
+
+In pages-meta-history dumps, the wikitext of each revision makes up
+almost all of the bytes, but none of it is needed for indexing.  Even
+with the iterparse backend discarding each element as soon as it's
+closed, every byte of it still has to be tokenized (and entities
+decoded) by expat.  TextFilter finds each <text ...>...</text> span in
+the decompressed stream with a plain substring search and removes it,
+so the parser only sees the small amount of markup around it.
+
+This relies on the text being character data: a literal '<' inside it
+is always escaped as &lt;, so the first '</text>' after a '<text' start
+tag is always its end tag.  Self-closing <text .../> elements (which is
+how deleted or empty text appears) are removed too.
+
+"""
+
+# Bytes (or characters) read from the underlying stream at a time.
+CHUNK_SIZE = 1024 * 1024
+
+
+class TextFilter:
+    """A read-only file-like object which returns the contents of stream
+    with all the <text> elements removed.  stream may be in binary or
+    text mode; read() returns the same type as stream.read().
+
+    """
+    def __init__(self, stream, chunk_size=CHUNK_SIZE):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.removed = 0
+        self._buffer = None
+        self._output = None
+        self._offset = 0
+        self._inside = False
+        self._eof = False
+
+
+    def _markers(self, data):
+        if isinstance(data, bytes):
+            self._start, self._end, self._close, self._slash = b'<text', b'</text>', b'>', b'/'
+            self._delimiters = (b' ', b'>', b'/', b'\t', b'\n', b'\r')
+        else:
+            self._start, self._end, self._close, self._slash = '<text', '</text>', '>', '/'
+            self._delimiters = (' ', '>', '/', '\t', '\n', '\r')
+        self._buffer = self._output = data[:0]
+
+
+    def read(self, size=-1):
+        """Returns up to size bytes (or characters) of the filtered stream,
+        or everything that's left if size is negative or None.  As with a
+        raw stream, this may be less than size; it's only empty at the end
+        of the stream.
+
+        """
+        if size is None or size < 0:
+            pieces = []
+            while True:
+                data = self.read(self.chunk_size)
+                if not data:
+                    return self._output.join(pieces) if pieces else data
+                pieces.append(data)
+        while self._output is None or (self._offset >= len(self._output) and not self._eof):
+            data = self.stream.read(self.chunk_size)
+            if self._buffer is None:
+                self._markers(data)
+            if not data:
+                self._eof = True
+            self._output = self._filter(self._buffer + data)
+            self._offset = 0
+        output = self._output[self._offset:self._offset + size]
+        self._offset += len(output)
+        return output
+
+
+    def _filter(self, buffer):
+        """Returns the part of buffer which can be emitted, saving
+        anything which can't be decided yet in self._buffer.
+
+        """
+        start, end, close = self._start, self._end, self._close
+        pieces = []
+        position = 0
+        length = len(buffer)
+        while position < length:
+            if self._inside:
+                i = buffer.find(end, position)
+                if i < 0:
+                    # Keep just enough to recognize an end tag which is
+                    # split across two reads.
+                    keep = max(position, length - len(end) + 1)
+                    self.removed += keep - position
+                    position = keep
+                    break
+                self.removed += i + len(end) - position
+                position = i + len(end)
+                self._inside = False
+                continue
+
+            i = buffer.find(start, position)
+            if i < 0:
+                # A start tag may be split across two reads.
+                keep = buffer.rfind(start[:1], max(position, length - len(start) + 1))
+                if keep < 0 or self._eof:
+                    keep = length
+                pieces.append(buffer[position:keep])
+                position = keep
+                break
+            j = i + len(start)
+            if j >= length:
+                pieces.append(buffer[position:i])
+                position = i
+                break
+            if buffer[j:j + 1] not in self._delimiters:
+                # Some other element whose name starts with "text".
+                pieces.append(buffer[position:j])
+                position = j
+                continue
+            k = buffer.find(close, j)
+            if k < 0:
+                pieces.append(buffer[position:i])
+                position = i
+                break
+            pieces.append(buffer[position:i])
+            self.removed += k + 1 - i
+            position = k + 1
+            if buffer[k - 1:k] != self._slash:
+                self._inside = True
+
+        self._buffer = buffer[position:]
+        if self._eof:
+            # Whatever is left is either the rest of an unterminated text
+            # element, or markup which couldn't be decided; either way,
+            # the parser will complain about it.
+            if self._inside:
+                self.removed += len(self._buffer)
+            else:
+                pieces.append(self._buffer)
+            self._buffer = buffer[:0]
+        return buffer[:0].join(pieces)
+
+
+    def close(self):
+        self.stream.close()
@@ -1,33 +1,102 @@
 #!/usr/bin/env python3
 
-from configparser import ConfigParser
+"""Load NDJSON revisions from stdin into the index.
+
+Lines are batched into _bulk requests as-is, without being decoded and
+re-encoded, and several requests are sent in parallel.  The amount of
+data in flight is bounded by --concurrency times --batch-bytes.
+Requests rejected with 429 (the cluster is overloaded) are retried with
+exponential backoff.  A throughput summary is printed at the end.
+
+  elastic.py --concurrency 4 --id-field rev_id < revisions.ndjson
+
+"""
+
+from argparse import ArgumentParser
 import json
 from pathlib import Path
 from pprint import pprint
 import sys
 
-from opensearchpy import OpenSearch
+from wp_search_tools.utils.bulk import BulkIndexer
+from wp_search_tools.utils.client import get_client, read_config
+from wp_search_tools.utils.indices import BulkLoad, create_index
 
 
-CONFIGS = (Path.home() / '.elasticsearch.ini',
-           Path('elasticsearch.ini'))
+CONFIGS = (Path('elasticsearch.ini'),)
 
 
 def main():
-    config = ConfigParser()
-    config.read(CONFIGS)
-    user = config.get('elasticsearch', 'user')
-    password = config.get('elasticsearch', 'password')
-    server = config.get('elasticsearch', 'server')
+    parser = ArgumentParser(description='Load JSON revisions, one per line, from stdin')
+    parser.add_argument('--bulk-load', action='store_true',
+                        help='''put the index into bulk-load mode (no refreshes or replicas)
+                        during the load, and force-merge it afterwards''')
+    parser.add_argument('--batch-docs', type=int, default=5000,
+                        help='maximum documents per bulk request (default %(default)s)')
+    parser.add_argument('--batch-bytes', type=int, default=10*1024*1024,
+                        help='maximum bytes per bulk request (default %(default)s)')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='bulk requests in flight at once (default %(default)s)')
+    parser.add_argument('--max-retries', type=int, default=5,
+                        help='retries for requests rejected with 429 (default %(default)s)')
+    parser.add_argument('--id-field',
+                        help='use this field of each document as its _id')
+    args = parser.parse_args()
+
+    config = read_config(*CONFIGS)
     index_name = config.get('elasticsearch', 'index')
 
-    es = OpenSearch(server, http_auth=(user, password))
+    es = get_client(config, threads=args.concurrency)
+
+    create_index(es, index_name)
+
+    indexer = BulkIndexer(es, index_name,
+                          batch_docs=args.batch_docs,
+                          batch_bytes=args.batch_bytes,
+                          concurrency=args.concurrency,
+                          max_retries=args.max_retries)
+    if args.bulk_load:
+        with BulkLoad(es, index_name):
+            stats = load(indexer, sys.stdin.buffer, args.id_field)
+    else:
+        stats = load(indexer, sys.stdin.buffer, args.id_field)
+
+    print(f"loaded {stats['indexed']} documents in {stats['seconds']:.1f}s "
+          f"({stats['docs_per_second']:.0f} docs/s, "
+          f"{stats['bytes_sent'] / stats['seconds'] / 1e6 if stats['seconds'] else 0:.1f} MB/s), "
+          f"{stats['failed']} failed, {stats['retries']} retried",
+          file=sys.stderr)
+    for error in stats['errors']:
+        print(f'error: {json.dumps(error)}', file=sys.stderr)
+
+
+def load(indexer, lines, id_field=None):
+    """Sends each line (bytes, one JSON document per line) to indexer.
+    The lines are only decoded if id_field is given.  Returns the
+    indexer's stats.
+
+    A document without id_field, or a line which isn't valid JSON, is
+    sent with a generated _id; the cluster rejects the latter, and it
+    is counted as failed like any other bad document, rather than
+    stopping the load.
+
+    """
+    with indexer:
+        for line in lines:
+            line = line.rstrip(b'\r\n')
+            if not line.strip():
+                continue
+            indexer.add_raw(line, doc_id_of(line, id_field) if id_field else None)
+    return indexer.stats()
+
 
-    es.indices.create(index_name, ignore=400)
+def doc_id_of(line, id_field):
+    try:
+        doc = json.loads(line)
+    except ValueError:
+        return None
+    return doc.get(id_field) if isinstance(doc, dict) else None
 
-    for line in sys.stdin:
-        revision = json.loads(line)
-        es.index(index_name, revision)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,127 @@
+"""Stream every hit of a query, not just the first page.
+
+iter_hits() walks the full result set with a point-in-time (PIT) and
+search_after, fetching one page at a time, so memory use doesn't depend
+on the number of matches.  If the cluster doesn't support PIT, it falls
+back to the scroll API.
+
+"""
+
+import csv
+import json
+import logging
+
+logger = logging.getLogger('wp_search_tools.search')
+
+DEFAULT_FIELDS = ('page_id', 'rev_id', 'user', 'comment')
+
+# Sorting on rev_id alone is a total order, which search_after needs to
+# not skip hits at page boundaries: each revision is indexed once, with
+# its rev_id as the document _id (tasks.py, or elastic.py --id-field
+# rev_id).  _shard_doc isn't used as a tiebreaker, since it's specific
+# to Elasticsearch and OpenSearch may reject it.
+SORT = [{'rev_id': 'asc'}]
+
+
+def iter_hits(es, index_name, query, fields=DEFAULT_FIELDS, page_size=1000, keep_alive='5m'):
+    """Returns an iterator over the _source of every document matching
+    query (the value of the "query" key of a search body), restricted to
+    fields.
+
+    page_size is the number of hits fetched per request.
+
+    keep_alive is how long the cluster keeps the PIT or scroll context
+    alive between requests.
+
+    """
+    try:
+        response = es.transport.perform_request('POST', f'/{index_name}/_search/point_in_time',
+                                                params={'keep_alive': keep_alive})
+        pit_id = response['pit_id']
+    except Exception as ex:
+        logger.info('Point-in-time not available (%s), falling back to scroll', ex)
+        return _iter_scroll(es, index_name, query, fields, page_size, keep_alive)
+    return _iter_pit(es, pit_id, query, fields, page_size, keep_alive)
+
+
+def _iter_pit(es, pit_id, query, fields, page_size, keep_alive):
+    body = {'query': query,
+            '_source': list(fields),
+            'size': page_size,
+            'sort': SORT,
+            'pit': {'id': pit_id, 'keep_alive': keep_alive},
+            'track_total_hits': False,
+            }
+    try:
+        while True:
+            response = es.transport.perform_request('POST', '/_search', body=body)
+            hits = response['hits']['hits']
+            for hit in hits:
+                yield hit['_source']
+            if len(hits) < page_size:
+                return
+            # The PIT id may change from one response to the next.
+            body['pit']['id'] = response.get('pit_id', body['pit']['id'])
+            body['search_after'] = hits[-1]['sort']
+    finally:
+        try:
+            es.transport.perform_request('DELETE', '/_search/point_in_time',
+                                         body={'pit_id': [body['pit']['id']]})
+        except Exception as ex:
+            logger.warning('Failed to delete point-in-time: %s', ex)
+
+
+def _iter_scroll(es, index_name, query, fields, page_size, keep_alive):
+    body = {'query': query,
+            '_source': list(fields),
+            'sort': ['_doc'],
+            }
+    response = es.search(body=body, index=index_name, size=page_size, scroll=keep_alive)
+    scroll_id = response.get('_scroll_id')
+    try:
+        while True:
+            hits = response['hits']['hits']
+            if not hits:
+                return
+            for hit in hits:
+                yield hit['_source']
+            response = es.scroll(body={'scroll_id': scroll_id, 'scroll': keep_alive})
+            scroll_id = response.get('_scroll_id', scroll_id)
+    finally:
+        if scroll_id:
+            try:
+                es.clear_scroll(body={'scroll_id': [scroll_id]})
+            except Exception as ex:
+                logger.warning('Failed to clear scroll: %s', ex)
+
+
+def write_ndjson(docs, output, fields=DEFAULT_FIELDS):
+    """Writes each doc to output as one line of JSON.  Returns the number
+    of docs written.
+
+    """
+    count = 0
+    for doc in docs:
+        output.write(json.dumps({f: doc.get(f) for f in fields}, ensure_ascii=False))
+        output.write('\n')
+        count += 1
+    return count
+
+
+def write_csv(docs, output, fields=DEFAULT_FIELDS):
+    """Writes docs to output as CSV, with a header row.  Returns the
+    number of docs written.
+
+    """
+    writer = csv.DictWriter(output, fieldnames=list(fields), extrasaction='ignore')
+    writer.writeheader()
+    count = 0
+    for doc in docs:
+        writer.writerow(doc)
+        count += 1
+    return count
+
+
+WRITERS = {'ndjson': write_ndjson,
+           'csv': write_csv,
+           }
@@ -0,0 +1,620 @@
+#!/usr/bin/env python3
+
+"""An offline inverted index of edit comments.
+
+LocalIndex answers AND and phrase queries over the comments in a set
+of dump files without going to OpenSearch, for local analysis and for
+fast lookups on a workstation.  Build one with:
+
+  local_index.py '/dumps/enwiki-20211201-pages-meta-history*' -o enwiki.idx
+
+and query it with search.py --local-index enwiki.idx.
+
+The index is a directory of flat files, all of which are memory-mapped
+when it's opened, so opening is instant and the page cache does the
+caching:
+
+  meta.json: the format version and the number of docs and terms.
+  terms, terms_offsets: the lexicon.  Every distinct token, in sorted
+    order, as concatenated UTF-8, with an array of n + 1 offsets into
+    it, so a term is found by binary search.
+  postings, counts, positions: each term's posting list, in three
+    parts, each with its own offsets file like terms_offsets: the doc
+    ids containing the term (each as the delta from the one before), the
+    number of times it appears in each of them, and its positions in
+    each of them (each as the delta from the one before, starting again
+    from 0 for each doc).  All are varints.  Keeping them apart means a
+    query only decodes positions when it has a phrase in it.
+  doc_freqs: the number of docs containing each term.
+  docs: page_id, rev_id and user number for each doc id.
+  users, users_offsets: the user names, stored like the terms, in
+    order of user number.  A deleted user is number -1.
+
+Every array is of little-endian int64s.  Doc ids are assigned in the
+order revisions are added.
+
+IndexBuilder keeps the posting lists in memory for at most run_docs
+revisions at a time, writing each run to a temporary file and merging
+the runs at the end, so memory use doesn't depend on the size of the
+dumps.
+
+"""
+
+from argparse import ArgumentParser
+from array import array
+import heapq
+from itertools import accumulate
+import json
+import logging
+import mmap
+import os
+import re
+import sys
+from time import perf_counter
+
+from wp_search_tools.indexer.dump_file import PagesDumpFile
+from wp_search_tools.indexer.revision_cache import RevisionCacheFile, is_cache_file
+from wp_search_tools.indexer.scheduler import find_dumps
+
+logger = logging.getLogger('wp_search_tools.search')
+
+VERSION = 1
+RUN_DOCS = 1000000
+# The posting list files, each of which holds a section of every term's
+# list.
+STREAMS = ('postings', 'counts', 'positions')
+
+_TOKEN = re.compile(r'\w+')
+_CLAUSE = re.compile(r'"([^"]*)"|(\S+)')
+_LONG_VARINT = re.compile(rb'[\x80-\xff]+[\x00-\x7f]')
+
+
+def tokenize(text):
+    """Returns the list of tokens in text: runs of word characters,
+    lower-cased.
+
+    """
+    return _TOKEN.findall(text.lower())
+
+
+def parse_query(text):
+    """Returns the clauses of a query, each a list of tokens.  A quoted
+    part of the query is a phrase, whose tokens must appear together and
+    in order; every other token is a clause by itself.  All the clauses
+    must match.
+
+    """
+    clauses = []
+    for phrase, word in _CLAUSE.findall(text):
+        if phrase:
+            tokens = tokenize(phrase)
+            if tokens:
+                clauses.append(tokens)
+        else:
+            clauses.extend([token] for token in tokenize(word))
+    return clauses
+
+
+def encode(buffer, value):
+    """Appends value to buffer (a bytearray) as a varint.
+
+    """
+    while value >= 0x80:
+        buffer.append(value & 0x7f | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def decode(data):
+    """Returns the list of the varints in data.
+
+    """
+    data = bytes(data)
+    # Most values (deltas, counts) fit in a single byte, which list()
+    # converts at C speed; only the longer ones are decoded in Python.
+    values = []
+    previous = 0
+    for match in _LONG_VARINT.finditer(data):
+        values.extend(data[previous:match.start()])
+        value = shift = 0
+        for byte in match.group():
+            value |= (byte & 0x7f) << shift
+            shift += 7
+        values.append(value)
+        previous = match.end()
+    values.extend(data[previous:])
+    return values
+
+
+def _read_varint(buffer, offset):
+    """Returns the varint at offset in buffer, and the offset after it.
+
+    """
+    value = shift = 0
+    while True:
+        byte = buffer[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, offset
+        shift += 7
+
+
+def _check_byteorder():
+    if sys.byteorder != 'little':
+        raise RuntimeError('LocalIndex only supports little-endian hosts')
+
+
+class IndexBuilder:
+    """Writes a LocalIndex to the directory path, which is created if
+    need be:
+
+      with IndexBuilder('enwiki.idx') as builder:
+          builder.add_all(revisions)
+
+    The index is complete when the with block exits (or finish() is
+    called).
+
+    """
+    def __init__(self, path, run_docs=RUN_DOCS):
+        if (not (isinstance(run_docs, int) and run_docs > 0)):
+            raise ValueError(f'run_docs ({run_docs}) must be a positive integer')
+        _check_byteorder()
+        self.path = str(path)
+        self.run_docs = run_docs
+        self.docs = 0
+        self.terms = 0
+        os.makedirs(self.path, exist_ok=True)
+        self._docs_file = open(self._file('docs'), 'wb')
+        self._doc_buffer = array('q')
+        self._users = {}
+        # term -> [encoded doc ids, counts, positions, last doc id, doc count]
+        self._postings = {}
+        self._run_size = 0
+        self._runs = []
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.finish()
+        else:
+            self._cleanup()
+
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+
+    def add(self, revision):
+        doc = self.docs
+        self.docs += 1
+        user = revision.user
+        if user is None:
+            number = -1
+        else:
+            number = self._users.get(user)
+            if number is None:
+                number = self._users[user] = len(self._users)
+        buffer = self._doc_buffer
+        buffer.extend((revision.page_id, revision.rev_id, number))
+        if len(buffer) >= 3 * 65536:
+            buffer.tofile(self._docs_file)
+            del buffer[:]
+
+        if revision.comment:
+            positions = {}
+            for position, token in enumerate(tokenize(revision.comment)):
+                positions.setdefault(token, []).append(position)
+            postings = self._postings
+            for token, where in positions.items():
+                entry = postings.get(token)
+                if entry is None:
+                    entry = postings[token] = [bytearray(), bytearray(), bytearray(), 0, 0]
+                # The first doc id of a run is stored as is, since the
+                # last doc id starts at 0.
+                encode(entry[0], doc - entry[3])
+                encode(entry[1], len(where))
+                data = entry[2]
+                previous = 0
+                for position in where:
+                    encode(data, position - previous)
+                    previous = position
+                entry[3] = doc
+                entry[4] += 1
+        self._run_size += 1
+        if self._run_size >= self.run_docs:
+            self._write_run()
+
+
+    def add_all(self, revisions):
+        for revision in revisions:
+            self.add(revision)
+        return self
+
+
+    def _write_run(self):
+        path = self._file(f'run{len(self._runs)}.tmp')
+        with open(path, 'wb') as f:
+            header = bytearray()
+            for term, *data, last, doc_freq in self._memory_run():
+                del header[:]
+                encode(header, len(term))
+                header += term
+                encode(header, doc_freq)
+                encode(header, last)
+                for stream in data:
+                    encode(header, len(stream))
+                f.write(header)
+                for stream in data:
+                    f.write(stream)
+        self._runs.append(path)
+        self._postings = {}
+        self._run_size = 0
+
+
+    def _memory_run(self):
+        """Returns an iterator over the (term, doc ids, counts, positions,
+        last doc id, doc_freq) entries of the run in memory, in term order.
+
+        """
+        for term, (doc_ids, counts, positions, last, doc_freq) in sorted(self._postings.items()):
+            yield term.encode('utf-8'), doc_ids, counts, positions, last, doc_freq
+
+
+    @staticmethod
+    def _read_run(path):
+        """Like _memory_run(), for the run in the file at path.
+
+        """
+        with open(path, 'rb') as f:
+            if f.seek(0, 2) == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                offset = 0
+                while offset < len(mm):
+                    length, offset = _read_varint(mm, offset)
+                    term = mm[offset:offset + length]
+                    offset += length
+                    doc_freq, offset = _read_varint(mm, offset)
+                    last, offset = _read_varint(mm, offset)
+                    lengths = []
+                    for _ in STREAMS:
+                        length, offset = _read_varint(mm, offset)
+                        lengths.append(length)
+                    data = []
+                    for length in lengths:
+                        data.append(mm[offset:offset + length])
+                        offset += length
+                    yield (term, *data, last, doc_freq)
+
+
+    @staticmethod
+    def _numbered(n, run):
+        for term, *rest in run:
+            yield (term, n, *rest)
+
+
+    def finish(self):
+        """Merges the runs and writes out the lexicon and the users.
+
+        """
+        if self._docs_file.closed:
+            return
+        self._doc_buffer.tofile(self._docs_file)
+        self._docs_file.close()
+
+        if self._runs and self._postings:
+            self._write_run()
+        runs = [self._read_run(path) for path in self._runs] or [self._memory_run()]
+        # Terms sort the same way as str and as UTF-8, and a term's entries
+        # from earlier runs come first, since they have lower doc ids.
+        merged = heapq.merge(*[self._numbered(n, run) for n, run in enumerate(runs)])
+        offsets = {name: array('q', [0]) for name in ('terms', *STREAMS)}
+        doc_freqs = array('q')
+        files = {name: open(self._file(name), 'wb') for name in ('terms', *STREAMS)}
+        try:
+            current = None
+            previous_last = 0
+            for term, _, doc_ids, counts, positions, last, doc_freq in merged:
+                if term != current:
+                    if current is not None:
+                        for name in STREAMS:
+                            offsets[name].append(files[name].tell())
+                    files['terms'].write(term)
+                    offsets['terms'].append(offsets['terms'][-1] + len(term))
+                    doc_freqs.append(0)
+                    current = term
+                else:
+                    # Rebase the run's first doc id on the previous run's
+                    # last one.
+                    first, offset = _read_varint(doc_ids, 0)
+                    rebased = bytearray()
+                    encode(rebased, first - previous_last)
+                    rebased += doc_ids[offset:]
+                    doc_ids = rebased
+                for name, data in zip(STREAMS, (doc_ids, counts, positions)):
+                    files[name].write(data)
+                doc_freqs[-1] += doc_freq
+                previous_last = last
+            if current is not None:
+                for name in STREAMS:
+                    offsets[name].append(files[name].tell())
+        finally:
+            for f in files.values():
+                f.close()
+        self.terms = len(doc_freqs)
+        self._postings = {}
+        self._cleanup()
+
+        offsets['users'] = array('q', [0])
+        with open(self._file('users'), 'wb') as f:
+            for user in self._users:
+                data = user.encode('utf-8')
+                f.write(data)
+                offsets['users'].append(offsets['users'][-1] + len(data))
+        self._users = {}
+
+        for name, values in offsets.items():
+            with open(self._file(f'{name}_offsets'), 'wb') as f:
+                values.tofile(f)
+        with open(self._file('doc_freqs'), 'wb') as f:
+            doc_freqs.tofile(f)
+        with open(self._file('meta.json'), 'w') as f:
+            json.dump({'version': VERSION, 'docs': self.docs, 'terms': self.terms}, f)
+        logger.info('Wrote %d docs and %d terms to "%s"', self.docs, self.terms, self.path)
+
+
+    def _cleanup(self):
+        if not self._docs_file.closed:
+            self._docs_file.close()
+        for path in self._runs:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self._runs = []
+
+
+class LocalIndex:
+    """A read-only view of the index in the directory path:
+
+      with LocalIndex('enwiki.idx') as index:
+          for doc in index.search('"rv vandalism" bot'):
+              print(index.lookup(doc))
+
+    Finding a term is a binary search of the lexicon.  A query decodes
+    only the doc ids of its own terms, rarest first, and the positions
+    of the terms in its phrases, so a selective query takes well under a
+    millisecond.
+
+    """
+    def __init__(self, path):
+        _check_byteorder()
+        self.path = str(path)
+        try:
+            with open(os.path.join(self.path, 'meta.json')) as f:
+                meta = json.load(f)
+        except (OSError, ValueError) as ex:
+            raise ValueError(f'"{self.path}" is not a local index: {ex}')
+        if meta.get('version') != VERSION:
+            raise ValueError(f'"{self.path}" has unsupported version {meta.get("version")}')
+        self.docs = meta['docs']
+        self.terms = meta['terms']
+        self._mmaps = []
+        self._views = []
+        self._data = {}
+        self._offsets = {}
+        for name in ('terms', 'users', *STREAMS):
+            self._data[name] = self._map(name)
+            self._offsets[name] = self._map(f'{name}_offsets', 'q')
+        self._doc_freqs = self._map('doc_freqs', 'q')
+        self._docs = self._map('docs', 'q')
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def __len__(self):
+        return self.docs
+
+
+    def _map(self, name, format=None):
+        with open(os.path.join(self.path, name), 'rb') as f:
+            if f.seek(0, 2) == 0:
+                view = memoryview(b'')
+            else:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._mmaps.append(mm)
+                view = memoryview(mm)
+        self._views.append(view)
+        if format:
+            view = view.cast(format)
+            self._views.append(view)
+        return view
+
+
+    def close(self):
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        for mm in self._mmaps:
+            mm.close()
+        self._mmaps = []
+
+
+    def _get(self, name, n):
+        offsets = self._offsets[name]
+        return self._data[name][offsets[n]:offsets[n + 1]]
+
+
+    def find(self, term):
+        """Returns the term number of term, or -1 if it's not in the
+        index.
+
+        """
+        target = term.encode('utf-8')
+        low, high = 0, self.terms
+        while low < high:
+            middle = (low + high) // 2
+            found = self._get('terms', middle).tobytes()
+            if found < target:
+                low = middle + 1
+            elif found > target:
+                high = middle
+            else:
+                return middle
+        return -1
+
+
+    def doc_freq(self, term):
+        n = self.find(term)
+        return self._doc_freqs[n] if n >= 0 else 0
+
+
+    def _doc_ids(self, n):
+        return list(accumulate(decode(self._get('postings', n))))
+
+
+    def _positions(self, n, docs=None):
+        """Returns a dict mapping the doc ids of term number n (or only
+        those in the set docs) to the term's positions in them.
+
+        """
+        doc_ids = self._doc_ids(n)
+        ends = list(accumulate(decode(self._get('counts', n)), initial=0))
+        values = decode(self._get('positions', n))
+        result = {}
+        for i, doc in enumerate(doc_ids):
+            if docs is None or doc in docs:
+                result[doc] = list(accumulate(values[ends[i]:ends[i + 1]]))
+        return result
+
+
+    def doc_ids(self, term):
+        """Returns the doc ids containing term, in order.
+
+        """
+        n = self.find(term)
+        return self._doc_ids(n) if n >= 0 else []
+
+
+    def positions(self, term, docs=None):
+        """Returns a dict mapping each doc id containing term (or only
+        those in the set docs) to the list of the term's positions in it.
+
+        """
+        n = self.find(term)
+        return self._positions(n, docs) if n >= 0 else {}
+
+
+    def search(self, query, size=None):
+        """Returns the ids of the docs matching query (see parse_query()),
+        in order, up to size of them.
+
+        """
+        clauses = parse_query(query)
+        numbers = {token: self.find(token) for clause in clauses for token in clause}
+        if not numbers or min(numbers.values()) < 0:
+            return []
+        # Intersecting from the rarest term keeps the candidate set small.
+        docs = None
+        for token in sorted(numbers, key=lambda token: self._doc_freqs[numbers[token]]):
+            if docs is None:
+                docs = set(self._doc_ids(numbers[token]))
+            else:
+                docs.intersection_update(self._doc_ids(numbers[token]))
+            if not docs:
+                return []
+
+        phrases = [clause for clause in clauses if len(clause) > 1]
+        if phrases:
+            positions = {token: self._positions(numbers[token], docs)
+                         for token in {token for phrase in phrases for token in phrase}}
+            docs = {doc for doc in docs
+                    if all(self._has_phrase(phrase, positions, doc) for phrase in phrases)}
+        return sorted(docs)[:size]
+
+
+    @staticmethod
+    def _has_phrase(phrase, positions, doc):
+        following = [set(positions[token][doc]) for token in phrase[1:]]
+        return any(all(start + i in where for i, where in enumerate(following, 1))
+                   for start in positions[phrase[0]][doc])
+
+
+    def lookup(self, doc):
+        """Returns the (page_id, rev_id, user) of doc id doc.
+
+        """
+        if not 0 <= doc < self.docs:
+            raise IndexError(f'doc id {doc} out of range')
+        page_id, rev_id, user = self._docs[3 * doc:3 * doc + 3]
+        if user < 0:
+            return page_id, rev_id, None
+        return page_id, rev_id, str(self._get('users', user), 'utf-8')
+
+
+    def hits(self, docs):
+        """Returns a list of dicts, like an OpenSearch _source, for the
+        doc ids in docs.
+
+        """
+        hits = []
+        for doc in docs:
+            page_id, rev_id, user = self.lookup(doc)
+            hits.append({'page_id': page_id, 'rev_id': rev_id, 'user': user})
+        return hits
+
+
+    def stats(self):
+        return {'docs': self.docs,
+                'terms': self.terms,
+                'bytes': sum(len(mm) for mm in self._mmaps),
+                }
+
+
+def build(paths, output, run_docs=RUN_DOCS):
+    """Builds a LocalIndex in output from the revisions in the dump (or
+    revision cache) files in paths, returning the IndexBuilder.
+
+    """
+    with IndexBuilder(output, run_docs) as builder:
+        for path in paths:
+            logger.info('Indexing "%s"', path)
+            df = RevisionCacheFile() if is_cache_file(path) else PagesDumpFile()
+            builder.add_all(df.process(path))
+    return builder
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = ArgumentParser(description='Build a local inverted index of edit comments')
+    parser.add_argument('path',
+                        help='dump file, directory or glob pattern to index')
+    parser.add_argument('--output', '-o', required=True,
+                        help='directory to write the index to')
+    parser.add_argument('--run-docs', type=int, default=RUN_DOCS,
+                        help='''revisions whose postings are held in memory before being
+                        written out as a run (default %(default)s)''')
+    args = parser.parse_args()
+
+    paths = [path for _, path in find_dumps(args.path, include_cache=True)]
+    if not paths:
+        parser.error(f'no files match "{args.path}"')
+    start = perf_counter()
+    builder = build(paths, args.output, args.run_docs)
+    logger.info('Indexed %d revisions from %d files in %.1f seconds',
+                builder.docs, len(paths), perf_counter() - start)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""A local cache of search responses.
+
+Analysts tend to run the same (or nearly the same) queries over and
+over.  QueryCache keeps recent responses keyed on the index name and a
+normalized form of the query body, so a repeated query doesn't have to
+go to the cluster at all.
+
+"""
+
+from collections import OrderedDict
+import json
+import logging
+import os
+import re
+from threading import Lock
+from time import time
+
+logger = logging.getLogger('wp_search_tools.search')
+
+
+def normalize(value):
+    """Returns a copy of a query body with insignificant differences
+    removed: runs of whitespace in strings are collapsed and leading and
+    trailing whitespace is stripped.  Key order is taken care of by
+    make_key().
+
+    """
+    if isinstance(value, dict):
+        return {k: normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize(v) for v in value]
+    if isinstance(value, str):
+        return re.sub(r'\s+', ' ', value).strip()
+    return value
+
+
+def make_key(index_name, body, **params):
+    return json.dumps([index_name, normalize(body), params], sort_keys=True, separators=(',', ':'))
+
+
+class QueryCache:
+    """An LRU cache of search responses.
+
+    maxsize: the maximum number of responses kept.  When the cache is
+    full, the least recently used entry is evicted.
+
+    ttl: seconds after which a cached response is considered stale and
+    is no longer returned.
+
+    path: if given, the cache is loaded from this file on creation, and
+    written back to it by save(), so it persists across invocations.
+
+    The cache is safe to share between threads.
+
+    """
+    def __init__(self, maxsize=1000, ttl=3600.0, path=None):
+        if (not (isinstance(maxsize, int) and maxsize > 0)):
+            raise ValueError(f'maxsize ({maxsize}) must be a positive integer')
+        if (ttl <= 0):
+            raise ValueError(f'ttl ({ttl}) must be > 0')
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        if path and os.path.exists(path):
+            self.load()
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def get(self, key):
+        """Returns the cached response for key, or None.
+
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            stored, response = entry
+            if time() - stored > self.ttl:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return response
+
+
+    def put(self, key, response):
+        with self._lock:
+            self._entries[key] = (time(), response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+
+    def search(self, es, index_name, body, **params):
+        """Like es.search(body=body, index=index_name, **params), but
+        answered from the cache when possible.  A cached response has
+        'cached': true, and no 'took', which was the cluster's time for
+        the original search, not this one.
+
+        """
+        key = make_key(index_name, body, **params)
+        response = self.get(key)
+        if response is None:
+            response = es.search(body=body, index=index_name, **params)
+            self.put(key, response)
+            return response
+        response = dict(response, cached=True)
+        response.pop('took', None)
+        return response
+
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                    'evictions': self.evictions,
+                    'expirations': self.expirations,
+                    'size': len(self._entries),
+                    }
+
+
+    def load(self):
+        """Replaces the contents of the cache with what's in path,
+        dropping anything which has already expired.
+
+        """
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as ex:
+            logger.warning('Ignoring unreadable cache file "%s": %s', self.path, ex)
+            return
+        now = time()
+        with self._lock:
+            self._entries.clear()
+            for key, stored, response in entries[-self.maxsize:]:
+                if now - stored <= self.ttl:
+                    self._entries[key] = (stored, response)
+
+
+    def save(self):
+        """Writes the cache to path, least recently used entry first.
+
+        """
+        if not self.path:
+            return
+        with self._lock:
+            entries = [[key, stored, response] for key, (stored, response) in self._entries.items()]
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, self.path)
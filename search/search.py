@@ -1,15 +1,21 @@
 #!/usr/bin/env python3
 
 from argparse import ArgumentParser
-from configparser import ConfigParser
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 import json
 import logging
 import os
 from pathlib import Path
 from pprint import pprint
 import sys
+from time import perf_counter
 
-from opensearchpy import OpenSearch
+from wp_search_tools.search.export import DEFAULT_FIELDS, WRITERS, iter_hits
+from wp_search_tools.search.local_index import LocalIndex
+from wp_search_tools.search.query_cache import QueryCache
+from wp_search_tools.utils.client import get_client, read_config
 
 
 def main():
@@ -23,35 +29,296 @@ def main():
                         help='print index stats')
     parser.add_argument('--search', nargs='*',
                         help='search term')
+    parser.add_argument('--batch', metavar='FILE',
+                        help='''run each line of FILE ("-" for stdin) as a separate search,
+                        writing one JSON result per line to stdout''')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='number of concurrent searches in batch mode (default %(default)s)')
+    parser.add_argument('--size', type=int, default=10,
+                        help='''maximum hits per query in batch mode or with --local-index
+                        (default %(default)s)''')
+    parser.add_argument('--export', metavar='FILE',
+                        help='''write every hit of the --search query to FILE ("-" for stdout),
+                        rather than just the first page''')
+    parser.add_argument('--format', choices=sorted(WRITERS), default='ndjson',
+                        help='export format (default %(default)s)')
+    parser.add_argument('--fields', nargs='+', default=list(DEFAULT_FIELDS),
+                        help='fields to export (default: %(default)s)')
+    parser.add_argument('--page-size', type=int, default=1000,
+                        help='hits fetched per request when exporting (default %(default)s)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help="don't use the local query cache")
+    parser.add_argument('--cache-file',
+                        help='file to keep the query cache in between runs')
+    parser.add_argument('--cache-size', type=int, default=1000,
+                        help='maximum number of cached responses (default %(default)s)')
+    parser.add_argument('--cache-ttl', type=float, default=3600,
+                        help='seconds a cached response stays valid (default %(default)s)')
+    parser.add_argument('--cache-stats', action='store_true',
+                        help='print query cache statistics to stderr when done')
+    parser.add_argument('--local-index', metavar='DIR',
+                        help='''answer --search, --batch and --stats from the local index
+                        in DIR (see local_index.py) instead of OpenSearch.  Quoted
+                        parts of a query are phrases''')
+    parser.add_argument('--since', metavar='DATE',
+                        help='''only match revisions made on or after DATE (e.g. 2021-01-01,
+                        or date math like now-1y)''')
+    parser.add_argument('--until', metavar='DATE',
+                        help='only match revisions made before DATE')
+    parser.add_argument('--ns', type=int, nargs='+', metavar='N',
+                        help='only match revisions of pages in these namespaces')
+    parser.add_argument('--top-users', type=int, metavar='N',
+                        help='report the N users with the most matching revisions')
+    parser.add_argument('--top-titles', type=int, metavar='N',
+                        help='report the N pages with the most matching revisions')
+    parser.add_argument('--histogram', choices=INTERVALS,
+                        help='report the number of matching revisions per interval')
     args = parser.parse_args()
 
-    config = ConfigParser()
-    config.read(get_configs())
-    user = config.get('elasticsearch', 'user')
-    password = config.get('elasticsearch', 'password')
-    server = config.get('elasticsearch', 'server')
+    filters = build_filters(args.since, args.until, args.ns)
+    aggs = build_aggregations(args.top_users, args.top_titles, args.histogram)
+
+    if args.local_index:
+        if filters or aggs:
+            parser.error('--since, --until, --ns and the aggregations need OpenSearch, '
+                         'not --local-index')
+        with LocalIndex(args.local_index) as index:
+            return local(index, args)
+
+    config = read_config(*get_configs())
     index_name = config.get('elasticsearch', 'index')
 
-    es = OpenSearch(server, http_auth=(user, password))
+    # The connection pool must be at least as big as the number of
+    # threads sharing it, or they just queue up for connections.
+    es = get_client(config, threads=args.workers)
 
-    if args.search:
-        return search(es, index_name, args.search)
-    if args.stats:
-        return stats(es, index_name)
+    cache = None
+    if not args.no_cache:
+        cache = QueryCache(maxsize=args.cache_size, ttl=args.cache_ttl, path=args.cache_file)
+    try:
+        if args.batch:
+            with (nullcontext(sys.stdin) if args.batch == '-' else open(args.batch)) as queries:
+                return batch_search(es, index_name, queries, args.workers, args.size, cache=cache,
+                                    filters=filters, aggs=aggs)
+        if args.search and args.export:
+            return export(es, index_name, args.search, args.export, args.format,
+                          args.fields, args.page_size, filters=filters)
+        if args.search and aggs:
+            return aggregate(es, index_name, args.search, aggs, filters=filters, cache=cache)
+        if args.search:
+            return search(es, index_name, args.search, cache=cache, filters=filters)
+        if args.stats:
+            return stats(es, index_name)
+    finally:
+        if cache:
+            cache.save()
+            if args.cache_stats:
+                print(f'query cache: {json.dumps(cache.stats())}', file=sys.stderr)
 
 
-def search(es, index_name, words):
+# Intervals for --histogram, and the format of their bucket keys.
+INTERVALS = {'year': 'yyyy',
+             'quarter': 'yyyy-MM',
+             'month': 'yyyy-MM',
+             'week': 'yyyy-MM-dd',
+             'day': 'yyyy-MM-dd',
+             }
+
+
+def build_query(text, filters=()):
     query = {
         "query": {
             "bool": {
                 "must": [
-                    {"match": {"comment": ' '.join(words)}},
+                    {"match": {"comment": text}},
                     ]
                 }
             }
         }
+    if filters:
+        query["query"]["bool"]["filter"] = list(filters)
+    return query
+
 
-    pprint(es.search(body=query, index=index_name))
+def build_filters(since=None, until=None, namespaces=None):
+    """Returns a list of filter clauses restricting a query to revisions
+    made in [since, until) and to pages in namespaces.  Any of them may
+    be None, for no restriction.
+
+    """
+    filters = []
+    if since or until:
+        timestamp = {}
+        if since:
+            timestamp["gte"] = since
+        if until:
+            timestamp["lt"] = until
+        filters.append({"range": {"timestamp": timestamp}})
+    if namespaces:
+        filters.append({"terms": {"ns": list(namespaces)}})
+    return filters
+
+
+def build_aggregations(top_users=None, top_titles=None, interval=None):
+    """Returns the "aggs" of a search body which counts the matching
+    revisions of the top_users users and top_titles pages with the most
+    of them, and the matching revisions per interval (one of
+    INTERVALS).  Returns an empty dict if there's nothing to count.
+
+    """
+    aggs = {}
+    if top_users:
+        aggs["top_users"] = {"terms": {"field": "user", "size": top_users}}
+    if top_titles:
+        aggs["top_titles"] = {"terms": {"field": "title", "size": top_titles}}
+    if interval:
+        aggs["per_" + interval] = {"date_histogram": {"field": "timestamp",
+                                                      "calendar_interval": interval,
+                                                      "format": INTERVALS[interval],
+                                                      "min_doc_count": 1,
+                                                      }}
+    return aggs
+
+
+def summarize_aggregations(response):
+    """Returns the aggregations in a search response as a dict of lists
+    of [key, count] pairs, in the order the cluster returned them.
+
+    """
+    return {name: [[bucket.get('key_as_string', bucket['key']), bucket['doc_count']]
+                   for bucket in agg['buckets']]
+            for name, agg in response.get('aggregations', {}).items()}
+
+
+def run_search(es, index_name, body, cache=None, **params):
+    if cache is None:
+        return es.search(body=body, index=index_name, **params)
+    return cache.search(es, index_name, body, **params)
+
+
+def search(es, index_name, words, cache=None, filters=()):
+    query = build_query(' '.join(words), filters)
+    pprint(run_search(es, index_name, query, cache))
+
+
+def aggregate(es, index_name, words, aggs, filters=(), cache=None, output=sys.stdout):
+    """Runs the aggregations in aggs (see build_aggregations()) over the
+    revisions matching words, and writes the total and the buckets to
+    output as JSON.  The counting is done by the cluster, and no hits
+    are fetched, so the response is small however many revisions match.
+
+    """
+    body = build_query(' '.join(words), filters)
+    body["aggs"] = aggs
+    body["track_total_hits"] = True
+    response = run_search(es, index_name, body, cache, size=0)
+    output.write(json.dumps({'query': ' '.join(words),
+                             'took_ms': response.get('took'),
+                             'cached': response.get('cached', False),
+                             'total': response['hits']['total'],
+                             **summarize_aggregations(response),
+                             }) + '\n')
+
+
+def export(es, index_name, words, path, format, fields, page_size, filters=()):
+    """Streams every hit for words to path, never holding more than one
+    page of hits in memory.
+
+    """
+    query = build_query(' '.join(words), filters)['query']
+    hits = iter_hits(es, index_name, query, fields=fields, page_size=page_size)
+    with (nullcontext(sys.stdout) if path == '-' else open(path, 'w', newline='')) as output:
+        count = WRITERS[format](hits, output, fields)
+    print(f'exported {count} hits', file=sys.stderr)
+
+
+def batch_search(es, index_name, queries, workers=8, size=10, output=sys.stdout, cache=None,
+                 filters=(), aggs=None):
+    """Runs each non-blank line of queries as a search, using a pool of
+    worker threads which share one connection pool.  Results are written
+    to output as JSON lines, in the same order as the queries.
+
+    filters restrict every query (see build_filters()).  If aggs is
+    given (see build_aggregations()), each result also includes the
+    aggregations, as by aggregate().
+
+    """
+    def run(text):
+        start = perf_counter()
+        body = build_query(text, filters)
+        if aggs:
+            body["aggs"] = aggs
+        try:
+            response = run_search(es, index_name, body, cache, size=size)
+        except Exception as ex:
+            return {'query': text,
+                    'error': str(ex),
+                    'elapsed_ms': round(1000 * (perf_counter() - start), 1),
+                    }
+        result = {'query': text,
+                  'took_ms': response.get('took'),
+                  'cached': response.get('cached', False),
+                  'elapsed_ms': round(1000 * (perf_counter() - start), 1),
+                  'total': response['hits']['total'],
+                  'hits': [hit['_source'] for hit in response['hits']['hits']],
+                  }
+        if aggs:
+            result['aggregations'] = summarize_aggregations(response)
+        return result
+
+    def write(future):
+        output.write(json.dumps(future.result()) + '\n')
+        output.flush()
+
+    # Only a few queries per worker are submitted ahead, so results
+    # stream out as they arrive and a huge input isn't read all at once.
+    pending = deque()
+    with ThreadPoolExecutor(workers) as pool:
+        for line in queries:
+            text = line.strip()
+            if not text:
+                continue
+            pending.append(pool.submit(run, text))
+            if len(pending) >= 4 * workers:
+                write(pending.popleft())
+        while pending:
+            write(pending.popleft())
+
+
+def local(index, args):
+    if args.batch:
+        with (nullcontext(sys.stdin) if args.batch == '-' else open(args.batch)) as queries:
+            return local_batch_search(index, queries, args.size)
+    if args.search:
+        return pprint(local_search(index, ' '.join(args.search), args.size))
+    if args.stats:
+        print(f'local index "{args.local_index}": {json.dumps(index.stats())}')
+
+
+def local_search(index, text, size=10):
+    """Returns the result of running text against a LocalIndex, in the
+    same form as the results of batch_search().
+
+    """
+    start = perf_counter()
+    docs = index.search(text)
+    hits = index.hits(docs[:size])
+    return {'query': text,
+            'elapsed_ms': round(1000 * (perf_counter() - start), 3),
+            'total': len(docs),
+            'hits': hits,
+            }
+
+
+def local_batch_search(index, queries, size=10, output=sys.stdout):
+    """Like batch_search(), but against a LocalIndex.  Queries take so
+    little time that they're simply run one after another.
+
+    """
+    for line in queries:
+        text = line.strip()
+        if text:
+            output.write(json.dumps(local_search(index, text, size)) + '\n')
 
 
 def stats(es, index_name):
@@ -60,10 +327,10 @@ def stats(es, index_name):
 
 
 def get_configs():
-    """Returns a interable over all the config files to read.
+    """Returns a interable over the config files to read, after
+    $HOME/.elasticsearch.ini.
 
     """
-    yield Path.home() / '.elasticsearch.ini'
     if 'SEARCH_TOOLS' in os.environ:
         yield Path(os.environ['SEARCH_TOOLS']) / 'wp_search_tools/elasticsearch.ini'
     yield Path('elasticsearch.ini')
@@ -0,0 +1,54 @@
+from unittest import TestCase
+
+from wp_search_tools.search.elastic import load
+
+
+class FakeIndexer:
+
+    def __init__(self):
+        self.added = []
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.closed = True
+
+    def add_raw(self, source, doc_id=None):
+        self.added.append((source, doc_id))
+
+    def stats(self):
+        return {'indexed': len(self.added)}
+
+
+class LoadTest(TestCase):
+
+    LINES = [b'{"rev_id": 1, "comment": "a"}\n',
+             b'\n',
+             b'   \r\n',
+             b'{"comment": "no id"}\r\n',
+             b'{"rev_id": 3, "comment": "\xc3\xa9"}',
+             ]
+
+    def test_lines_are_sent_as_is_without_ids(self):
+        indexer = FakeIndexer()
+        self.assertEqual(load(indexer, self.LINES), {'indexed': 3})
+        self.assertEqual(indexer.added, [(b'{"rev_id": 1, "comment": "a"}', None),
+                                         (b'{"comment": "no id"}', None),
+                                         (b'{"rev_id": 3, "comment": "\xc3\xa9"}', None)])
+        self.assertTrue(indexer.closed)
+
+
+    def test_id_field_is_used_as_doc_id(self):
+        indexer = FakeIndexer()
+        load(indexer, self.LINES, id_field='rev_id')
+        self.assertEqual([doc_id for _, doc_id in indexer.added], [1, None, 3])
+
+
+    def test_malformed_lines_are_passed_on(self):
+        indexer = FakeIndexer()
+        load(indexer, [b'{"rev_id": 1', b'[1, 2]', b'{"rev_id": 2}'], id_field='rev_id')
+        self.assertEqual(indexer.added, [(b'{"rev_id": 1', None),
+                                         (b'[1, 2]', None),
+                                         (b'{"rev_id": 2}', 2)])
@@ -0,0 +1,86 @@
+from io import StringIO
+from unittest import TestCase
+from unittest.mock import Mock, call
+
+from wp_search_tools.search.export import iter_hits, write_csv, write_ndjson
+
+
+def hit(rev_id):
+    return {'_source': {'page_id': 1, 'rev_id': rev_id, 'user': 'u', 'comment': f'c{rev_id}'},
+            'sort': [rev_id]}
+
+
+def response(*rev_ids, **extra):
+    result = {'hits': {'hits': [hit(r) for r in rev_ids]}}
+    result.update(extra)
+    return result
+
+
+class PitExportTest(TestCase):
+
+    def test_pages_are_walked_with_search_after(self):
+        es = Mock()
+        es.transport.perform_request.side_effect = [
+            {'pit_id': 'pit1'},
+            response(1, 2, pit_id='pit2'),
+            response(3),
+            {},
+        ]
+        docs = list(iter_hits(es, 'index', {'match_all': {}}, page_size=2))
+        self.assertEqual([d['rev_id'] for d in docs], [1, 2, 3])
+
+        calls = es.transport.perform_request.call_args_list
+        self.assertEqual(calls[0], call('POST', '/index/_search/point_in_time',
+                                        params={'keep_alive': '5m'}))
+        self.assertEqual(calls[1][1]['body']['sort'], [{'rev_id': 'asc'}])
+        second_page = calls[2][1]['body']
+        self.assertEqual(second_page['search_after'], [2])
+        self.assertEqual(second_page['pit']['id'], 'pit2')
+        self.assertEqual(calls[3], call('DELETE', '/_search/point_in_time',
+                                        body={'pit_id': ['pit2']}))
+
+
+    def test_pit_is_deleted_when_export_is_abandoned(self):
+        es = Mock()
+        es.transport.perform_request.side_effect = [
+            {'pit_id': 'pit1'},
+            response(1, 2),
+            {},
+        ]
+        docs = iter_hits(es, 'index', {'match_all': {}}, page_size=2)
+        next(docs)
+        docs.close()
+        self.assertEqual(es.transport.perform_request.call_args_list[-1],
+                         call('DELETE', '/_search/point_in_time', body={'pit_id': ['pit1']}))
+
+
+class ScrollExportTest(TestCase):
+
+    def test_scroll_is_used_when_pit_is_unavailable(self):
+        es = Mock()
+        es.transport.perform_request.side_effect = Exception('no PIT here')
+        es.search.return_value = response(1, 2, _scroll_id='s1')
+        es.scroll.side_effect = [response(3, _scroll_id='s2'), response()]
+        docs = list(iter_hits(es, 'index', {'match_all': {}}, page_size=2))
+        self.assertEqual([d['rev_id'] for d in docs], [1, 2, 3])
+        es.clear_scroll.assert_called_once_with(body={'scroll_id': ['s2']})
+
+
+class WriterTest(TestCase):
+
+    DOCS = [{'rev_id': 1, 'user': 'u1', 'comment': 'hello, world'},
+            {'rev_id': 2, 'user': 'u2', 'comment': None}]
+
+    def test_ndjson_projects_fields(self):
+        output = StringIO()
+        self.assertEqual(write_ndjson(self.DOCS, output, ['rev_id', 'comment']), 2)
+        self.assertEqual(output.getvalue(),
+                         '{"rev_id": 1, "comment": "hello, world"}\n'
+                         '{"rev_id": 2, "comment": null}\n')
+
+
+    def test_csv_has_header_and_projects_fields(self):
+        output = StringIO()
+        self.assertEqual(write_csv(self.DOCS, output, ['rev_id', 'comment']), 2)
+        self.assertEqual(output.getvalue().splitlines(),
+                         ['rev_id,comment', '1,"hello, world"', '2,'])
@@ -0,0 +1,157 @@
+import json
+import os
+from pathlib import Path
+import random
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from wp_search_tools.indexer.dump_file import PagesDumpFile, RevisionData
+from wp_search_tools.search.local_index import (IndexBuilder, LocalIndex, build, decode, encode,
+                                                parse_query, tokenize)
+
+
+SAMPLE = Path(__file__).parent.parent / 'indexer/test/pages-meta-history0.xml-p1p4'
+
+REVISIONS = [
+    RevisionData(1, 10, 'Alice', 'Reverted vandalism'),
+    RevisionData(1, 11, 'Bob', 'rv vandalism by Alice'),
+    RevisionData(2, 20, None, 'fix typo'),
+    RevisionData(2, 21, 'Alice', None),
+    RevisionData(3, 30, 'Bob', 'vandalism reverted, typo fix'),
+    RevisionData(3, 31, 'Alice', ''),
+    RevisionData(4, 40, 'Zoë', 'fix fix typo typo'),
+]
+
+
+class EncodingTest(TestCase):
+
+    def test_varints_round_trip(self):
+        values = [0, 1, 127, 128, 300, 2 ** 35, 2 ** 63 - 1]
+        buffer = bytearray()
+        for value in values:
+            encode(buffer, value)
+        self.assertEqual(list(decode(buffer)), values)
+
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize('Rv: [[WP:VANDAL]] Zoë'), ['rv', 'wp', 'vandal', 'zoë'])
+
+
+    def test_parse_query(self):
+        self.assertEqual(parse_query('"rv vandalism" bot "" "Fix!"'),
+                         [['rv', 'vandalism'], ['bot'], ['fix']])
+
+
+class LocalIndexTest(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'index')
+
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+
+    def build(self, revisions=REVISIONS, **kwargs):
+        with IndexBuilder(self.path, **kwargs) as builder:
+            builder.add_all(revisions)
+        return LocalIndex(self.path)
+
+
+    def test_run_docs_must_be_a_positive_integer(self):
+        with self.assertRaisesRegex(ValueError, 'positive integer'):
+            IndexBuilder(self.path, run_docs=0)
+
+
+    def test_and_query(self):
+        with self.build() as index:
+            self.assertEqual(index.search('vandalism'), [0, 1, 4])
+            self.assertEqual(index.search('Vandalism REVERTED'), [0, 4])
+            self.assertEqual(index.search('typo fix'), [2, 4, 6])
+            self.assertEqual(index.search('vandalism nonesuch'), [])
+            self.assertEqual(index.search(''), [])
+
+
+    def test_phrase_query(self):
+        with self.build() as index:
+            self.assertEqual(index.search('"fix typo"'), [2, 6])
+            self.assertEqual(index.search('"typo fix"'), [4])
+            self.assertEqual(index.search('"reverted vandalism"'), [0])
+            self.assertEqual(index.search('"typo typo" fix'), [6])
+            self.assertEqual(index.search('"vandalism typo"'), [])
+
+
+    def test_size_limits_results(self):
+        with self.build() as index:
+            self.assertEqual(index.search('vandalism', size=2), [0, 1])
+
+
+    def test_lookup(self):
+        with self.build() as index:
+            self.assertEqual(len(index), len(REVISIONS))
+            self.assertEqual(index.lookup(0), (1, 10, 'Alice'))
+            self.assertEqual(index.lookup(2), (2, 20, None))
+            self.assertEqual(index.lookup(6), (4, 40, 'Zoë'))
+            self.assertEqual(index.hits([1]), [{'page_id': 1, 'rev_id': 11, 'user': 'Bob'}])
+            with self.assertRaises(IndexError):
+                index.lookup(7)
+
+
+    def test_positions(self):
+        with self.build() as index:
+            self.assertEqual(index.positions('typo'), {2: [1], 4: [2], 6: [2, 3]})
+            self.assertEqual(index.positions('typo', {4}), {4: [2]})
+            self.assertEqual(index.doc_freq('fix'), 3)
+            self.assertEqual(index.doc_freq('nonesuch'), 0)
+
+
+    def test_runs_merge_to_the_same_index(self):
+        rng = random.Random(1)
+        words = ['w%d' % i for i in range(50)]
+        revisions = [RevisionData(i, i, f'u{i % 7}', ' '.join(rng.choices(words, k=rng.randint(0, 8))))
+                     for i in range(500)]
+        with self.build(revisions) as index:
+            expected = {word: index.positions(word) for word in words}
+        for name in os.listdir(self.path):
+            os.remove(os.path.join(self.path, name))
+        with self.build(revisions, run_docs=37) as index:
+            for word in words:
+                self.assertEqual(index.positions(word), expected[word])
+            self.assertEqual(index.lookup(499), (499, 499, 'u2'))
+        self.assertFalse([name for name in os.listdir(self.path) if name.endswith('.tmp')])
+
+
+    def test_empty_index(self):
+        with self.build([]) as index:
+            self.assertEqual(len(index), 0)
+            self.assertEqual(index.search('anything'), [])
+            self.assertEqual(index.stats()['terms'], 0)
+
+
+    def test_unsupported_version_raises(self):
+        self.build().close()
+        meta_path = os.path.join(self.path, 'meta.json')
+        with open(meta_path) as f:
+            meta = json.load(f)
+        meta['version'] = 99
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f)
+        with self.assertRaisesRegex(ValueError, 'unsupported version'):
+            LocalIndex(self.path)
+
+
+    def test_missing_index_raises(self):
+        with self.assertRaisesRegex(ValueError, 'not a local index'):
+            LocalIndex(self.path)
+
+
+    def test_build_from_dump(self):
+        build([str(SAMPLE)], self.path, run_docs=2)
+        revisions = list(PagesDumpFile().process(str(SAMPLE)))
+        with LocalIndex(self.path) as index:
+            self.assertEqual(len(index), len(revisions))
+            for doc, revision in enumerate(revisions):
+                self.assertEqual(index.lookup(doc), (revision.page_id, revision.rev_id, revision.user))
+                if revision.comment:
+                    self.assertIn(doc, index.search(f'"{revision.comment}"'))
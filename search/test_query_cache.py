@@ -0,0 +1,77 @@
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+from wp_search_tools.search.query_cache import QueryCache, make_key
+
+
+class QueryCacheTest(TestCase):
+
+    def test_construct(self):
+        QueryCache()
+
+
+    def test_maxsize_must_be_a_positive_integer(self):
+        with self.assertRaisesRegex(ValueError, 'positive integer'):
+            QueryCache(maxsize=0)
+
+
+    def test_whitespace_and_key_order_do_not_change_key(self):
+        self.assertEqual(make_key('index', {'a': 1, 'q': ' foo   bar'}),
+                         make_key('index', {'q': 'foo bar', 'a': 1}))
+
+
+    def test_index_name_changes_key(self):
+        self.assertNotEqual(make_key('index1', {'q': 'foo'}),
+                            make_key('index2', {'q': 'foo'}))
+
+
+    def test_repeated_search_is_answered_from_cache(self):
+        es = Mock()
+        es.search.return_value = {'took': 12, 'hits': {}}
+        cache = QueryCache()
+        self.assertEqual(cache.search(es, 'index', {'q': 'foo'}), {'took': 12, 'hits': {}})
+        self.assertEqual(cache.search(es, 'index', {'q': ' foo '}), {'hits': {}, 'cached': True})
+        self.assertEqual(es.search.return_value, {'took': 12, 'hits': {}})
+        es.search.assert_called_once_with(body={'q': 'foo'}, index='index')
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = QueryCache(maxsize=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+
+    def test_entries_expire_after_ttl(self):
+        with patch('wp_search_tools.search.query_cache.time', autospec=True) as clock:
+            clock.side_effect = [0.0, 5.0, 20.0]
+            cache = QueryCache(ttl=10)
+            cache.put('a', 1)
+            self.assertEqual(cache.get('a'), 1)
+            self.assertIsNone(cache.get('a'))
+            self.assertEqual(cache.stats()['expirations'], 1)
+
+
+    def test_cache_persists_to_file(self):
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'cache.json')
+            cache = QueryCache(path=path)
+            cache.put('a', {'hits': [1, 2]})
+            cache.save()
+            self.assertEqual(QueryCache(path=path).get('a'), {'hits': [1, 2]})
+
+
+    def test_unreadable_cache_file_is_ignored(self):
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'cache.json')
+            with open(path, 'w') as f:
+                f.write('not json')
+            self.assertEqual(len(QueryCache(path=path)), 0)
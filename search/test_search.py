@@ -0,0 +1,181 @@
+from io import StringIO
+import json
+from time import sleep
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+from wp_search_tools.search.query_cache import QueryCache
+from wp_search_tools.search.search import (INTERVALS, aggregate, batch_search, build_aggregations,
+                                           build_filters, build_query, export,
+                                           summarize_aggregations)
+
+
+def response(text, total=1):
+    return {'took': 2,
+            'hits': {'total': {'value': total},
+                     'hits': [{'_source': {'comment': text}}]},
+            }
+
+
+def run_search(body, index, size):
+    text = body['query']['bool']['must'][0]['match']['comment']
+    if text == 'boom':
+        raise RuntimeError('search failed')
+    # Later queries finish first, so results arrive out of order.
+    sleep(0.01 / len(text))
+    return response(text)
+
+
+class BatchSearchTest(TestCase):
+
+    def batch(self, lines, **kwargs):
+        es = Mock()
+        es.search.side_effect = run_search
+        output = StringIO()
+        batch_search(es, 'index', lines, output=output, **kwargs)
+        return es, [json.loads(line) for line in output.getvalue().splitlines()]
+
+
+    def test_results_are_in_query_order(self):
+        queries = ['q' * n for n in range(1, 21)]
+        es, results = self.batch([q + '\n' for q in queries], workers=4)
+        self.assertEqual([r['query'] for r in results], queries)
+        self.assertEqual([r['hits'] for r in results], [[{'comment': q}] for q in queries])
+        self.assertEqual(es.search.call_count, len(queries))
+
+
+    def test_blank_lines_are_skipped(self):
+        es, results = self.batch(['one\n', '\n', '   \n', 'two'])
+        self.assertEqual([r['query'] for r in results], ['one', 'two'])
+
+
+    def test_size_is_passed_through(self):
+        es, results = self.batch(['one'], size=3)
+        self.assertEqual(es.search.call_args.kwargs['size'], 3)
+        self.assertEqual(results[0]['total'], {'value': 1})
+        self.assertEqual(results[0]['took_ms'], 2)
+
+
+    def test_failed_query_is_reported_and_others_continue(self):
+        es, results = self.batch(['one', 'boom', 'three'], workers=2)
+        self.assertEqual([r['query'] for r in results], ['one', 'boom', 'three'])
+        self.assertEqual(results[1]['error'], 'search failed')
+        self.assertNotIn('hits', results[1])
+        self.assertEqual(results[2]['hits'], [{'comment': 'three'}])
+
+
+    def test_cached_results_are_marked(self):
+        cache = QueryCache()
+        es, first = self.batch(['one'], cache=cache)
+        es, second = self.batch(['one'], cache=cache)
+        es.search.assert_not_called()
+        self.assertEqual((first[0]['cached'], first[0]['took_ms']), (False, 2))
+        self.assertEqual((second[0]['cached'], second[0]['took_ms']), (True, None))
+        self.assertEqual(second[0]['hits'], first[0]['hits'])
+
+
+class ExportTest(TestCase):
+
+    def test_export_to_stdout_leaves_it_open(self):
+        stdout = StringIO()
+        with patch('sys.stdout', new=stdout), patch('sys.stderr', new=StringIO()), \
+             patch('wp_search_tools.search.search.iter_hits', return_value=iter([{'rev_id': 1}])):
+            export(Mock(), 'index', ['foo'], '-', 'ndjson', ['rev_id'], 100)
+        self.assertFalse(stdout.closed)
+        self.assertEqual(json.loads(stdout.getvalue()), {'rev_id': 1})
+
+
+AGGREGATED = {'took': 5,
+              'hits': {'total': {'value': 42}, 'hits': []},
+              'aggregations': {
+                  'top_users': {'buckets': [{'key': 'Alice', 'doc_count': 30},
+                                            {'key': 'Bob', 'doc_count': 12}]},
+                  'per_month': {'buckets': [{'key': 978307200000, 'key_as_string': '2001-01',
+                                             'doc_count': 42}]},
+                  }}
+
+
+class QueryTest(TestCase):
+
+    def test_query_without_filters(self):
+        self.assertEqual(build_query('rv'),
+                         {'query': {'bool': {'must': [{'match': {'comment': 'rv'}}]}}})
+
+
+    def test_filters(self):
+        filters = build_filters('2021-01-01', 'now', [0, 1])
+        self.assertEqual(filters, [{'range': {'timestamp': {'gte': '2021-01-01', 'lt': 'now'}}},
+                                   {'terms': {'ns': [0, 1]}}])
+        self.assertEqual(build_query('rv', filters)['query']['bool']['filter'], filters)
+
+
+    def test_open_ended_range(self):
+        self.assertEqual(build_filters(until='2002-01-01'),
+                         [{'range': {'timestamp': {'lt': '2002-01-01'}}}])
+        self.assertEqual(build_filters(), [])
+
+
+    def test_main_namespace_is_a_filter(self):
+        self.assertEqual(build_filters(namespaces=[0]), [{'terms': {'ns': [0]}}])
+
+
+    def test_aggregations(self):
+        self.assertEqual(build_aggregations(5, 3, 'month'),
+                         {'top_users': {'terms': {'field': 'user', 'size': 5}},
+                          'top_titles': {'terms': {'field': 'title', 'size': 3}},
+                          'per_month': {'date_histogram': {'field': 'timestamp',
+                                                           'calendar_interval': 'month',
+                                                           'format': 'yyyy-MM',
+                                                           'min_doc_count': 1}}})
+        self.assertEqual(build_aggregations(), {})
+
+
+    def test_every_interval_has_a_histogram(self):
+        for interval, format in INTERVALS.items():
+            with self.subTest(interval=interval):
+                histogram = build_aggregations(interval=interval)[f'per_{interval}']['date_histogram']
+                self.assertEqual(histogram['calendar_interval'], interval)
+                self.assertEqual(histogram['format'], format)
+
+
+    def test_summarize_prefers_key_as_string(self):
+        self.assertEqual(summarize_aggregations(AGGREGATED),
+                         {'top_users': [['Alice', 30], ['Bob', 12]],
+                          'per_month': [['2001-01', 42]]})
+        self.assertEqual(summarize_aggregations({'hits': {}}), {})
+
+
+class AggregateTest(TestCase):
+
+    def test_only_counts_are_fetched(self):
+        es = Mock()
+        es.search.return_value = AGGREGATED
+        output = StringIO()
+        aggs = build_aggregations(top_users=2, interval='month')
+        aggregate(es, 'index', ['rv', 'vandalism'], aggs, build_filters(namespaces=[0]), output=output)
+        kwargs = es.search.call_args.kwargs
+        self.assertEqual(kwargs['size'], 0)
+        self.assertEqual(kwargs['index'], 'index')
+        self.assertTrue(kwargs['body']['track_total_hits'])
+        self.assertEqual(kwargs['body']['aggs'], aggs)
+        self.assertEqual(kwargs['body']['query']['bool']['filter'], [{'terms': {'ns': [0]}}])
+        self.assertEqual(json.loads(output.getvalue()),
+                         {'query': 'rv vandalism', 'took_ms': 5, 'cached': False,
+                          'total': {'value': 42},
+                          'top_users': [['Alice', 30], ['Bob', 12]],
+                          'per_month': [['2001-01', 42]]})
+
+
+    def test_batch_results_include_aggregations(self):
+        es = Mock()
+        es.search.return_value = AGGREGATED
+        output = StringIO()
+        aggs = build_aggregations(top_users=2)
+        batch_search(es, 'index', ['rv'], output=output, filters=build_filters('2001-01-01'),
+                     aggs=aggs)
+        body = es.search.call_args.kwargs['body']
+        self.assertEqual(body['aggs'], aggs)
+        self.assertEqual(body['query']['bool']['filter'],
+                         [{'range': {'timestamp': {'gte': '2001-01-01'}}}])
+        result = json.loads(output.getvalue())
+        self.assertEqual(result['aggregations']['top_users'], [['Alice', 30], ['Bob', 12]])
@@ -0,0 +1,270 @@
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore, Lock
+from time import perf_counter, sleep
+
+logger = logging.getLogger('wp_search_tools.bulk')
+
+
+def serialize(doc):
+    """Returns doc (a dict) as the bytes of a _bulk source line.  This is
+    what BulkIndexer.add() sends; callers which serialize documents
+    themselves, to pass to add_raw(), should use it too.
+
+    """
+    return json.dumps(doc, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class BulkIndexer:
+    """Accumulate documents and send them to OpenSearch in _bulk requests.
+
+    es: an OpenSearch client.
+
+    index_name: the index the documents are written to.
+
+    batch_docs, batch_bytes: a request is sent as soon as the pending
+    batch reaches either this many documents or this many bytes of
+    request body.
+
+    concurrency: the number of requests which may be in flight at once.
+    With concurrency=1, requests are sent synchronously from add() and
+    flush().  With more, they are sent from a thread pool, and add()
+    blocks once that many requests are outstanding.
+
+    max_retries, backoff: items which are rejected with a 429 (too many
+    requests) status, and whole requests rejected the same way, are
+    retried up to max_retries times, sleeping backoff * 2**n seconds
+    before the n-th retry.  Any other failed item is counted and, up to
+    max_errors of them, recorded in errors.  The _ids of all of them can
+    be had from take_failed().
+
+    on_request: if given, called with the duration in seconds of each
+    _bulk request (from whichever thread sent it), for latency metrics.
+
+    Use as a context manager, or call close() when done, to make sure
+    the last partial batch is sent.
+
+    """
+    def __init__(self, es, index_name, batch_docs=1000, batch_bytes=5*1024*1024,
+                 concurrency=1, max_retries=3, backoff=1.0, max_errors=100, on_request=None):
+        if (not (isinstance(batch_docs, int) and batch_docs > 0)):
+            raise ValueError(f'batch_docs ({batch_docs}) must be a positive integer')
+        if (not (isinstance(batch_bytes, int) and batch_bytes > 0)):
+            raise ValueError(f'batch_bytes ({batch_bytes}) must be a positive integer')
+        if (not (isinstance(concurrency, int) and concurrency > 0)):
+            raise ValueError(f'concurrency ({concurrency}) must be a positive integer')
+        self.es = es
+        self.index_name = index_name
+        self.batch_docs = batch_docs
+        self.batch_bytes = batch_bytes
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_errors = max_errors
+        self.on_request = on_request
+
+        self.indexed = 0
+        self.failed = 0
+        self.retries = 0
+        self.requests = 0
+        self.bytes_sent = 0
+        self.errors = []
+
+        self._failed_ids = []
+        self._lines = []
+        self._docs = 0
+        self._bytes = 0
+        self._lock = Lock()
+        self._exception = None
+        self._start = perf_counter()
+        if concurrency > 1:
+            self._executor = ThreadPoolExecutor(concurrency)
+            self._slots = BoundedSemaphore(concurrency)
+        else:
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def add(self, doc, doc_id=None):
+        """Queue doc (a dict) for indexing.  If doc_id is given, it is used
+        as the document's _id; otherwise OpenSearch generates one.
+
+        """
+        self.add_raw(serialize(doc), doc_id)
+
+
+    def add_raw(self, source, doc_id=None):
+        """Queue an already-serialized JSON document (bytes, with no
+        trailing newline) for indexing, without decoding it.
+
+        """
+        if doc_id is None:
+            action = b'{"index":{}}'
+        else:
+            action = b'{"index":{"_id":%s}}' % json.dumps(str(doc_id)).encode('utf-8')
+        self._lines.append(action)
+        self._lines.append(source)
+        self._docs += 1
+        self._bytes += len(action) + len(source) + 2
+        if self._docs >= self.batch_docs or self._bytes >= self.batch_bytes:
+            self.flush()
+
+
+    def flush(self):
+        """Send whatever is in the pending batch.  With concurrency > 1,
+        this returns as soon as the request has been handed to the
+        thread pool; use wait() to wait for it to finish.
+
+        """
+        self._raise_pending()
+        if not self._docs:
+            return
+        lines = self._lines
+        self._lines = []
+        self._docs = 0
+        self._bytes = 0
+        if self._executor is None:
+            self._send(lines)
+            return
+        self._slots.acquire()
+        future = self._executor.submit(self._send, lines)
+        future.add_done_callback(self._done)
+
+
+    def wait(self):
+        """Wait for all in-flight requests to finish.
+
+        """
+        if self._executor is not None:
+            for _ in range(self.concurrency):
+                self._slots.acquire()
+            for _ in range(self.concurrency):
+                self._slots.release()
+        self._raise_pending()
+
+
+    def close(self):
+        """Send the last partial batch, wait for everything to finish, and
+        return stats().
+
+        """
+        try:
+            self.flush()
+            self.wait()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+        return self.stats()
+
+
+    def take_failed(self):
+        """Returns a list of the _ids of the items which have failed since
+        the last call (None for a document whose _id was generated by
+        OpenSearch), and forgets them.  Call wait() first to include
+        every request sent so far.
+
+        """
+        with self._lock:
+            failed, self._failed_ids = self._failed_ids, []
+        return failed
+
+
+    def stats(self):
+        """Returns a dict of counters suitable for logging or for
+        including in a task result.
+
+        """
+        seconds = perf_counter() - self._start
+        with self._lock:
+            return {'indexed': self.indexed,
+                    'failed': self.failed,
+                    'retries': self.retries,
+                    'requests': self.requests,
+                    'bytes_sent': self.bytes_sent,
+                    'seconds': round(seconds, 3),
+                    'docs_per_second': round(self.indexed / seconds, 1) if seconds else 0.0,
+                    'errors': list(self.errors),
+                    }
+
+
+    def _done(self, future):
+        exception = future.exception()
+        if exception is not None:
+            with self._lock:
+                if self._exception is None:
+                    self._exception = exception
+        self._slots.release()
+
+
+    def _raise_pending(self):
+        with self._lock:
+            exception, self._exception = self._exception, None
+        if exception is not None:
+            raise exception
+
+
+    def _send(self, lines):
+        """Send one batch, retrying rejected items.  lines alternates
+        action and source lines.
+
+        """
+        attempt = 0
+        while True:
+            body = b'\n'.join(lines) + b'\n'
+            started = perf_counter()
+            try:
+                response = self.es.bulk(body=body, index=self.index_name)
+            except Exception as ex:
+                if getattr(ex, 'status_code', None) != 429 or attempt >= self.max_retries:
+                    raise
+                logger.warning('bulk request rejected (429), retrying')
+                attempt = self._backoff(attempt, len(lines) // 2)
+                continue
+
+            if self.on_request is not None:
+                self.on_request(perf_counter() - started)
+            with self._lock:
+                self.requests += 1
+                self.bytes_sent += len(body)
+
+            if not response.get('errors'):
+                with self._lock:
+                    self.indexed += len(lines) // 2
+                return
+
+            retry = []
+            with self._lock:
+                for i, item in enumerate(response['items']):
+                    result = next(iter(item.values()))
+                    status = result.get('status', 500)
+                    if status < 300:
+                        self.indexed += 1
+                    elif status == 429 and attempt < self.max_retries:
+                        retry.append(i)
+                    else:
+                        self.failed += 1
+                        self._failed_ids.append(result.get('_id'))
+                        if len(self.errors) < self.max_errors:
+                            self.errors.append({'_id': result.get('_id'),
+                                                'status': status,
+                                                'error': result.get('error'),
+                                                })
+            if not retry:
+                return
+            lines = [line for i in retry for line in lines[2*i:2*i + 2]]
+            attempt = self._backoff(attempt, len(retry))
+
+
+    def _backoff(self, attempt, count):
+        with self._lock:
+            self.retries += count
+        sleep(self.backoff * 2 ** attempt)
+        return attempt + 1
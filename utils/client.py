@@ -0,0 +1,126 @@
+"""Shared, pooled OpenSearch clients.
+
+Each OpenSearch client has its own pool of HTTP connections, so a
+client built per task (or per call) starts cold every time: a new TCP
+connection for each request until the pool warms up, and nothing is
+reused between tasks.  get_client() instead keeps one client per
+process for each configuration, built the first time it's asked for.
+Celery worker processes build theirs as soon as they start (see
+tasks.py), so even the first task gets a warm client.
+
+A client is never shared across a fork; a child process which asks for
+one gets its own.
+
+The connection comes from the [elasticsearch] section of the config:
+
+  server, user, password: the cluster and the credentials for it.
+  maxsize: connections kept in the pool (default 10).  It should be at
+    least the number of threads sharing the client, or they queue up for
+    connections; get_client(threads=n) makes sure it is.
+  timeout: seconds to wait for a response (default 30).
+  http_compress: gzip request bodies (default true).  _bulk bodies are
+    repetitive JSON, which compresses several times over.
+  keep_alive: ask for persistent connections (default true).  If false,
+    each request closes its connection, for proxies which mishandle
+    idle ones.
+  max_retries, retry_on_timeout, retry_on_status: requests which fail
+    with a connection error, a timeout (if retry_on_timeout) or one of
+    the listed statuses are retried, on another connection, up to
+    max_retries times (defaults 3, true and 502,503,504).
+
+"""
+
+from configparser import ConfigParser
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from threading import Lock
+
+logger = logging.getLogger('wp_search_tools.client')
+
+SECTION = 'elasticsearch'
+
+_clients = {}
+_lock = Lock()
+
+
+def read_config(*paths):
+    """Returns a ConfigParser with $HOME/.elasticsearch.ini (which holds
+    the credentials) and then each of paths read into it.  Missing files
+    are skipped.
+
+    """
+    config = ConfigParser()
+    config.read([Path.home() / '.elasticsearch.ini', *paths])
+    return config
+
+
+def client_options(config, threads=None):
+    """Returns the keyword arguments for OpenSearch() given by config
+    (see above).  If threads is given, the pool is made at least that
+    big.
+
+    """
+    maxsize = config.getint(SECTION, 'maxsize', fallback=10)
+    if threads:
+        maxsize = max(maxsize, threads)
+    keep_alive = config.getboolean(SECTION, 'keep_alive', fallback=True)
+    retry_on_status = config.get(SECTION, 'retry_on_status', fallback='502,503,504')
+    return {'hosts': [config.get(SECTION, 'server')],
+            'http_auth': (config.get(SECTION, 'user'), config.get(SECTION, 'password')),
+            'maxsize': maxsize,
+            'timeout': config.getfloat(SECTION, 'timeout', fallback=30.0),
+            'http_compress': config.getboolean(SECTION, 'http_compress', fallback=True),
+            'headers': {'connection': 'keep-alive' if keep_alive else 'close'},
+            'max_retries': config.getint(SECTION, 'max_retries', fallback=3),
+            'retry_on_timeout': config.getboolean(SECTION, 'retry_on_timeout', fallback=True),
+            'retry_on_status': tuple(int(status) for status in retry_on_status.split(',')
+                                     if status.strip()),
+            }
+
+
+def get_client(config, threads=None):
+    """Returns this process's OpenSearch client for config, creating it
+    the first time.  It's safe to call from several threads, which can
+    all share the client.
+
+    """
+    options = client_options(config, threads)
+    pid = os.getpid()
+    # A digest, so the password isn't kept in the key for the life of
+    # the process.
+    digest = hashlib.sha256(json.dumps(options, sort_keys=True).encode('utf-8')).hexdigest()
+    key = (pid, digest)
+    with _lock:
+        es = _clients.get(key)
+        if es is None:
+            # Clients inherited from the parent process share its sockets,
+            # so they're dropped, not used (or closed).
+            for stale in [k for k in _clients if k[0] != pid]:
+                del _clients[stale]
+            es = _clients[key] = make_client(options)
+            logger.info('Created OpenSearch client for %s (pool of %d, compression %s)',
+                        options['hosts'][0], options['maxsize'],
+                        'on' if options['http_compress'] else 'off')
+    return es
+
+
+def make_client(options):
+    # Imported here, so the offline tools which share this package
+    # don't need opensearch-py.
+    from opensearchpy import OpenSearch
+    return OpenSearch(**options)
+
+
+def close_clients():
+    """Closes all of this process's clients.
+
+    """
+    with _lock:
+        pid = os.getpid()
+        for (owner, _), es in _clients.items():
+            if owner == pid:
+                es.close()
+        _clients.clear()
@@ -0,0 +1,114 @@
+import logging
+
+logger = logging.getLogger('wp_search_tools.indices')
+
+# Explicit mappings for the fields of RevisionData.  Without these,
+# dynamic mapping makes user both text and keyword (when it's only ever
+# matched exactly) and guesses types for everything else.  timestamp is
+# a date, so it can be filtered by range and bucketed by month, and title
+# a keyword, like user, so both can be aggregated on.
+MAPPINGS = {
+    'dynamic': 'strict',
+    'properties': {
+        'page_id': {'type': 'long'},
+        'rev_id': {'type': 'long'},
+        'user': {'type': 'keyword'},
+        'comment': {'type': 'text'},
+        'timestamp': {'type': 'date'},
+        'title': {'type': 'keyword'},
+        'ns': {'type': 'integer'},
+    },
+}
+
+# Fields added to MAPPINGS since the first indexes were created, which
+# create_index() adds to an existing index.
+NEW_FIELDS = ('timestamp', 'title', 'ns')
+
+# Settings used while an initial load is running: no periodic refreshes
+# (nobody is searching yet) and no replicas (so each document is only
+# written once).  The original values are put back when the load is done.
+BULK_LOAD_SETTINGS = {
+    'refresh_interval': '-1',
+    'number_of_replicas': 0,
+}
+
+
+def create_index(es, index_name, settings=None):
+    """Creates index_name with the explicit MAPPINGS, and optionally the
+    given index settings.  It is not an error if the index already
+    exists; the NEW_FIELDS are added to its mapping (an index created
+    with the strict mapping before they existed would otherwise reject
+    documents with them).  If that fails, say because an older,
+    dynamically mapped index already has one of them with another type,
+    it is logged, not raised.
+
+    """
+    body = {'mappings': MAPPINGS}
+    if settings:
+        body['settings'] = settings
+    response = es.indices.create(index_name, body=body, ignore=400)
+    if response.get('error', {}).get('type') == 'resource_already_exists_exception':
+        properties = {name: MAPPINGS['properties'][name] for name in NEW_FIELDS}
+        try:
+            es.indices.put_mapping(index=index_name, body={'properties': properties})
+        except Exception as ex:
+            logger.warning('Unable to add %s to the mapping of "%s": %s',
+                           ', '.join(NEW_FIELDS), index_name, ex)
+    return response
+
+
+class BulkLoad:
+    """Context manager which puts an index into bulk-load mode for the
+    duration of a large load:
+
+      with BulkLoad(es, index_name):
+          ... index lots of documents ...
+
+    On entry, refresh_interval and number_of_replicas are saved and set
+    to BULK_LOAD_SETTINGS.  On exit they are restored, the index is
+    refreshed, and (if max_num_segments is set) force-merged down to that
+    many segments per shard.
+
+    The settings are restored even if the load fails, but the
+    force-merge is skipped.
+
+    """
+    def __init__(self, es, index_name, max_num_segments=1):
+        self.es = es
+        self.index_name = index_name
+        self.max_num_segments = max_num_segments
+        self.saved = None
+
+
+    def __enter__(self):
+        self.begin()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end(merge=exc_type is None)
+
+
+    def begin(self):
+        response = self.es.indices.get_settings(index=self.index_name)
+        # The response is keyed by the concrete index name, which may be
+        # different from index_name if that's an alias.
+        current = next(iter(response.values()))['settings']['index']
+        # A setting which was never changed from its default is absent;
+        # it is saved as None, which resets it to the default on restore.
+        self.saved = {key: current.get(key) for key in BULK_LOAD_SETTINGS}
+        logger.info('Starting bulk load of "%s", saved settings %s', self.index_name, self.saved)
+        self.es.indices.put_settings(index=self.index_name,
+                                     body={'index': BULK_LOAD_SETTINGS})
+
+
+    def end(self, merge=True):
+        logger.info('Finishing bulk load of "%s", restoring settings %s', self.index_name, self.saved)
+        self.es.indices.put_settings(index=self.index_name,
+                                     body={'index': self.saved or {key: None for key in BULK_LOAD_SETTINGS}})
+        self.es.indices.refresh(index=self.index_name)
+        if merge and self.max_num_segments:
+            logger.info('Force-merging "%s" to %d segments', self.index_name, self.max_num_segments)
+            self.es.indices.forcemerge(index=self.index_name,
+                                       max_num_segments=self.max_num_segments,
+                                       request_timeout=3600)
@@ -0,0 +1,248 @@
+"""Optional instrumentation for finding where the time goes.
+
+StageTimer accumulates wall-clock and CPU time per named stage of a
+pipeline (reading, parsing, serializing, indexing...).  Stages may be
+nested, and each stage's time excludes the stages nested inside it, so
+the stages add up to the total.
+
+Code which is instrumented takes a timer argument defaulting to
+NULL_TIMER, whose methods do nothing (and whose iterate() and reader()
+return their argument unchanged), so instrumentation costs nothing
+unless it's turned on.
+
+SamplingProfiler is a low-overhead statistical profiler which writes
+collapsed stacks, the input format of flamegraph.pl and speedscope.
+
+"""
+
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+import logging
+import signal
+import sys
+from threading import Lock, enumerate as threads, local
+from time import perf_counter, thread_time
+
+logger = logging.getLogger('wp_search_tools.profiling')
+
+
+class StageTimer:
+    """Accumulates calls, wall time and CPU time per stage.
+
+    The timer may be shared by several threads.  Each thread has its own
+    nesting of stages, and CPU time is that of the thread which ran the
+    stage.  add() records time measured elsewhere.
+
+    """
+    enabled = True
+
+    def __init__(self):
+        self.stages = {}
+        self._local = local()
+        self._lock = Lock()
+
+
+    @property
+    def _stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+
+    def start(self, name):
+        self._stack.append([name, perf_counter(), thread_time(), 0.0, 0.0])
+
+
+    def stop(self):
+        stack = self._stack
+        name, wall, cpu, child_wall, child_cpu = stack.pop()
+        wall = perf_counter() - wall
+        cpu = thread_time() - cpu
+        self.add(name, wall - child_wall, cpu - child_cpu)
+        if stack:
+            stack[-1][3] += wall
+            stack[-1][4] += cpu
+
+
+    @contextmanager
+    def stage(self, name):
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop()
+
+
+    def add(self, name, wall, cpu=0.0):
+        with self._lock:
+            totals = self.stages.setdefault(name, [0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += wall
+            totals[2] += cpu
+
+
+    def iterate(self, iterable, name):
+        """Returns an iterator over iterable which charges the time spent
+        producing each item to name.
+
+        """
+        iterator = iter(iterable)
+        while True:
+            self.start(name)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.stop()
+            yield item
+
+
+    def reader(self, stream, name):
+        """Returns a wrapper around stream which charges the time spent in
+        its read methods to name.
+
+        """
+        return _TimedReader(stream, self, name)
+
+
+    def report(self):
+        """Returns a dict mapping each stage to its calls, wall and cpu
+        seconds.
+
+        """
+        with self._lock:
+            return {name: {'calls': calls, 'wall': round(wall, 3), 'cpu': round(cpu, 3)}
+                    for name, (calls, wall, cpu) in self.stages.items()}
+
+
+    def format(self):
+        """Returns the report as a line of text for the logs.
+
+        """
+        return ', '.join(f"{name} {s['wall']:.3f}s wall/{s['cpu']:.3f}s cpu"
+                         for name, s in sorted(self.report().items(),
+                                               key=lambda item: -item[1]['wall']))
+
+
+class NullTimer:
+    """A StageTimer which does nothing.
+
+    """
+    enabled = False
+    _context = nullcontext()
+
+    def start(self, name):
+        pass
+
+
+    def stop(self):
+        pass
+
+
+    def stage(self, name):
+        return self._context
+
+
+    def add(self, name, wall, cpu=0.0):
+        pass
+
+
+    def iterate(self, iterable, name):
+        return iterable
+
+
+    def reader(self, stream, name):
+        return stream
+
+
+    def report(self):
+        return {}
+
+
+    def format(self):
+        return ''
+
+
+NULL_TIMER = NullTimer()
+
+
+class _TimedReader:
+    def __init__(self, stream, timer, name):
+        self._stream = stream
+        self._timer = timer
+        self._name = name
+
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+    def read(self, *args):
+        with self._timer.stage(self._name):
+            return self._stream.read(*args)
+
+
+    def readinto(self, buffer):
+        with self._timer.stage(self._name):
+            return self._stream.readinto(buffer)
+
+
+    def readline(self, *args):
+        with self._timer.stage(self._name):
+            return self._stream.readline(*args)
+
+
+class SamplingProfiler:
+    """Context manager which samples the stack of every thread every
+    interval seconds of CPU time, and writes the counts in collapsed
+    stack format to path on exit:
+
+      with SamplingProfiler('run.folded'):
+          ...
+
+    The root of each stack is the name of its thread.  It uses SIGPROF,
+    so it only works on Unix, it must be started from the main thread,
+    and only one can be active at a time.
+
+    """
+    def __init__(self, path, interval=0.005):
+        if (interval <= 0):
+            raise ValueError(f'interval ({interval}) must be > 0')
+        self.path = path
+        self.interval = interval
+        self.samples = Counter()
+        self._previous = None
+
+
+    def __enter__(self):
+        self._previous = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self._previous)
+        self.write()
+
+
+    def _sample(self, signum, frame):
+        names = {thread.ident: thread.name for thread in threads()}
+        for ident, frame in sys._current_frames().items():
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({code.co_filename}:{code.co_firstlineno})')
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            self.samples[';'.join(reversed(stack))] += 1
+
+
+    def write(self):
+        with open(self.path, 'w') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f'{stack} {count}\n')
+        logger.info('Wrote %d profile samples to "%s"', sum(self.samples.values()), self.path)
@@ -1,4 +1,9 @@
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
 from logging import DEBUG, INFO, WARNING, ERROR, CRITICAL
+import math
+from threading import Lock, Thread
 from time import time
 
 class ProgressMonitor:
@@ -51,3 +56,170 @@ class ProgressMonitor:
         if time_now >= self.next_log_time:
             self.next_log_time = time_now + self.delay
             return self.logger.log(level, msg, *args, **kwargs)
+
+
+class RateMonitor:
+    """Keep counters for a long-running job, and work out rolling rates
+    and an ETA from them.
+
+    The counters are absolute values (pages parsed so far, compressed
+    bytes read so far, ...) which are passed to sample() from time to
+    time; rates are computed over the samples from the last window
+    seconds.  Call due() as often as convenient (it's cheap) and
+    sample() when it returns true.
+
+    totals: a dict giving the final value of some of the counters, for
+    instance {'bytes': file_size}.  The first of them which has a value
+    is used for both percent and eta_seconds (which is None until its
+    rate is non-zero), so they don't switch between counters.
+
+    resolution: the minimum number of seconds between samples.
+
+    Latencies (e.g. of each bulk request) are recorded with observe(),
+    which is safe to call from any thread.
+
+    """
+    def __init__(self, totals=None, window=60.0, resolution=1.0, clock=time):
+        if (window <= 0):
+            raise ValueError(f'window ({window}) must be > 0')
+        if (resolution < 0):
+            raise ValueError(f'resolution ({resolution}) must be >= 0')
+        self.totals = dict(totals or {})
+        self.window = window
+        self.resolution = resolution
+        self.clock = clock
+        self.start = clock()
+        self.counters = {}
+        self._samples = deque([(self.start, {})])
+        self._latencies = {}
+        self._next_sample_time = self.start + resolution
+        self._lock = Lock()
+
+
+    def due(self):
+        """Returns true if at least resolution seconds have passed since
+        the last sample.
+
+        """
+        return self.clock() >= self._next_sample_time
+
+
+    def sample(self, **counters):
+        """Update the named counters and record a sample of all of them.
+        A counter given as None is left unchanged.
+
+        """
+        now = self.clock()
+        with self._lock:
+            self.counters.update((k, v) for k, v in counters.items() if v is not None)
+            self._samples.append((now, dict(self.counters)))
+            # Keep one sample from before the window, so the rates
+            # always cover the whole of it.
+            while len(self._samples) > 2 and self._samples[1][0] <= now - self.window:
+                self._samples.popleft()
+            self._next_sample_time = now + self.resolution
+
+
+    def observe(self, name, seconds):
+        """Record one latency measurement for name.
+
+        """
+        now = self.clock()
+        with self._lock:
+            values = self._latencies.setdefault(name, deque())
+            values.append((now, seconds))
+            while values[0][0] <= now - self.window:
+                values.popleft()
+
+
+    def rates(self):
+        """Returns a dict of the per-second rate of each counter over the
+        window.
+
+        """
+        with self._lock:
+            (t0, first), (t1, last) = self._samples[0], self._samples[-1]
+        dt = t1 - t0
+        return {name: (value - first.get(name, 0)) / dt if dt > 0 else 0.0
+                for name, value in last.items()}
+
+
+    def snapshot(self):
+        """Returns a JSON-serializable dict of the counters, their rates
+        (as <name>_per_second), latency summaries (count, mean, p95 and
+        max over the window), percent done and eta_seconds.
+
+        """
+        rates = self.rates()
+        with self._lock:
+            counters = dict(self.counters)
+            latencies = {name: sorted(s for _, s in values)
+                         for name, values in self._latencies.items()}
+        snapshot = {'elapsed': round(self.clock() - self.start, 3)}
+        snapshot.update(counters)
+        for name, rate in rates.items():
+            snapshot[f'{name}_per_second'] = round(rate, 1)
+        for name, values in latencies.items():
+            snapshot[name] = {'count': len(values),
+                              'mean': round(sum(values) / len(values), 4) if values else None,
+                              'p95': round(values[max(0, math.ceil(0.95 * len(values)) - 1)], 4) if values else None,
+                              'max': round(values[-1], 4) if values else None,
+                              }
+        snapshot['percent'] = None
+        snapshot['eta_seconds'] = None
+        for name, total in self.totals.items():
+            if counters.get(name) is None or not total:
+                continue
+            snapshot['percent'] = round(100.0 * counters[name] / total, 1)
+            if rates.get(name, 0) > 0:
+                snapshot['eta_seconds'] = round(max(total - counters[name], 0) / rates[name], 1)
+            break
+        return snapshot
+
+
+    def prometheus(self, prefix='wp_search_tools'):
+        """Returns the snapshot in the Prometheus text exposition format.
+
+        """
+        lines = []
+        for name, value in self.snapshot().items():
+            if isinstance(value, dict):
+                for stat, v in value.items():
+                    if v is not None:
+                        lines.append(f'{prefix}_{name}_seconds{{stat="{stat}"}} {v}')
+            elif value is not None:
+                lines.append(f'{prefix}_{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+    def serve(self, port, host='127.0.0.1'):
+        """Start an HTTP server in a background thread which returns
+        prometheus() at /metrics and the snapshot as JSON anywhere else.
+        port 0 picks a free port.
+
+        Returns the server; call its shutdown() and server_close() methods
+        to stop it.
+
+        """
+        monitor = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body = monitor.prometheus().encode('utf-8')
+                    content_type = 'text/plain; version=0.0.4'
+                else:
+                    body = json.dumps(monitor.snapshot()).encode('utf-8')
+                    content_type = 'application/json'
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        Thread(target=server.serve_forever, daemon=True).start()
+        return server
@@ -0,0 +1,170 @@
+from unittest import TestCase
+from unittest.mock import Mock, call
+from bulk import BulkIndexer, serialize
+
+
+def ok_response(body):
+    n = body.count(b'\n') // 2
+    return {'errors': False, 'items': [{'index': {'status': 201}}] * n}
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class BulkIndexerTest(TestCase):
+
+    def test_construct(self):
+        es = Mock()
+        BulkIndexer(es, 'index')
+
+
+    def test_batch_docs_must_be_a_positive_integer(self):
+        with self.assertRaisesRegex(ValueError, 'positive integer'):
+            BulkIndexer(Mock(), 'index', batch_docs=0)
+
+
+    def test_nothing_is_sent_before_batch_is_full(self):
+        es = Mock()
+        bi = BulkIndexer(es, 'index', batch_docs=3)
+        bi.add({'a': 1})
+        bi.add({'a': 2})
+        es.bulk.assert_not_called()
+
+
+    def test_batch_is_sent_when_full(self):
+        es = Mock()
+        es.bulk.side_effect = lambda body, index: ok_response(body)
+        bi = BulkIndexer(es, 'index', batch_docs=2)
+        bi.add({'a': 1})
+        bi.add({'a': 2}, doc_id=7)
+        es.bulk.assert_called_once_with(
+            body=b'{"index":{}}\n{"a":1}\n{"index":{"_id":"7"}}\n{"a":2}\n',
+            index='index')
+        self.assertEqual(bi.indexed, 2)
+
+
+    def test_add_sends_what_serialize_returns(self):
+        es = Mock()
+        es.bulk.side_effect = lambda body, index: ok_response(body)
+        doc = {'comment': 'Zoë', 'n': 1}
+        self.assertEqual(serialize(doc), '{"comment":"Zoë","n":1}'.encode('utf-8'))
+        with BulkIndexer(es, 'index') as bi:
+            bi.add(doc, doc_id=1)
+        self.assertEqual(es.bulk.call_args.kwargs['body'].splitlines()[1], serialize(doc))
+
+
+    def test_batch_is_sent_when_byte_limit_is_reached(self):
+        es = Mock()
+        es.bulk.side_effect = lambda body, index: ok_response(body)
+        bi = BulkIndexer(es, 'index', batch_docs=1000, batch_bytes=30)
+        bi.add({'comment': 'x' * 20})
+        es.bulk.assert_called_once()
+
+
+    def test_close_sends_partial_batch_and_returns_stats(self):
+        es = Mock()
+        es.bulk.side_effect = lambda body, index: ok_response(body)
+        with BulkIndexer(es, 'index', batch_docs=10) as bi:
+            bi.add({'a': 1})
+        stats = bi.stats()
+        self.assertEqual(stats['indexed'], 1)
+        self.assertEqual(stats['failed'], 0)
+        self.assertEqual(stats['requests'], 1)
+
+
+    def test_raw_documents_are_not_re_encoded(self):
+        es = Mock()
+        es.bulk.side_effect = lambda body, index: ok_response(body)
+        bi = BulkIndexer(es, 'index')
+        bi.add_raw(b'{"b": 2,  "a": 1}')
+        bi.close()
+        es.bulk.assert_called_once_with(body=b'{"index":{}}\n{"b": 2,  "a": 1}\n', index='index')
+
+
+    def test_failed_items_are_reported(self):
+        es = Mock()
+        es.bulk.return_value = {
+            'errors': True,
+            'items': [{'index': {'status': 201}},
+                      {'index': {'_id': 'x', 'status': 400, 'error': {'type': 'mapper_parsing_exception'}}},
+                      ]}
+        bi = BulkIndexer(es, 'index')
+        bi.add({'a': 1})
+        bi.add({'a': 'bad'})
+        stats = bi.close()
+        self.assertEqual(stats['indexed'], 1)
+        self.assertEqual(stats['failed'], 1)
+        self.assertEqual(stats['errors'],
+                         [{'_id': 'x', 'status': 400, 'error': {'type': 'mapper_parsing_exception'}}])
+        self.assertEqual(bi.take_failed(), ['x'])
+        self.assertEqual(bi.take_failed(), [])
+
+
+    def test_rejected_items_are_retried(self):
+        es = Mock()
+        es.bulk.side_effect = [
+            {'errors': True,
+             'items': [{'index': {'status': 201}}, {'index': {'status': 429}}]},
+            {'errors': False,
+             'items': [{'index': {'status': 201}}]},
+        ]
+        bi = BulkIndexer(es, 'index', backoff=0)
+        bi.add({'a': 1})
+        bi.add({'a': 2})
+        stats = bi.close()
+        self.assertEqual(es.bulk.call_args_list[1],
+                         call(body=b'{"index":{}}\n{"a":2}\n', index='index'))
+        self.assertEqual(stats['indexed'], 2)
+        self.assertEqual(stats['retries'], 1)
+
+
+    def test_rejected_request_is_retried(self):
+        es = Mock()
+        es.bulk.side_effect = [StatusError(429), ok_response(b'x\ny\n')]
+        bi = BulkIndexer(es, 'index', backoff=0)
+        bi.add({'a': 1})
+        stats = bi.close()
+        self.assertEqual(es.bulk.call_count, 2)
+        self.assertEqual(stats['indexed'], 1)
+
+
+    def test_other_request_errors_are_raised(self):
+        es = Mock()
+        es.bulk.side_effect = StatusError(500)
+        bi = BulkIndexer(es, 'index')
+        bi.add({'a': 1})
+        with self.assertRaises(StatusError):
+            bi.close()
+
+
+    def test_concurrent_requests_are_all_sent(self):
+        es = Mock()
+        es.bulk.side_effect = lambda body, index: ok_response(body)
+        bi = BulkIndexer(es, 'index', batch_docs=2, concurrency=4)
+        for i in range(101):
+            bi.add({'a': i})
+        stats = bi.close()
+        self.assertEqual(stats['indexed'], 101)
+        self.assertEqual(es.bulk.call_count, 51)
+
+
+    def test_errors_in_concurrent_requests_are_raised(self):
+        es = Mock()
+        es.bulk.side_effect = StatusError(500)
+        bi = BulkIndexer(es, 'index', batch_docs=1, concurrency=2)
+        bi.add({'a': 1})
+        with self.assertRaises(StatusError):
+            bi.close()
+
+
+    def test_on_request_is_called_with_duration(self):
+        es = Mock()
+        es.bulk.side_effect = lambda body, index: ok_response(body)
+        on_request = Mock()
+        with BulkIndexer(es, 'index', batch_docs=1, on_request=on_request) as bi:
+            bi.add({'a': 1})
+            bi.add({'a': 2})
+        self.assertEqual(on_request.call_count, 2)
+        self.assertGreaterEqual(on_request.call_args[0][0], 0.0)
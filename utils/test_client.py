@@ -0,0 +1,111 @@
+from configparser import ConfigParser
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from threading import Thread
+from unittest import TestCase
+from unittest.mock import Mock, patch
+import client
+from client import client_options, close_clients, get_client, read_config
+
+
+def make_config(**options):
+    config = ConfigParser()
+    config.read_dict({'elasticsearch': {'server': 'localhost:9200',
+                                        'user': 'user',
+                                        'password': 'secret',
+                                        **options}})
+    return config
+
+
+class ClientOptionsTest(TestCase):
+
+    def test_defaults(self):
+        options = client_options(make_config())
+        self.assertEqual(options['hosts'], ['localhost:9200'])
+        self.assertEqual(options['http_auth'], ('user', 'secret'))
+        self.assertEqual(options['maxsize'], 10)
+        self.assertTrue(options['http_compress'])
+        self.assertEqual(options['headers'], {'connection': 'keep-alive'})
+        self.assertEqual(options['max_retries'], 3)
+        self.assertTrue(options['retry_on_timeout'])
+        self.assertEqual(options['retry_on_status'], (502, 503, 504))
+
+
+    def test_config_overrides_defaults(self):
+        options = client_options(make_config(maxsize='4', http_compress='false',
+                                             keep_alive='false', max_retries='0',
+                                             retry_on_status='429, 503'))
+        self.assertEqual(options['maxsize'], 4)
+        self.assertFalse(options['http_compress'])
+        self.assertEqual(options['headers'], {'connection': 'close'})
+        self.assertEqual(options['max_retries'], 0)
+        self.assertEqual(options['retry_on_status'], (429, 503))
+
+
+    def test_pool_is_at_least_as_big_as_threads(self):
+        self.assertEqual(client_options(make_config(), threads=32)['maxsize'], 32)
+        self.assertEqual(client_options(make_config(), threads=2)['maxsize'], 10)
+
+
+    def test_read_config_reads_files_in_order(self):
+        with TemporaryDirectory() as tmp_dir:
+            first = os.path.join(tmp_dir, 'first.ini')
+            second = os.path.join(tmp_dir, 'second.ini')
+            with open(first, 'w') as f:
+                f.write('[elasticsearch]\nindex = one\nserver = s\n')
+            with open(second, 'w') as f:
+                f.write('[elasticsearch]\nindex = two\n')
+            with patch('client.Path.home', return_value=Path(tmp_dir)):
+                config = read_config(first, second, os.path.join(tmp_dir, 'missing.ini'))
+        self.assertEqual(config.get('elasticsearch', 'index'), 'two')
+        self.assertEqual(config.get('elasticsearch', 'server'), 's')
+
+
+class GetClientTest(TestCase):
+
+    def setUp(self):
+        patcher = patch('client.make_client', side_effect=lambda options: Mock(options=options))
+        self.make_client = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(close_clients)
+
+
+    def test_one_client_per_process(self):
+        config = make_config()
+        clients = []
+        threads = [Thread(target=lambda: clients.append(get_client(config))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len({id(es) for es in clients}), 1)
+        self.make_client.assert_called_once()
+
+
+    def test_different_options_get_different_clients(self):
+        config = make_config()
+        self.assertIsNot(get_client(config), get_client(config, threads=32))
+        self.assertIs(get_client(config, threads=32), get_client(config, threads=32))
+
+
+    def test_password_is_not_kept_in_cache_keys(self):
+        get_client(make_config())
+        self.assertTrue(client._clients)
+        self.assertNotIn('secret', repr(list(client._clients)))
+
+
+    def test_clients_are_not_shared_across_fork(self):
+        config = make_config()
+        es = get_client(config)
+        with patch('client.os.getpid', return_value=os.getpid() + 1):
+            child = get_client(config)
+        self.assertIsNot(child, es)
+        es.close.assert_not_called()
+
+
+    def test_close_clients(self):
+        es = get_client(make_config())
+        close_clients()
+        es.close.assert_called_once_with()
+        self.assertIsNot(get_client(make_config()), es)
@@ -0,0 +1,104 @@
+from unittest import TestCase
+from unittest.mock import Mock, call
+from indices import BULK_LOAD_SETTINGS, MAPPINGS, BulkLoad, create_index
+
+EXISTS = {'error': {'type': 'resource_already_exists_exception'}, 'status': 400}
+
+
+def mock_es(index_settings):
+    es = Mock()
+    es.indices.get_settings.return_value = {
+        'concrete-index': {'settings': {'index': index_settings}}}
+    return es
+
+
+class CreateIndexTest(TestCase):
+
+    def test_index_is_created_with_mappings(self):
+        es = Mock()
+        create_index(es, 'index')
+        es.indices.create.assert_called_once_with('index', body={'mappings': MAPPINGS}, ignore=400)
+
+
+    def test_settings_are_passed_through(self):
+        es = Mock()
+        create_index(es, 'index', settings={'number_of_shards': 4})
+        es.indices.create.assert_called_once_with(
+            'index', body={'mappings': MAPPINGS, 'settings': {'number_of_shards': 4}}, ignore=400)
+
+
+    def test_user_is_a_keyword(self):
+        self.assertEqual(MAPPINGS['properties']['user'], {'type': 'keyword'})
+
+
+    def test_new_index_is_not_remapped(self):
+        es = Mock()
+        es.indices.create.return_value = {'acknowledged': True}
+        create_index(es, 'index')
+        es.indices.put_mapping.assert_not_called()
+
+
+    def test_existing_index_gets_only_new_fields(self):
+        es = Mock()
+        es.indices.create.return_value = EXISTS
+        self.assertEqual(create_index(es, 'index'), EXISTS)
+        es.indices.put_mapping.assert_called_once_with(
+            index='index', body={'properties': {'timestamp': {'type': 'date'},
+                                                'title': {'type': 'keyword'},
+                                                'ns': {'type': 'integer'}}})
+
+
+    def test_mapping_conflict_is_logged_not_raised(self):
+        es = Mock()
+        es.indices.create.return_value = EXISTS
+        es.indices.put_mapping.side_effect = Exception('illegal_argument_exception: mapper [title] '
+                                                       'cannot be changed from type [text] to [keyword]')
+        with self.assertLogs('wp_search_tools.indices', 'WARNING') as logs:
+            create_index(es, 'index')
+        self.assertIn('mapper [title]', logs.output[0])
+
+
+    def test_timestamp_title_and_ns_can_be_aggregated(self):
+        properties = MAPPINGS['properties']
+        self.assertEqual(properties['timestamp'], {'type': 'date'})
+        self.assertEqual(properties['title'], {'type': 'keyword'})
+        self.assertEqual(properties['ns'], {'type': 'integer'})
+
+
+class BulkLoadTest(TestCase):
+
+    def test_bulk_load_settings_are_applied_on_entry(self):
+        es = mock_es({'refresh_interval': '30s', 'number_of_replicas': '2'})
+        with BulkLoad(es, 'index'):
+            es.indices.put_settings.assert_called_once_with(
+                index='index', body={'index': BULK_LOAD_SETTINGS})
+
+
+    def test_settings_are_restored_and_index_merged_on_exit(self):
+        es = mock_es({'refresh_interval': '30s', 'number_of_replicas': '2'})
+        with BulkLoad(es, 'index'):
+            pass
+        self.assertEqual(es.indices.put_settings.call_args_list[-1],
+                         call(index='index',
+                              body={'index': {'refresh_interval': '30s', 'number_of_replicas': '2'}}))
+        es.indices.refresh.assert_called_once_with(index='index')
+        es.indices.forcemerge.assert_called_once_with(index='index', max_num_segments=1,
+                                                      request_timeout=3600)
+
+
+    def test_default_settings_are_restored_as_none(self):
+        es = mock_es({'number_of_replicas': '1'})
+        with BulkLoad(es, 'index'):
+            pass
+        self.assertEqual(es.indices.put_settings.call_args_list[-1],
+                         call(index='index',
+                              body={'index': {'refresh_interval': None, 'number_of_replicas': '1'}}))
+
+
+    def test_failed_load_restores_settings_without_merging(self):
+        es = mock_es({'refresh_interval': '1s', 'number_of_replicas': '1'})
+        with self.assertRaises(RuntimeError):
+            with BulkLoad(es, 'index'):
+                raise RuntimeError()
+        self.assertEqual(es.indices.put_settings.call_count, 2)
+        es.indices.forcemerge.assert_not_called()
@@ -0,0 +1,139 @@
+from io import StringIO
+import os
+from tempfile import TemporaryDirectory
+from threading import Thread
+from time import perf_counter
+from unittest import TestCase
+from profiling import NULL_TIMER, SamplingProfiler, StageTimer
+
+
+def spin(seconds):
+    end = perf_counter() + seconds
+    while perf_counter() < end:
+        pass
+
+
+class StageTimerTest(TestCase):
+
+    def test_stage_counts_calls_and_time(self):
+        timer = StageTimer()
+        for _ in range(3):
+            with timer.stage('a'):
+                spin(0.01)
+        report = timer.report()
+        self.assertEqual(report['a']['calls'], 3)
+        self.assertGreaterEqual(report['a']['wall'], 0.03)
+        self.assertGreater(report['a']['cpu'], 0.0)
+
+
+    def test_nested_stages_are_excluded_from_outer(self):
+        timer = StageTimer()
+        with timer.stage('outer'):
+            with timer.stage('inner'):
+                spin(0.05)
+        report = timer.report()
+        self.assertGreaterEqual(report['inner']['wall'], 0.05)
+        self.assertLess(report['outer']['wall'], 0.05)
+
+
+    def test_iterate_charges_producer_not_consumer(self):
+        timer = StageTimer()
+
+        def produce():
+            for i in range(2):
+                spin(0.02)
+                yield i
+
+        items = []
+        for item in timer.iterate(produce(), 'produce'):
+            spin(0.05)
+            items.append(item)
+        self.assertEqual(items, [0, 1])
+        report = timer.report()
+        self.assertEqual(report['produce']['calls'], 3)
+        self.assertGreaterEqual(report['produce']['wall'], 0.04)
+        self.assertLess(report['produce']['wall'], 0.1)
+
+
+    def test_iterate_stops_stage_on_exception(self):
+        timer = StageTimer()
+
+        def produce():
+            yield 1
+            raise KeyError('x')
+
+        with self.assertRaises(KeyError):
+            list(timer.iterate(produce(), 'produce'))
+        self.assertEqual(timer.report()['produce']['calls'], 2)
+        with timer.stage('after'):
+            pass
+        self.assertIn('after', timer.report())
+
+
+    def test_reader_times_reads_and_passes_other_attributes(self):
+        timer = StageTimer()
+        stream = StringIO('abcdef')
+        reader = timer.reader(stream, 'read')
+        self.assertEqual(reader.read(3), 'abc')
+        self.assertEqual(reader.read(), 'def')
+        self.assertEqual(reader.tell(), 6)
+        self.assertEqual(timer.report()['read']['calls'], 2)
+
+
+    def test_add_records_external_time(self):
+        timer = StageTimer()
+        timer.add('request', 0.5)
+        timer.add('request', 0.25)
+        self.assertEqual(timer.report(), {'request': {'calls': 2, 'wall': 0.75, 'cpu': 0.0}})
+        self.assertEqual(timer.format(), 'request 0.750s wall/0.000s cpu')
+
+
+    def test_threads_nest_stages_independently(self):
+        timer = StageTimer()
+
+        def other():
+            with timer.stage('other'):
+                spin(0.02)
+
+        with timer.stage('main'):
+            thread = Thread(target=other)
+            thread.start()
+            thread.join()
+        report = timer.report()
+        self.assertEqual(report['other']['calls'], 1)
+        # Time spent in another thread isn't nested in this one's stage.
+        self.assertGreaterEqual(report['main']['wall'], 0.02)
+
+
+class NullTimerTest(TestCase):
+
+    def test_does_nothing(self):
+        stream = StringIO('abc')
+        items = [1, 2]
+        self.assertFalse(NULL_TIMER.enabled)
+        self.assertIs(NULL_TIMER.reader(stream, 'read'), stream)
+        self.assertIs(NULL_TIMER.iterate(items, 'parse'), items)
+        with NULL_TIMER.stage('a'):
+            NULL_TIMER.add('b', 1.0)
+        self.assertEqual(NULL_TIMER.report(), {})
+
+
+class SamplingProfilerTest(TestCase):
+
+    def test_interval_must_be_positive(self):
+        with self.assertRaisesRegex(ValueError, 'must be > 0'):
+            SamplingProfiler('x', interval=0)
+
+
+    def test_writes_collapsed_stacks(self):
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'profile.folded')
+            with SamplingProfiler(path, interval=0.001) as profiler:
+                spin(0.2)
+            self.assertTrue(profiler.samples)
+            with open(path) as f:
+                lines = f.read().splitlines()
+        self.assertTrue(any('spin' in line for line in lines))
+        for line in lines:
+            stack, count = line.rsplit(' ', 1)
+            self.assertGreater(int(count), 0)
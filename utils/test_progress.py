@@ -1,7 +1,9 @@
+import json
 from logging import DEBUG, INFO, WARNING, ERROR, CRITICAL
 from unittest import TestCase
 from unittest.mock import Mock, call, patch
-from progress import ProgressMonitor
+from urllib.request import urlopen
+from progress import ProgressMonitor, RateMonitor
 
 class ProgressMonitorTest(TestCase):
 
@@ -76,3 +78,141 @@ class ProgressMonitorTest(TestCase):
             pl.info('1')
             pl.info('2')
             logger.log.assert_has_calls([call(INFO, '2')])
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class RateMonitorTest(TestCase):
+
+    def test_window_must_be_positive(self):
+        with self.assertRaisesRegex(ValueError, 'must be > 0'):
+            RateMonitor(window=0)
+
+
+    def test_due_after_resolution(self):
+        clock = Clock()
+        rm = RateMonitor(resolution=1.0, clock=clock)
+        self.assertFalse(rm.due())
+        clock.now = 1.0
+        self.assertTrue(rm.due())
+        rm.sample(pages=1)
+        self.assertFalse(rm.due())
+
+
+    def test_rates_are_computed_over_window(self):
+        clock = Clock()
+        rm = RateMonitor(window=10.0, clock=clock)
+        for t in range(1, 31):
+            clock.now = float(t)
+            # Fast for the first 20 seconds, then slower.
+            rm.sample(pages=t * 10 if t <= 20 else 200 + (t - 20))
+        self.assertEqual(rm.rates()['pages'], 1.0)
+
+
+    def test_none_leaves_counter_unchanged(self):
+        clock = Clock()
+        rm = RateMonitor(clock=clock)
+        rm.sample(bytes=100)
+        rm.sample(bytes=None)
+        self.assertEqual(rm.counters['bytes'], 100)
+
+
+    def test_snapshot_includes_eta_from_totals(self):
+        clock = Clock()
+        rm = RateMonitor(totals={'bytes': 1000}, clock=clock)
+        clock.now = 10.0
+        rm.sample(bytes=250, pages=5)
+        snapshot = rm.snapshot()
+        self.assertEqual(snapshot['bytes_per_second'], 25.0)
+        self.assertEqual(snapshot['pages_per_second'], 0.5)
+        self.assertEqual(snapshot['percent'], 25.0)
+        self.assertEqual(snapshot['eta_seconds'], 30.0)
+
+
+    def test_percent_and_eta_come_from_the_same_total(self):
+        clock = Clock()
+        rm = RateMonitor(totals={'bytes': 1000, 'pages': 20}, clock=clock)
+        rm.sample(bytes=0, pages=0)
+        clock.now = 10.0
+        # bytes haven't moved yet, so there's no ETA, but pages isn't used.
+        rm.sample(bytes=0, pages=5)
+        snapshot = rm.snapshot()
+        self.assertEqual(snapshot['percent'], 0.0)
+        self.assertIsNone(snapshot['eta_seconds'])
+        clock.now = 20.0
+        rm.sample(bytes=500, pages=6)
+        snapshot = rm.snapshot()
+        self.assertEqual(snapshot['percent'], 50.0)
+        self.assertEqual(snapshot['eta_seconds'], 20.0)
+
+
+    def test_snapshot_without_totals_has_no_eta(self):
+        rm = RateMonitor()
+        rm.sample(pages=5)
+        snapshot = rm.snapshot()
+        self.assertIsNone(snapshot['percent'])
+        self.assertIsNone(snapshot['eta_seconds'])
+
+
+    def test_latencies_are_summarized(self):
+        clock = Clock()
+        rm = RateMonitor(clock=clock)
+        for i in range(1, 21):
+            rm.observe('index_latency', i / 10)
+        latency = rm.snapshot()['index_latency']
+        self.assertEqual(latency['count'], 20)
+        self.assertEqual(latency['mean'], 1.05)
+        self.assertEqual(latency['p95'], 1.9)
+        self.assertEqual(latency['max'], 2.0)
+
+
+    def test_p95_is_the_nearest_rank(self):
+        rm = RateMonitor(clock=Clock())
+        for i in range(1, 11):
+            rm.observe('index_latency', i / 10)
+        self.assertEqual(rm.snapshot()['index_latency']['p95'], 1.0)
+        rm = RateMonitor(clock=Clock())
+        rm.observe('index_latency', 0.5)
+        self.assertEqual(rm.snapshot()['index_latency']['p95'], 0.5)
+
+
+    def test_old_latencies_are_dropped(self):
+        clock = Clock()
+        rm = RateMonitor(window=10.0, clock=clock)
+        rm.observe('index_latency', 5.0)
+        clock.now = 20.0
+        rm.observe('index_latency', 1.0)
+        self.assertEqual(rm.snapshot()['index_latency']['max'], 1.0)
+
+
+    def test_prometheus_format(self):
+        clock = Clock()
+        rm = RateMonitor(clock=clock)
+        clock.now = 2.0
+        rm.sample(pages=4)
+        rm.observe('index_latency', 0.5)
+        text = rm.prometheus()
+        self.assertIn('wp_search_tools_pages 4\n', text)
+        self.assertIn('wp_search_tools_pages_per_second 2.0\n', text)
+        self.assertIn('wp_search_tools_index_latency_seconds{stat="max"} 0.5\n', text)
+
+
+    def test_serve_metrics_and_json(self):
+        rm = RateMonitor()
+        rm.sample(pages=3)
+        server = rm.serve(0)
+        try:
+            url = f'http://127.0.0.1:{server.server_address[1]}'
+            with urlopen(url + '/metrics') as response:
+                self.assertIn(b'wp_search_tools_pages 3', response.read())
+            with urlopen(url + '/') as response:
+                self.assertEqual(json.load(response)['pages'], 3)
+        finally:
+            server.shutdown()
+            server.server_close()